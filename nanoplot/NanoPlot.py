@@ -9,35 +9,40 @@ Input data can be given as one or multiple of:
  additional information added by albacore or MinKNOW
 -a bam file
 -a summary file generated by albacore
+-a feather file stored earlier using --store
 '''
 
 
 from argparse import ArgumentParser
 from os import path
 import logging
-import nanomath
-import numpy as np
-from scipy import stats
 import nanoplot.utils as utils
-from nanoget import get_input
-from nanoplot.filteroptions import filter_and_transform_data
+import nanoplot.metrics as metrics
+from nanoplot.scheduler import PlotJob, run_plot_jobs, \
+    workers_within_budget, estimate_plot_memory
 from .version import __version__
-import nanoplotter
-import pickle
 import sys
 
+# Modules with heavy dependencies (matplotlib, pandas, pysam...) are imported in the
+# functions using them, such that e.g. --help and --version start fast and only the
+# reader of the chosen input source is loaded.
+
 
 def main():
+    run(get_args())
+
+
+def run(args):
     '''
     Organization function
     -setups logging
     -gets inputdata
     -calls plotting function
     '''
-    args = get_args()
     try:
         utils.make_output_dir(args.outdir)
         utils.init_logs(args)
+        import nanoplotter
         args.format = nanoplotter.check_valid_format(args.format)
         settings = vars(args)
         settings["path"] = path.join(args.outdir, args.prefix)
@@ -52,46 +57,19 @@ def main():
             "ubam": args.ubam,
         }
 
-        if args.pickle:
-            datadf = pickle.load(open(args.pickle, 'rb'))
-        else:
-            datadf = get_input(
-                source=[n for n, s in sources.items() if s][0],
-                files=[f for f in sources.values() if f][0],
-                threads=args.threads,
-                readtype=args.readtype,
-                combine="simple",
-                barcoded=args.barcoded)
-        if args.store:
-            pickle.dump(
-                obj=datadf,
-                file=open(settings["path"] + "NanoPlot-data.pickle", 'wb'))
-        if args.raw:
-            datadf.to_csv("NanoPlot-data.tsv.gz", sep="\t", index=False, compression="gzip")
-
-        settings["statsfile"] = [make_stats(datadf, settings, suffix="")]
-        datadf, settings = filter_and_transform_data(datadf, settings)
-        if settings["filtered"]:  # Bool set when filter was applied in filter_and_transform_data()
-            settings["statsfile"].append(make_stats(datadf, settings, suffix="_post_filtering"))
-
-        if args.barcoded:
-            barcodes = list(datadf["barcode"].unique())
-            plots = []
-            for barc in barcodes:
-                logging.info("Processing {}".format(barc))
-                settings["path"] = path.join(args.outdir, args.prefix + barc + "_")
-                dfbarc = datadf[datadf["barcode"] == barc]
-                if len(dfbarc) > 5:
-                    settings["title"] = barc
-                    plots.extend(
-                        make_plots(dfbarc, settings)
-                    )
-                else:
-                    sys.stderr.write("Found barcode {} less than 5x, ignoring...\n".format(barc))
-                    logging.info("Found barcode {} less than 5 times, ignoring".format(barc))
+        profiler = metrics.start_profiler() if args.profile else None
+        if args.watch:
+            watch_summary(settings)
+        elif args.stream:
+            stream_summary(settings)
         else:
-            plots = make_plots(datadf, settings)
-        make_report(plots, settings)
+            with metrics.stage("ingestion") as stage:
+                datadf = load_data(settings, sources)
+                stage["rows"] = len(datadf)
+            process_data(datadf, settings)
+        if profiler:
+            metrics.stop_profiler(profiler, settings["path"] + "NanoPlot-profile.prof")
+        metrics.write_metrics(settings["path"] + "NanoPlot-metrics.json", settings)
         logging.info("Finished!")
     except Exception as e:
         logging.error(e, exc_info=True)
@@ -103,7 +81,106 @@ def main():
         raise
 
 
-def get_args():
+def load_data(settings, sources):
+    '''
+    Return a DataFrame of the input data, from a pickle or feather file, the cache,
+    or extracted from the files of the source given in sources
+    Extracted data is cached and optionally stored to a feather or tsv file
+    '''
+    import nanoplot.store as store
+    from nanoplot.schema import compact
+    if settings["pickle"]:
+        import pickle
+        datadf = compact(pickle.load(open(settings["pickle"], 'rb')))
+        metadata = store.make_metadata("pickle", [settings["pickle"]])
+    elif settings["feather"]:
+        datadf = compact(
+            store.read_store(settings["feather"], columns=store.needed_columns(settings)))
+        metadata = store.read_metadata(settings["feather"])
+    else:
+        source = [n for n, s in sources.items() if s][0]
+        files = [f for f in sources.values() if f][0]
+        import nanoplot.cache as cache
+        metadata = store.make_metadata(source, files)
+        key = None if settings["no_cache"] else cache.cache_key(source, files, settings)
+        settings["cache_dir"] = settings["cache_dir"] or cache.default_cache_dir()
+        datadf = key and cache.fetch(settings["cache_dir"], key, store.needed_columns(settings))
+        if datadf is None:
+            if source in ["bam", "cram"]:
+                from nanoplot.alignments import extract_alignments
+                datadf = extract_alignments(files, source=source, threads=settings["threads"])
+            elif source == "summary":
+                from nanoplot.summary import read_summary
+                datadf = read_summary(files,
+                                      readtype=settings["readtype"],
+                                      barcoded=settings["barcoded"],
+                                      identifiers=True,
+                                      threads=settings["threads"])
+            elif source in ["fastq", "fasta", "fastq_minimal"]:
+                from nanoplot.fastx import extract_sequences
+                datadf = extract_sequences(files, source=source, threads=settings["threads"])
+            else:
+                from nanoget import get_input
+                datadf = get_input(
+                    source=source,
+                    files=files,
+                    threads=settings["threads"],
+                    readtype=settings["readtype"],
+                    combine="simple",
+                    barcoded=settings["barcoded"])
+            datadf = compact(datadf)
+            if key:
+                cache.save(datadf, settings["cache_dir"], key, metadata,
+                           max_size=settings["cache_size"] * 1e9)
+    if settings["store"]:
+        store.write_store(
+            df=datadf,
+            filename=settings["path"] + "NanoPlot-data.feather",
+            metadata=metadata)
+    if settings["raw"]:
+        datadf.to_csv("NanoPlot-data.tsv.gz", sep="\t", index=False, compression="gzip")
+    return datadf
+
+
+def process_data(datadf, settings):
+    '''
+    Create the stats, plots and report of a DataFrame, after filtering and transformation
+    '''
+    from nanoplot.filteroptions import filter_and_transform_data
+    from nanoplot.grouping import BarcodeGroups
+    groups = None
+    if settings["barcoded"]:
+        with metrics.stage("grouping", rows=len(datadf)):
+            groups = BarcodeGroups(datadf)
+            datadf = groups.df
+    with metrics.stage("stats", rows=len(datadf)):
+        settings["stats"] = [make_stats(datadf, settings, suffix="", groups=groups)]
+    with metrics.stage("filtering") as stage:
+        grouped = len(datadf)
+        datadf, settings = filter_and_transform_data(datadf, settings)
+        if groups is not None:
+            if len(datadf) < grouped:  # filtering keeps the order, so no sorting again
+                groups = groups.subset(datadf)
+            else:
+                groups.df = datadf
+        stage["rows"] = len(datadf)
+    if settings["filtered"]:  # Bool set when filter was applied in filter_and_transform_data()
+        with metrics.stage("stats_post_filtering", rows=len(datadf)):
+            settings["stats"].append(
+                make_stats(datadf, settings, suffix="_post_filtering", groups=groups))
+    with metrics.stage("plots", rows=len(datadf)):
+        if settings["barcoded"]:
+            plots = make_barcode_plots(groups, settings)
+        else:
+            plots = make_plots(datadf, settings)
+    with metrics.stage("report"):
+        make_report(plots, settings)
+
+
+def get_args(argv=None):
+    '''
+    Parse the arguments of a run, from the command line or from argv
+    '''
     epilog = """EXAMPLES:
     Nanoplot --summary sequencing_summary.txt --loglength -o summary-plots-log-transformed
     NanoPlot -t 2 --fastq reads1.fastq.gz reads2.fastq.gz --maxlength 40000 --plots hex dot
@@ -124,18 +201,54 @@ def get_args():
                          action="version",
                          version='NanoPlot {}'.format(__version__))
     general.add_argument("-t", "--threads",
-                         help="Set the allowed number of threads to be used by the script",
+                         help="Set the allowed number of threads to be used by the script \
+                               for extracting data and creating plots",
                          default=4,
                          type=int)
+    general.add_argument("--max_memory",
+                         help="Limit the memory in gigabytes used for processing barcodes \
+                               in parallel.",
+                         type=float,
+                         metavar="GB")
     general.add_argument("--verbose",
                          help="Write log messages also to terminal.",
                          action="store_true")
     general.add_argument("--store",
-                         help="Store the extracted data in a pickle file for future plotting.",
+                         help="Store the extracted data in a feather file for future plotting.",
                          action="store_true")
     general.add_argument("--raw",
                          help="Store the extracted data in tab separated file.",
                          action="store_true")
+    general.add_argument("--stats_format",
+                         help="Specify the format of the NanoStats files.",
+                         default="text",
+                         choices=["text", "tsv", "json"])
+    general.add_argument("--genome_size",
+                         help="Genome size in bases, to report the read length NG50 in the \
+                               NanoStats files.",
+                         type=int,
+                         metavar="BASES")
+    general.add_argument("--linked_report",
+                         help="Link to the plot files in the html report rather than embedding \
+                               the images, for a small report which opens quickly.",
+                         action="store_true")
+    general.add_argument("--thumbnails",
+                         help="Show downscaled thumbnails of the plots in a --linked_report.",
+                         action="store_true")
+    general.add_argument("--profile",
+                         help="Profile the run with cProfile, written to NanoPlot-profile.prof.",
+                         action="store_true")
+    general.add_argument("--no_cache",
+                         help="Do not use or update the cache of previously extracted data.",
+                         action="store_true")
+    general.add_argument("--cache_dir",
+                         help="Directory for the cache of extracted data, \
+                               defaults to $NANOPLOT_CACHE or ~/.cache/NanoPlot.",
+                         default=None)
+    general.add_argument("--cache_size",
+                         help="Maximal size of the cache in gigabytes.",
+                         default=10,
+                         type=float)
     general.add_argument("-o", "--outdir",
                          help="Specify directory in which output has to be created.",
                          default=".")
@@ -157,9 +270,14 @@ def get_args():
                            help="Drop outlier reads with extreme long length.",
                            action="store_true")
     filtering.add_argument("--downsample",
-                           help="Reduce dataset to N reads by random sampling.",
+                           help="Make the bivariate plots from a random sample of N reads, \
+                                 statistics and other plots still use all reads.",
                            type=int,
                            metavar='N')
+    filtering.add_argument("--downsample_by",
+                           help="Sample an equal number of reads per barcode, channel or hour \
+                                 of the run when using --downsample.",
+                           choices=["barcode", "channel", "time"])
     filtering.add_argument("--loglength",
                            help="Logarithmic scaling of lengths in plots.",
                            action="store_true")
@@ -173,6 +291,10 @@ def get_args():
                            help="Drop reads with an average quality lower than specified.",
                            type=int,
                            metavar='N')
+    filtering.add_argument("--runtime_from",
+                           help="Skip the N first hours of a run",
+                           type=int,
+                           metavar='N')
     filtering.add_argument("--runtime_until",
                            help="Only take the N first hours of a run",
                            type=int,
@@ -185,6 +307,20 @@ def get_args():
     filtering.add_argument("--barcoded",
                            help="Use if you want to split the summary file by barcode",
                            action="store_true")
+    filtering.add_argument("--stream",
+                           help="Read summary files in chunks with bounded memory, \
+                                 creating the plots from aggregated data",
+                           action="store_true")
+    filtering.add_argument("--watch",
+                           help="Keep watching the summary files during a run, updating the \
+                                 report with the new reads every N seconds until interrupted",
+                           type=int,
+                           metavar='N')
+    filtering.add_argument("--chunksize",
+                           help="Number of reads per chunk when using --stream",
+                           default=1000000,
+                           type=int,
+                           metavar='N')
     visual = parser.add_argument_group(
         title='Options for customizing the plots created')
     visual.add_argument("-c", "--color",
@@ -201,7 +337,7 @@ def get_args():
                         default=['kde', 'dot'],
                         type=str,
                         nargs='*',
-                        choices=['kde', 'hex', 'dot', 'pauvre'])
+                        choices=['kde', 'hex', 'dot', 'pauvre', 'binned'])
     visual.add_argument("--listcolors",
                         help="List the colors which are available for plotting and exit.",
                         action=utils.Action_Print_Colors,
@@ -269,7 +405,21 @@ def get_args():
     mtarget.add_argument("--pickle",
                          help="Data is a pickle file stored earlier.",
                          metavar="pickle")
-    args = parser.parse_args()
+    mtarget.add_argument("--feather",
+                         help="Data is a feather file stored earlier using --store.",
+                         metavar="feather")
+    args = parser.parse_args(argv)
+    if args.runtime_from and args.runtime_until and args.runtime_from >= args.runtime_until:
+        parser.error("--runtime_from should be smaller than --runtime_until")
+    if args.stream and not args.summary:
+        parser.error("--stream requires input from --summary")
+    if (args.stream or args.watch) and args.percentqual:
+        parser.error("--percentqual is not supported with --stream or --watch")
+    if args.watch:
+        if not args.summary:
+            parser.error("--watch requires input from --summary")
+        if any(f.endswith(('.gz', '.bz2', '.zip', '.xz')) for f in args.summary):
+            parser.error("--watch requires uncompressed summary files")
     if args.listcolors:
         utils.list_colors()
     if args.no_N50:
@@ -278,210 +428,500 @@ def get_args():
     return args
 
 
-def make_stats(datadf, settings, suffix):
-    statsfile = settings["path"] + "NanoStats" + suffix + ".txt"
-    nanomath.write_stats(
-        datadfs=[datadf],
-        outputfile=statsfile)
+def make_stats(datadf, settings, suffix, groups=None):
+    '''
+    Write the statistics of datadf to a NanoStats file and return them as a StatsTable
+    For barcoded data also per barcode, using the BarcodeGroups of datadf if supplied
+    The statistics of the whole dataset are then merged from those of the barcodes
+    and the StatsTable of the barcodes is kept in settings["barcode_stats"]
+    The qualities and identities kept for the medians are dropped once these are computed
+    '''
+    from nanoplot.grouping import BarcodeGroups
+    from nanoplot.stats import ReadStats, merge_stats
+    if settings["barcoded"]:
+        if groups is None:
+            groups = BarcodeGroups(datadf)
+        barcode_stats = [ReadStats(exact=True).update(df) for df in groups.frames()]
+        stats = merge_stats(barcode_stats + [ReadStats(exact=True).update(groups.unassigned())])
+        stats.finish()
+        for s in barcode_stats:
+            s.finish()
+    else:
+        stats = ReadStats(exact=True).update(datadf).finish()
+    table = write_stats_table([stats], settings, "NanoStats" + suffix)
     logging.info("Calculated statistics")
     if settings["barcoded"]:
-        barcodes = list(datadf["barcode"].unique())
-        statsfile = settings["path"] + "NanoStats_barcoded.txt"
-        nanomath.write_stats(
-            datadfs=[datadf[datadf["barcode"] == b] for b in barcodes],
-            outputfile=statsfile,
-            names=barcodes)
-    return statsfile
+        settings["barcode_stats"] = write_stats_table(
+            barcode_stats, settings, "NanoStats_barcoded", names=groups.names)
+    return table
+
+
+def write_stats_table(stats, settings, name, names=None):
+    '''
+    Write the StatsTable of a list of ReadStats in settings["stats_format"] to a file
+    called name and return the table, including the NG50 if settings["genome_size"] is set
+    '''
+    from nanoplot.stats import StatsTable, STATS_EXTENSIONS
+    table = StatsTable(stats, names=names, genome_size=settings["genome_size"])
+    table.write(settings["path"] + name + STATS_EXTENSIONS[settings["stats_format"]],
+                format=settings["stats_format"])
+    return table
+
+
+def stream_summary(settings):
+    '''
+    Create the stats, plots and report of summary files by streaming over them in chunks
+    Stats and plots are made from the aggregates of the run and of every barcode
+    '''
+    import nanoplot.stream as stream
+    with metrics.stage("aggregation") as stage:
+        run, barcodes = stream.aggregate_summary(settings)
+        stage["rows"] = run.stats.lengths.number_of_reads
+    report_aggregates(run, barcodes, settings)
+
+
+def watch_summary(settings):
+    '''
+    Keep the stats, plots and report of growing summary files up to date
+    Every settings["watch"] seconds the rows appended to the files are added to the aggregates,
+    after which only the plots of the run or barcodes with new reads are made again
+    Watching stops when interrupted or terminated
+    '''
+    import signal
+    import time
+    from nanoplot.watch import SummaryWatcher
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    watcher = SummaryWatcher(settings)
+    rendered = {}
+    logging.info("Watching {} every {} seconds.".format(
+        ", ".join(settings["summary"]), settings["watch"]))
+    try:
+        while True:
+            with metrics.stage("aggregation") as stage:
+                stage["rows"] = watcher.update()
+            if stage["rows"]:
+                aggregates = watcher.aggregates
+                report_aggregates(aggregates.run, aggregates.reported_barcodes(), settings,
+                                  rendered)
+                logging.info("Updated report with {} new reads.".format(stage["rows"]))
+            time.sleep(settings["watch"])
+    except KeyboardInterrupt:
+        logging.info("Stopped watching.")
+
+
+def report_aggregates(run, barcodes, settings, rendered=None):
+    '''
+    Write the stats, plots and report of the RunAggregates of a run and of its barcodes
+    rendered is passed to stream_plots, see there
+    '''
+    settings["stats"] = [write_stats_table([run.stats], settings, "NanoStats")]
+    if settings["filtered"]:
+        settings["stats"].append(write_stats_table(
+            [run.filtered_stats], settings, "NanoStats_post_filtering"))
+    logging.info("Calculated statistics")
+    if barcodes:
+        settings["barcode_stats"] = write_stats_table(
+            [b.filtered_stats for b in barcodes.values()], settings, "NanoStats_barcoded",
+            names=list(barcodes))
+    with metrics.stage("plots", rows=run.number_of_reads):
+        plots = stream_plots(run, barcodes, settings, rendered)
+    with metrics.stage("report"):
+        make_report(plots, settings)
+
+
+def stream_plots(run, barcodes, settings, rendered=None):
+    '''
+    Create the plots of the RunAggregates of the run, or of every barcode if there are barcodes
+    rendered is a dict of the plots made earlier, with the number of reads they were made of,
+    per barcode (or None for the run). Plots are only made again if the number of reads changed
+    '''
+    rendered = {} if rendered is None else rendered
+
+    def plots_of(name, aggregates, plot_settings):
+        reads = aggregates.stats.lengths.number_of_reads
+        if name not in rendered or rendered[name][0] != reads:
+            rendered[name] = (reads, make_aggregate_plots(aggregates, plot_settings))
+        return rendered[name][1]
+
+    if barcodes:
+        plots = []
+        for barc, aggregates in barcodes.items():
+            if aggregates.number_of_reads > 5:
+                logging.info("Processing {}".format(barc))
+                plots.extend(plots_of(
+                    barc,
+                    aggregates,
+                    dict(settings,
+                         path=path.join(settings["outdir"], settings["prefix"] + barc + "_"),
+                         title=barc)))
+            else:
+                sys.stderr.write("Found barcode {} less than 5x, ignoring...\n".format(barc))
+                logging.info("Found barcode {} less than 5 times, ignoring".format(barc))
+    else:
+        plots = plots_of(None, run, settings)
+    return plots
+
+
+def make_aggregate_plots(aggregates, settings):
+    '''
+    Call plotting functions from nanoplot.aggregate_plots on RunAggregates
+    The equivalent of make_plots for data which is streamed rather than in a DataFrame
+    With --downsample the scatter plots are made from the reads sampled while streaming
+    '''
+    import numpy as np
+    import nanoplotter
+    import nanoplot.aggregate_plots as aggregate_plots
+    import nanoplot.lengths as lengths
+    plot_settings = dict(font_scale=settings["font_scale"])
+    nanoplotter.plot_settings(plot_settings, dpi=settings["dpi"])
+    color = nanoplotter.check_valid_color(settings["color"])
+    n50 = lengths.n50(*aggregates.filtered_stats.lengths.distinct()) if settings["N50"] else None
+    jobs = [PlotJob(
+        aggregate_plots.length_histograms,
+        dict(lengths=aggregates.lengths,
+             path=settings["path"],
+             n50=n50,
+             color=color,
+             figformat=settings["format"],
+             title=settings["title"]),
+        message="Created length plots")
+    ]
+    if aggregates.length_vs_qual.counts.any():
+        jobs.append(PlotJob(
+            aggregate_plots.density_plot,
+            dict(grid=aggregates.length_vs_qual,
+                 names=['Read lengths', 'Average read quality'],
+                 path=settings["path"] + "LengthvsQualityScatterPlot",
+                 color=color,
+                 figformat=settings["format"],
+                 title=settings["title"],
+                 log_x=settings["logBool"],
+                 plot_settings=plot_settings),
+            message="Created LengthvsQual plot")
+        )
+    if aggregates.sample is not None and "quals" in aggregates.sample.sample():
+        from nanoplot.columns import PlotColumns
+        sample = aggregates.sample.sample()
+        if settings["logBool"]:
+            sample["log_lengths"] = np.log10(sample["lengths"])
+        columns = PlotColumns(sample)
+        jobs.extend(bivariate_plot_jobs(
+            columns, columns,
+            x="log_lengths" if settings["logBool"] else "lengths",
+            y="quals",
+            filtered=True,
+            names=['Read lengths', 'Average read quality'],
+            path=settings["path"] + "LengthvsQualityScatterPlot",
+            log=settings["logBool"],
+            message="Created LengthvsQual plot of sampled reads",
+            settings=dict(settings, plots=[p for p in settings["plots"] if p != "binned"]),
+            color=color,
+            plot_settings=plot_settings))
+    if aggregates.channels.counts.any():
+        jobs.append(PlotJob(
+            aggregate_plots.channel_heatmap,
+            dict(channels=aggregates.channels,
+                 title=settings["title"],
+                 path=settings["path"] + "ActivityMap_ReadsPerChannel",
+                 color="Greens",
+                 figformat=settings["format"]),
+            message="Created spatialheatmap for succesfull basecalls.")
+        )
+    if aggregates.time.reads.any():
+        jobs.append(PlotJob(
+            aggregate_plots.time_plots,
+            dict(buckets=aggregates.time,
+                 path=settings["path"],
+                 color=color,
+                 figformat=settings["format"],
+                 title=settings["title"],
+                 log_length=settings["logBool"],
+                 plot_settings=plot_settings),
+            message="Created timeplots.")
+        )
+    return run_plot_jobs(jobs, threads=settings["threads"],
+                         encode=not settings["linked_report"])
+
+
+def make_barcode_plots(groups, settings):
+    '''
+    Create the plots of every barcode with more than 5 reads
+    Barcodes are independent and processed in parallel, as one PlotJob per barcode,
+    using as many processes as fit in settings["max_memory"] gigabytes if that is set
+    '''
+    barcodes = []
+    for barc, size in groups.counts():
+        if size > 5:
+            barcodes.append(barc)
+        else:
+            sys.stderr.write("Found barcode {} less than 5x, ignoring...\n".format(barc))
+            logging.info("Found barcode {} less than 5 times, ignoring".format(barc))
+    # with multiple barcodes the parallelism is over barcodes, not over plots of a barcode
+    plot_threads = 1 if len(barcodes) > 1 else settings["threads"]
+    jobs = []
+    for barc in barcodes:
+        logging.info("Processing {}".format(barc))
+        jobs.append(PlotJob(
+            make_plots,
+            dict(datadf=groups.get(barc),
+                 settings=dict(settings,
+                               path=path.join(settings["outdir"], settings["prefix"] + barc + "_"),
+                               title=barc,
+                               threads=plot_threads)),
+            message="Created plots for {}".format(barc))
+        )
+    if settings["max_memory"]:
+        workers = workers_within_budget(
+            threads=settings["threads"],
+            job_sizes=[estimate_plot_memory(groups.get(barc), settings["plots"],
+                                            settings.get("downsample")) for barc in barcodes],
+            budget=settings["max_memory"] * 1e9)
+        logging.info("Processing barcodes using {} processes.".format(workers))
+    else:
+        workers = settings["threads"]
+    return run_plot_jobs(jobs, threads=workers, encode=not settings["linked_report"])
 
 
 def make_plots(datadf, settings):
     '''
     Call plotting functions from nanoplotter
     settings["lengths_pointer"] is a column in the DataFrame specifying which lengths to use
+    Every plotting call is a PlotJob, rendered in parallel using settings["threads"] processes
+    Columns are materialized once as contiguous arrays by PlotColumns
+    The time plots are made from the TimeBuckets of the reads, see nanoplot.timeindex
     '''
+    import nanoplotter
+    from scipy import stats
+    from nanoplot.columns import PlotColumns
+    import nanoplot.lengths as lengths
     plot_settings = dict(font_scale=settings["font_scale"])
     nanoplotter.plot_settings(plot_settings, dpi=settings["dpi"])
     color = nanoplotter.check_valid_color(settings["color"])
-    plotdict = {type: settings["plots"].count(type) for type in ["kde", "hex", "dot", 'pauvre']}
-    plots = []
+    columns = PlotColumns(datadf)
+    if settings.get("downsample") and len(datadf) > settings["downsample"]:
+        from nanoplot.sampling import sample_reads
+        sample = PlotColumns(sample_reads(datadf, settings))
+    else:
+        sample = columns
+    jobs = []
     if settings["N50"]:
-        n50 = nanomath.get_N50(np.sort(datadf["lengths"]))
+        n50 = lengths.n50(lengths.length_counts(columns.get("lengths")))
     else:
         n50 = None
-    plots.extend(
-        nanoplotter.length_plots(
-            array=datadf[datadf["length_filter"]]["lengths"],
-            name="Read length",
-            path=settings["path"],
-            n50=n50,
-            color=color,
-            figformat=settings["format"],
-            title=settings["title"])
+    jobs.append(PlotJob(
+        nanoplotter.length_plots,
+        dict(array=columns.get("lengths", filtered=True),
+             name="Read length",
+             path=settings["path"],
+             n50=n50,
+             color=color,
+             figformat=settings["format"],
+             title=settings["title"]),
+        message="Created length plots")
     )
-    logging.info("Created length plots")
+    bivariate = dict(settings=settings, color=color, plot_settings=plot_settings)
     if "quals" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                y=datadf[datadf["length_filter"]]["quals"],
-                names=['Read lengths', 'Average read quality'],
-                path=settings["path"] + "LengthvsQualityScatterPlot",
-                color=color,
-                figformat=settings["format"],
-                plots=plotdict,
-                log=settings["logBool"],
-                title=settings["title"],
-                plot_settings=plot_settings)
-        )
-        logging.info("Created LengthvsQual plot")
+        jobs.extend(bivariate_plot_jobs(
+            columns, sample,
+            x=settings["lengths_pointer"],
+            y="quals",
+            filtered=True,
+            names=['Read lengths', 'Average read quality'],
+            path=settings["path"] + "LengthvsQualityScatterPlot",
+            log=settings["logBool"],
+            message="Created LengthvsQual plot",
+            **bivariate))
     if "channelIDs" in datadf:
-        plots.extend(
-            nanoplotter.spatial_heatmap(
-                array=datadf["channelIDs"],
-                title=settings["title"],
-                path=settings["path"] + "ActivityMap_ReadsPerChannel",
-                color="Greens",
-                figformat=settings["format"])
+        jobs.append(PlotJob(
+            nanoplotter.spatial_heatmap,
+            dict(array=columns.get("channelIDs"),
+                 title=settings["title"],
+                 path=settings["path"] + "ActivityMap_ReadsPerChannel",
+                 color="Greens",
+                 figformat=settings["format"]),
+            message="Created spatialheatmap for succesfull basecalls.")
         )
-        logging.info("Created spatialheatmap for succesfull basecalls.")
     if "start_time" in datadf:
-        plots.extend(
-            nanoplotter.time_plots(
-                df=datadf,
-                path=settings["path"],
-                color=color,
-                figformat=settings["format"],
-                title=settings["title"],
-                log_length=settings["logBool"],
-                plot_settings=plot_settings)
+        import nanoplot.aggregate_plots as aggregate_plots
+        from nanoplot.timeindex import time_buckets
+        jobs.append(PlotJob(
+            aggregate_plots.time_plots,
+            dict(buckets=time_buckets(datadf),
+                 path=settings["path"],
+                 color=color,
+                 figformat=settings["format"],
+                 title=settings["title"],
+                 log_length=settings["logBool"],
+                 plot_settings=plot_settings),
+            message="Created timeplots.")
         )
-        logging.info("Created timeplots.")
     if "aligned_lengths" in datadf and "lengths" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]]["aligned_lengths"],
-                y=datadf[datadf["length_filter"]]["lengths"],
-                names=["Aligned read lengths", "Sequenced read length"],
-                path=settings["path"] + "AlignedReadlengthvsSequencedReadLength",
-                figformat=settings["format"],
-                plots=plotdict,
-                color=color,
-                title=settings["title"],
-                plot_settings=plot_settings)
-        )
-        logging.info("Created AlignedLength vs Length plot.")
+        jobs.extend(bivariate_plot_jobs(
+            columns, sample,
+            x="aligned_lengths",
+            y="lengths",
+            filtered=True,
+            names=["Aligned read lengths", "Sequenced read length"],
+            path=settings["path"] + "AlignedReadlengthvsSequencedReadLength",
+            message="Created AlignedLength vs Length plot.",
+            **bivariate))
     if "mapQ" in datadf and "quals" in datadf:
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf["mapQ"],
-                y=datadf["quals"],
-                names=["Read mapping quality", "Average basecall quality"],
-                path=settings["path"] + "MappingQualityvsAverageBaseQuality",
-                color=color,
-                figformat=settings["format"],
-                plots=plotdict,
-                title=settings["title"],
-                plot_settings=plot_settings)
-        )
-        logging.info("Created MapQvsBaseQ plot.")
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                y=datadf[datadf["length_filter"]]["mapQ"],
-                names=["Read length", "Read mapping quality"],
-                path=settings["path"] + "MappingQualityvsReadLength",
-                color=color,
-                figformat=settings["format"],
-                plots=plotdict,
-                log=settings["logBool"],
-                title=settings["title"],
-                plot_settings=plot_settings)
-        )
-        logging.info("Created Mapping quality vs read length plot.")
+        jobs.extend(bivariate_plot_jobs(
+            columns, sample,
+            x="mapQ",
+            y="quals",
+            names=["Read mapping quality", "Average basecall quality"],
+            path=settings["path"] + "MappingQualityvsAverageBaseQuality",
+            message="Created MapQvsBaseQ plot.",
+            **bivariate))
+        jobs.extend(bivariate_plot_jobs(
+            columns, sample,
+            x=settings["lengths_pointer"],
+            y="mapQ",
+            filtered=True,
+            names=["Read length", "Read mapping quality"],
+            path=settings["path"] + "MappingQualityvsReadLength",
+            log=settings["logBool"],
+            message="Created Mapping quality vs read length plot.",
+            **bivariate))
     if "percentIdentity" in datadf:
-        minPID = np.percentile(datadf["percentIdentity"], 1)
+        minPID = lengths.percentile(columns.get("percentIdentity"), 1)
         if "aligned_quals" in datadf:
-            plots.extend(
-                nanoplotter.scatter(
-                    x=datadf["percentIdentity"],
-                    y=datadf["aligned_quals"],
-                    names=["Percent identity", "Average Base Quality"],
-                    path=settings["path"] + "PercentIdentityvsAverageBaseQuality",
-                    color=color,
-                    figformat=settings["format"],
-                    plots=plotdict,
-                    stat=stats.pearsonr,
-                    minvalx=minPID,
-                    title=settings["title"],
-                    plot_settings=plot_settings)
-            )
-            logging.info("Created Percent ID vs Base quality plot.")
-        plots.extend(
-            nanoplotter.scatter(
-                x=datadf[datadf["length_filter"]][settings["lengths_pointer"]],
-                y=datadf[datadf["length_filter"]]["percentIdentity"],
-                names=["Aligned read length", "Percent identity"],
-                path=settings["path"] + "PercentIdentityvsAlignedReadLength",
-                color=color,
-                figformat=settings["format"],
-                plots=plotdict,
+            jobs.extend(bivariate_plot_jobs(
+                columns, sample,
+                x="percentIdentity",
+                y="aligned_quals",
+                names=["Percent identity", "Average Base Quality"],
+                path=settings["path"] + "PercentIdentityvsAverageBaseQuality",
                 stat=stats.pearsonr,
-                log=settings["logBool"],
-                minvaly=minPID,
-                title=settings["title"],
-                plot_settings=plot_settings)
+                minvalx=minPID,
+                message="Created Percent ID vs Base quality plot.",
+                **bivariate))
+        jobs.extend(bivariate_plot_jobs(
+            columns, sample,
+            x=settings["lengths_pointer"],
+            y="percentIdentity",
+            filtered=True,
+            names=["Aligned read length", "Percent identity"],
+            path=settings["path"] + "PercentIdentityvsAlignedReadLength",
+            stat=stats.pearsonr,
+            log=settings["logBool"],
+            minvaly=minPID,
+            message="Created Percent ID vs Length plot",
+            **bivariate))
+    return run_plot_jobs(jobs, threads=settings["threads"],
+                         encode=not settings["linked_report"])
+
+
+def bivariate_plot_jobs(columns, sample, x, y, names, path, message, settings, color,
+                        plot_settings, filtered=False, log=False, stat=None, minvalx=0, minvaly=0):
+    '''
+    Return the PlotJobs creating the bivariate plots of columns x vs y chosen in settings["plots"]
+    The kde, hex, dot and pauvre plots are made by nanoplotter from the PlotColumns sample,
+    the binned density from a grid of counts of all reads in columns
+    With filtered only reads passing the length_filter are plotted
+    '''
+    import nanoplotter
+    import nanoplot.aggregate_plots as aggregate_plots
+    plotdict = {type: settings["plots"].count(type) for type in ["kde", "hex", "dot", 'pauvre']}
+    jobs = []
+    if any(plotdict.values()):
+        jobs.append(PlotJob(
+            nanoplotter.scatter,
+            dict(x=sample.get(x, filtered),
+                 y=sample.get(y, filtered),
+                 names=names,
+                 path=path,
+                 color=color,
+                 figformat=settings["format"],
+                 plots=plotdict,
+                 stat=stat,
+                 log=log,
+                 minvalx=minvalx,
+                 minvaly=minvaly,
+                 title=settings["title"],
+                 plot_settings=plot_settings),
+            message=message)
         )
-        logging.info("Created Percent ID vs Length plot")
-    return plots
+    if "binned" in settings["plots"]:
+        jobs.append(PlotJob(
+            aggregate_plots.binned_density,
+            dict(x=columns.get(x, filtered),
+                 y=columns.get(y, filtered),
+                 names=names,
+                 path=path,
+                 color=color,
+                 figformat=settings["format"],
+                 title=settings["title"],
+                 log=log,
+                 minvalx=minvalx or None,
+                 minvaly=minvaly or None,
+                 plot_settings=plot_settings),
+            message=message.rstrip(".") + " using binned densities.")
+        )
+    return jobs
 
 
 def make_report(plots, settings):
     '''
-    Creates a fat html report based on the previously created files
+    Creates a html report based on the previously created files
     plots is a list of Plot objects defined by a path and title
-    statsfile is the file to which the stats have been saved,
-    which is parsed to a table (rather dodgy)
+    settings["stats"] holds the StatsTable of the data prior to and after filtering,
+    settings["barcode_stats"] that of the barcodes if the data is barcoded
+    The images are embedded in the report, or with settings["linked_report"] the report
+    links to the plot files, optionally showing thumbnails
+    The report is written while it is generated, rather than built in memory
     '''
     logging.info("Writing html report.")
-    html_content = ['<body>']
-
-    # Hyperlink Table of Contents panel
-    html_content.append('<div class="panel panelC">')
-    if settings["filtered"]:
-        html_content.append(
-            '<p><strong><a href="#stats0">Summary Statistics prior to filtering</a></strong></p>')
-        html_content.append(
-            '<p><strong><a href="#stats1">Summary Statistics after filtering</a></strong></p>')
-    else:
-        html_content.append(
-            '<p><strong><a href="#stats0">Summary Statistics</a></strong></p>')
-    html_content.append('<p><strong><a href="#plots">Plots</a></strong></p>')
-    html_content.extend(['<p style="margin-left:20px"><a href="#' +
-                         p.title.replace(' ', '_') + '">' + p.title + '</a></p>' for p in plots])
-    html_content.append('</div>')
-
-    # The report itself: stats
-    html_content.append('<div class="panel panelM"> <h1>NanoPlot report</h1>')
-    if settings["filtered"]:
-        html_content.append('<h2 id="stats0">Summary statistics prior to filtering</h2>')
-        html_content.append(utils.stats2html(settings["statsfile"][0]))
-        html_content.append('<h2 id="stats1">Summary statistics after filtering</h2>')
-        html_content.append(utils.stats2html(settings["statsfile"][1]))
-    else:
-        html_content.append('<h2 id="stats0">Summary statistics</h2>')
-        html_content.append(utils.stats2html(settings["statsfile"][0]))
-
-    # The report itself: plots
-    html_content.append('<h2 id="plots">Plots</h2>')
-    for plot in plots:
-        html_content.append('\n<h3 id="' + plot.title.replace(' ', '_') + '">' +
-                            plot.title + '</h3>\n' + plot.encode())
-        html_content.append('\n<br>\n<br>\n<br>\n<br>')
-    html_body = '\n'.join(html_content) + '</div></body></html>'
-    html_str = utils.html_head + html_body
     htmlreport = settings["path"] + "NanoPlot-report.html"
     with open(htmlreport, "w") as html_file:
-        html_file.write(html_str)
+        html_file.write(utils.html_head)
+        html_file.write('<body>\n')
+
+        # Hyperlink Table of Contents panel
+        html_file.write('<div class="panel panelC">\n')
+        if settings["filtered"]:
+            html_file.write('<p><strong><a href="#stats0">'
+                            'Summary Statistics prior to filtering</a></strong></p>\n')
+            html_file.write('<p><strong><a href="#stats1">'
+                            'Summary Statistics after filtering</a></strong></p>\n')
+        else:
+            html_file.write('<p><strong><a href="#stats0">Summary Statistics</a></strong></p>\n')
+        if settings.get("barcode_stats"):
+            html_file.write('<p><strong><a href="#barcodes">'
+                            'Summary Statistics per barcode</a></strong></p>\n')
+        html_file.write('<p><strong><a href="#plots">Plots</a></strong></p>\n')
+        for p in plots:
+            html_file.write('<p style="margin-left:20px"><a href="#' +
+                            p.title.replace(' ', '_') + '">' + p.title + '</a></p>\n')
+        html_file.write('</div>\n')
+
+        # The report itself: stats
+        html_file.write('<div class="panel panelM"> <h1>NanoPlot report</h1>\n')
+        if settings["filtered"]:
+            html_file.write('<h2 id="stats0">Summary statistics prior to filtering</h2>\n')
+            html_file.write(settings["stats"][0].to_html())
+            html_file.write('<h2 id="stats1">Summary statistics after filtering</h2>\n')
+            html_file.write(settings["stats"][1].to_html())
+        else:
+            html_file.write('<h2 id="stats0">Summary statistics</h2>\n')
+            html_file.write(settings["stats"][0].to_html())
+        if settings.get("barcode_stats"):
+            html_file.write('<h2 id="barcodes">Summary statistics per barcode</h2>\n')
+            html_file.write(settings["barcode_stats"].to_html())
+
+        # The report itself: plots
+        html_file.write('<h2 id="plots">Plots</h2>\n')
+        for plot in plots:
+            html_file.write('\n<h3 id="' + plot.title.replace(' ', '_') + '">' +
+                            plot.title + '</h3>\n')
+            if settings["linked_report"]:
+                html_file.write(utils.link_plot(plot, path.dirname(htmlreport),
+                                                thumbnails=settings["thumbnails"]))
+            else:
+                html_file.write(plot.encode())
+            html_file.write('\n<br>\n<br>\n<br>\n<br>\n')
+        html_file.write('</div></body></html>')
     return htmlreport
 
 
@@ -0,0 +1,276 @@
+"""
+Plots created from aggregated data (see nanoplot.aggregates) rather than from
+per-read arrays, so that the time to create them depends on the resolution of
+the aggregates and not on the number of reads. Violin plots are drawn from the
+binned distributions with Axes.violin rather than from a kernel density estimate.
+Output files follow the naming of the nanoplotter plots they replace.
+"""
+
+import numpy as np
+from nanoplot.aggregates import Histogram2D, adaptive_edges
+from nanoplotter.plot import Plot
+from nanoplotter.spatial_heatmap import make_layout
+import matplotlib as mpl
+mpl.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+import seaborn as sns
+import pandas as pd
+
+
+def log_ticks(maxval):
+    return [10**i for i in range(10) if not 10**i > 10 * maxval]
+
+
+def length_histograms(lengths, path, title=None, n50=None, color="#4CB391", figformat="png",
+                      name="Read length"):
+    """Create histograms of normal and log transformed read lengths from LengthCounts."""
+    values, counts = lengths.distinct()
+    maxvalx = lengths.max()
+    plots = []
+    for weighted, h_name, ylabel in [(False, "", "Number of reads"),
+                                     (True, "Weighted ", "Number of bases")]:
+        weights = counts * values if weighted else counts
+        histogram = Plot(
+            path=path + h_name.replace(" ", "_") + "Histogram" +
+            name.replace(' ', '') + "." + figformat,
+            title=h_name + "Histogram of read lengths")
+        ax = plt.figure().gca()
+        ax.hist(values, bins=max(round(int(maxvalx) / 500), 10), range=(0, maxvalx),
+                weights=weights, color=color, edgecolor=color, linewidth=0.2, alpha=0.8)
+        if n50:
+            plt.axvline(n50)
+            plt.annotate('N50', xy=(n50, np.amax([h.get_height() for h in ax.patches])), size=8)
+        ax.set(xlabel='Read length', ylabel=ylabel, title=title or histogram.title)
+        plt.ticklabel_format(style='plain', axis='y')
+        histogram.fig = ax.get_figure()
+        histogram.save(format=figformat)
+        plt.close("all")
+
+        log_histogram = Plot(
+            path=path + h_name.replace(" ", "_") + "LogTransformed_Histogram" +
+            name.replace(' ', '') + "." + figformat,
+            title=h_name + "Histogram of read lengths after log transformation")
+        ax = plt.figure().gca()
+        ax.hist(np.log10(values[values > 0]), bins=50, weights=weights[values > 0],
+                color=color, edgecolor=color, linewidth=0.2, alpha=0.8)
+        ticks = log_ticks(maxvalx)
+        ax.set(xticks=np.log10(ticks), xticklabels=ticks, xlabel='Read length', ylabel=ylabel,
+               title=title or log_histogram.title)
+        if n50:
+            plt.axvline(np.log10(n50))
+            plt.annotate('N50', xy=(np.log10(n50), np.amax(
+                [h.get_height() for h in ax.patches])), size=8)
+        plt.ticklabel_format(style='plain', axis='y')
+        log_histogram.fig = ax.get_figure()
+        log_histogram.save(format=figformat)
+        plt.close("all")
+        plots.extend([histogram, log_histogram])
+
+    yield_by_length = Plot(
+        path=path + "Yield_By_Length." + figformat,
+        title="Yield by length")
+    ax = plt.figure().gca()
+    ax.scatter(values[::-1], np.cumsum((counts * values)[::-1]) / 10**9, s=3, color=color)
+    ax.set(xlabel='Read length', ylabel='Cumulative yield for minimal length',
+           title=title or yield_by_length.title)
+    yield_by_length.fig = ax.get_figure()
+    yield_by_length.save(format=figformat)
+    plt.close("all")
+    plots.append(yield_by_length)
+    return plots
+
+
+def density_plot(grid, names, path, color="#4CB391", figformat="png", title=None,
+                 log_x=False, log_grid=True, plot_settings=None):
+    """Create a bivariate density plot from a Histogram2D.
+
+    With log_grid the x values of the grid are log10 transformed, and with log_x
+    the x axis shows the log transformed values, otherwise the original values
+    """
+    density = Plot(
+        path=path + "_binned." + figformat,
+        title="{} vs {} plot using binned densities".format(names[0], names[1]))
+    sns.set(style="ticks", **(plot_settings or {}))
+    fig, ax = plt.subplots(figsize=(10, 10))
+    counts = np.ma.masked_equal(grid.counts.T, 0)
+    xedges = 10**grid.xedges if log_grid and not log_x else grid.xedges
+    mesh = ax.pcolormesh(xedges, grid.yedges, counts, norm=LogNorm(),
+                         cmap=sns.light_palette(color, as_cmap=True))
+    fig.colorbar(mesh, ax=ax, label="Number of reads")
+    present_x = np.flatnonzero(grid.counts.sum(axis=1))
+    present_y = np.flatnonzero(grid.counts.sum(axis=0))
+    if present_x.size:
+        ax.set_xlim(0 if log_grid and not log_x else xedges[present_x[0]],
+                    xedges[present_x[-1] + 1])
+        ax.set_ylim(grid.yedges[present_y[0]], grid.yedges[present_y[-1] + 1])
+    if log_x:
+        density.title = density.title + " after log transformation of read lengths"
+        ticks = log_ticks(10**xedges[present_x[-1] + 1] if present_x.size else 1)
+        ax.set_xticks(np.log10(ticks))
+        ax.set_xticklabels(ticks)
+    ax.set(xlabel=names[0], ylabel=names[1])
+    fig.suptitle(title or "{} vs {} plot".format(names[0], names[1]), fontsize=25)
+    density.fig = fig
+    density.save(format=figformat)
+    plt.close("all")
+    return [density]
+
+
+def binned_density(x, y, names, path, color="#4CB391", figformat="png", title=None,
+                   log=False, minvalx=None, minvaly=None, bins=200, plot_settings=None):
+    """Create a density plot of all values of x vs y, binned in a grid spanning their range.
+
+    With log the x values are log10 transformed read lengths, as for nanoplotter.scatter
+    """
+    grid = Histogram2D(adaptive_edges(x, bins, minvalx), adaptive_edges(y, bins, minvaly))
+    grid.update(x, y)
+    return density_plot(grid, names, path, color=color, figformat=figformat, title=title,
+                        log_x=log, log_grid=log, plot_settings=plot_settings)
+
+
+def channel_heatmap(channels, path, title=None, color="Greens", figformat="png"):
+    """Create the heatmap of reads per channel on the flowcell from ChannelCounts."""
+    activity_map = Plot(
+        path=path + "." + figformat,
+        title="Number of reads generated per channel")
+    layout = make_layout(maxval=channels.counts.size - 1)
+    counts = np.zeros(layout.structure.max() + 1, dtype=np.int64)
+    counts[:min(channels.counts.size, counts.size)] = channels.counts[:counts.size]
+    plt.figure()
+    ax = sns.heatmap(
+        data=pd.DataFrame(counts[layout.structure], index=layout.yticks, columns=layout.xticks),
+        xticklabels="auto",
+        yticklabels="auto",
+        square=True,
+        cbar_kws={"orientation": "horizontal"},
+        cmap=color,
+        linewidths=0.20)
+    ax.set_title(title or activity_map.title)
+    activity_map.fig = ax.get_figure()
+    activity_map.save(format=figformat)
+    plt.close("all")
+    return [activity_map]
+
+
+def over_time(plot, hours, values, ylabel, title, color, figformat):
+    ax = plt.figure().gca()
+    ax.scatter(hours, values, s=3, color=color)
+    ax.set(xlabel='Run time (hours)', ylabel=ylabel, title=title or plot.title)
+    plot.fig = ax.get_figure()
+    plot.save(format=figformat)
+    plt.close("all")
+    return plot
+
+
+def violin_stats(histograms, transform=None):
+    """Return the intervals with reads and the statistics of their violins, as for Axes.violin.
+
+    Values are the centers of the bins of the histograms, optionally transformed,
+    densities are per unit of the (transformed) values
+    """
+    edges = histograms.edges if transform is None else transform(histograms.edges)
+    centers = (edges[:-1] + edges[1:]) / 2
+    intervals = []
+    stats = []
+    for interval, counts in enumerate(histograms.counts):
+        present = np.flatnonzero(counts)
+        if not present.size:
+            continue
+        first, last = present[0], present[-1] + 1
+        number = counts.sum()
+        stats.append(dict(
+            coords=centers[first:last],
+            vals=counts[first:last] / np.diff(edges[first:last + 1]) / number,
+            mean=np.dot(counts, centers) / number,
+            median=centers[np.searchsorted(np.cumsum(counts), number / 2)],
+            min=centers[first],
+            max=centers[last - 1]))
+        intervals.append(interval)
+    return intervals, stats
+
+
+def violins_over_time(plot, histograms, ylabel, title, color, figformat, transform=None,
+                      log_ticks_max=None):
+    """Create violin plots of the distributions of IntervalHistograms over time."""
+    intervals, stats = violin_stats(histograms, transform)
+    hours = histograms.width // 3600
+    ax = plt.figure().gca()
+    parts = ax.violin(stats, positions=intervals, widths=0.8, showextrema=False)
+    for body in parts["bodies"]:
+        body.set(facecolor=color, edgecolor=color, alpha=0.8)
+    ax.set_xticks(intervals)
+    ax.set_xticklabels(["{}-{}".format(i * hours, (i + 1) * hours) for i in intervals],
+                       rotation=45, ha='center', fontsize=8)
+    ax.set(xlabel='Interval (hours)', ylabel=ylabel, title=title or plot.title)
+    if log_ticks_max:
+        ticks = log_ticks(log_ticks_max)
+        ax.set(yticks=np.log10(ticks), yticklabels=ticks)
+    plot.fig = ax.get_figure()
+    plot.save(format=figformat)
+    plt.close("all")
+    return plot
+
+
+def time_plots(buckets, path, title=None, color="#4CB391", figformat="png", log_length=False,
+               plot_settings=None):
+    """Create cumulative yield, metrics over time and violin plots over time from TimeBuckets.
+
+    The read lengths of the violin plot are log transformed with log_length
+    """
+    sns.set(style="white", **(plot_settings or {}))
+    hours = buckets.hours()
+    interval = "per {} minutes".format(round(buckets.width / 60))
+    plots = [
+        over_time(Plot(path=path + "CumulativeYieldPlot_Gigabases." + figformat,
+                       title="Cumulative yield"),
+                  hours, np.cumsum(buckets.bases) / 1e9, 'Cumulative yield in gigabase',
+                  title, color, figformat),
+        over_time(Plot(path=path + "CumulativeYieldPlot_NumberOfReads." + figformat,
+                       title="Cumulative yield"),
+                  hours, np.cumsum(buckets.reads), 'Cumulative yield in number of reads',
+                  title, color, figformat),
+        over_time(Plot(path=path + "NumberOfReads_Over_Time." + figformat,
+                       title="Number of reads over time"),
+                  hours, buckets.reads, 'Number of reads ' + interval,
+                  title, color, figformat),
+    ]
+    if buckets.active.size:
+        plots.append(over_time(
+            Plot(path=path + "ActivePores_Over_Time." + figformat,
+                 title="Number of active pores over time"),
+            hours, buckets.active_channels(), 'Active pores ' + interval,
+            title, color, figformat))
+    if buckets.qual_sum.size:
+        plots.append(over_time(
+            Plot(path=path + "MeanQuality_Over_Time." + figformat,
+                 title="Mean basecall quality over time"),
+            hours, buckets.mean_quality(), 'Mean basecall quality ' + interval,
+            title, color, figformat))
+    if buckets.speed_sum.size:
+        plots.append(over_time(
+            Plot(path=path + "SequencingSpeed_Over_Time." + figformat,
+                 title="Sequencing speed over time"),
+            hours, buckets.mean_speed(), 'Mean sequencing speed (nucleotides/second)',
+            title, color, figformat))
+    if buckets.length_distributions.counts.any():
+        maxlength = 10 ** buckets.length_distributions.edges[
+            np.flatnonzero(buckets.length_distributions.counts.any(axis=0))[-1] + 1]
+        plots.append(violins_over_time(
+            Plot(path=path + "TimeLengthViolinPlot." + figformat,
+                 title="Violin plot of read lengths over time"),
+            buckets.length_distributions, "Read length", title, color, figformat,
+            transform=None if log_length else lambda edges: 10 ** edges,
+            log_ticks_max=maxlength if log_length else None))
+    if buckets.qual_distributions.counts.any():
+        plots.append(violins_over_time(
+            Plot(path=path + "TimeQualityViolinPlot." + figformat,
+                 title="Violin plot of quality over time"),
+            buckets.qual_distributions, "Basecall quality", title, color, figformat))
+    if buckets.speed_distributions.counts.any():
+        plots.append(violins_over_time(
+            Plot(path=path + "TimeSequencingSpeed_ViolinPlot." + figformat,
+                 title="Violin plot of sequencing speed over time"),
+            buckets.speed_distributions, "Sequencing speed (nucleotides/second)",
+            title, color, figformat, transform=lambda edges: 10 ** edges))
+    return plots
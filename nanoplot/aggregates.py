@@ -0,0 +1,372 @@
+"""
+Incremental aggregates of read metrics.
+
+Aggregates are updated chunk by chunk and can be merged, so that plots can be
+created from data which is never completely in memory. Their memory use depends
+on the resolution of the aggregate, not on the number of reads.
+The exception is ExactValues, which keeps all values for exact quantiles when
+all reads are in memory anyway.
+"""
+
+import numpy as np
+from nanoplot.lengths import DENSE_LENGTHS, percentile
+
+
+def grow(array, shape):
+    """Return array zero-padded to at least shape, or array itself if it is large enough."""
+    shape = tuple(max(old, new) for old, new in zip(array.shape, shape))
+    if shape == array.shape:
+        return array
+    grown = np.zeros(shape, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+def add_counts(total, counts):
+    """Add counts to total, growing total if required, and return the result."""
+    total = grow(total, counts.shape)
+    total[tuple(slice(0, n) for n in counts.shape)] += counts
+    return total
+
+
+class LengthCounts(object):
+    """Exact number of reads for every read length.
+
+    Lengths below DENSE_LENGTHS are counted in a dense array, the longer ones sparsely as
+    their distinct lengths and counts, such that memory doesn't grow with the longest read
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.long_values = np.zeros(0, dtype=np.int64)
+        self.long_counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, lengths):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not lengths.size:
+            return
+        dense = lengths < DENSE_LENGTHS
+        if dense.all():
+            self.counts = add_counts(self.counts, np.bincount(lengths))
+            return
+        self.counts = add_counts(self.counts, np.bincount(lengths[dense]))
+        self.add_long(*np.unique(lengths[~dense], return_counts=True))
+
+    def add_long(self, values, counts):
+        if values.size:
+            values, inverse = np.unique(np.concatenate([self.long_values, values]),
+                                        return_inverse=True)
+            self.long_counts = np.bincount(
+                inverse, weights=np.concatenate([self.long_counts, counts])).astype(np.int64)
+            self.long_values = values
+
+    def merge(self, other):
+        self.counts = add_counts(self.counts, other.counts)
+        self.add_long(other.long_values, other.long_counts)
+
+    def distinct(self):
+        """Return the distinct read lengths in increasing order and the number of reads of each."""
+        values = np.flatnonzero(self.counts)
+        return (np.concatenate([values, self.long_values]),
+                np.concatenate([self.counts[values], self.long_counts]))
+
+    @property
+    def number_of_reads(self):
+        return int(self.counts.sum() + self.long_counts.sum())
+
+    @property
+    def number_of_bases(self):
+        return int(np.dot(self.counts, np.arange(self.counts.size)) +
+                   np.dot(self.long_counts, self.long_values))
+
+    def max(self):
+        if self.long_values.size:
+            return int(self.long_values[-1])
+        return int(np.flatnonzero(self.counts)[-1]) if self.counts.any() else 0
+
+
+class ValueCounts(object):
+    """Number of reads per value of a continuous metric, at a fixed resolution."""
+
+    def __init__(self, resolution=0.01):
+        self.resolution = resolution
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.total = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size:
+            self.total += values.sum()
+            bins = np.round(np.clip(values, 0, None) / self.resolution).astype(np.int64)
+            self.counts = add_counts(self.counts, np.bincount(bins))
+
+    def merge(self, other):
+        if isinstance(other, ExactValues):
+            self.update(other.values())
+            return
+        self.counts = add_counts(self.counts, other.counts)
+        self.total += other.total
+
+    @property
+    def number(self):
+        return int(self.counts.sum())
+
+    def mean(self):
+        return self.total / self.number if self.number else np.nan
+
+    def quantile(self, q):
+        """Return the value at quantile q, interpolated as np.percentile and accurate up to
+        the resolution.
+        """
+        if not self.number:
+            return np.nan
+        rank = (self.number - 1) * q
+        lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+        # the value with 0-based rank k is in the bin at which the cumulative count exceeds k
+        values = np.searchsorted(np.cumsum(self.counts), [lower, upper], side="right") \
+            * self.resolution
+        return values[0] + (values[1] - values[0]) * (rank - lower)
+
+
+class ExactValues(object):
+    """All values of a continuous metric, for quantiles equal to np.percentile.
+
+    Has the interface of ValueCounts, but its memory use grows with the number of reads.
+    The values are kept as given, without a copy unless they contain NaN, until finish
+    drops them and keeps only their number, mean and median
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.finished = None
+
+    def update(self, values):
+        if self.finished:
+            raise ValueError("Can't add values to finished ExactValues.")
+        values = np.asarray(values)
+        missing = np.isnan(values)
+        if missing.any():
+            values = values[~missing]
+        if values.size:
+            self.arrays.append(values)
+
+    def merge(self, other):
+        if not isinstance(other, ExactValues):
+            raise ValueError("Can't merge ValueCounts into ExactValues.")
+        if self.finished or other.finished:
+            raise ValueError("Can't merge finished ExactValues.")
+        self.arrays.extend(other.arrays)
+
+    def values(self):
+        if self.finished:
+            raise ValueError("The values of finished ExactValues are no longer kept.")
+        if len(self.arrays) > 1:
+            return np.concatenate(self.arrays)
+        return self.arrays[0] if self.arrays else np.zeros(0)
+
+    def finish(self):
+        """Keep only the number, mean and median of the values and drop the values."""
+        if not self.finished:
+            self.finished = (self.number, self.mean(), self.quantile(0.5))
+            self.arrays = []
+
+    @property
+    def number(self):
+        if self.finished:
+            return self.finished[0]
+        return sum(a.size for a in self.arrays)
+
+    def mean(self):
+        if self.finished:
+            return self.finished[1]
+        return self.values().mean(dtype=np.float64) if self.number else np.nan
+
+    def quantile(self, q):
+        """Return the value at quantile q, interpolated as np.percentile."""
+        if self.finished:
+            if q != 0.5:
+                raise ValueError("Only the median of finished ExactValues is kept.")
+            return self.finished[2]
+        if not self.number:
+            return np.nan
+        return percentile(self.values(), q * 100)
+
+
+def adaptive_edges(values, bins=200, minval=None):
+    """Return at most bins + 1 evenly spaced edges spanning values, starting at minval if given.
+
+    For integer values every bin spans at least one integer, to avoid empty bins in between
+    """
+    values = np.asarray(values)
+    lower = float(np.min(values) if minval is None else minval)
+    upper = float(np.max(values))
+    if np.issubdtype(values.dtype, np.integer):
+        bins = int(min(bins, upper - lower + 1))
+        lower, upper = lower - 0.5, upper + 0.5
+    elif upper <= lower:
+        upper = lower + 1
+    return np.linspace(lower, upper, bins + 1)
+
+
+def bin_indices(values, edges):
+    """Return the bin of every value for evenly spaced edges, clipping values outside the edges."""
+    scale = (edges.size - 1) / (edges[-1] - edges[0])
+    return np.clip(((values - edges[0]) * scale).astype(np.int64), 0, edges.size - 2)
+
+
+class Histogram2D(object):
+    """Number of reads in a fixed grid of evenly spaced x and y bins.
+
+    Values outside the grid are counted in the outermost bins, missing values are ignored.
+    The bins are computed arithmetically and counted with a single bincount.
+    """
+
+    def __init__(self, xedges, yedges):
+        self.xedges = np.asarray(xedges, dtype=np.float64)
+        self.yedges = np.asarray(yedges, dtype=np.float64)
+        self.counts = np.zeros((self.xedges.size - 1, self.yedges.size - 1), dtype=np.int64)
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.all():
+            x, y = x[finite], y[finite]
+        cells = bin_indices(x, self.xedges) * self.counts.shape[1] + bin_indices(y, self.yedges)
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+
+class ChannelCounts(object):
+    """Number of reads per channel."""
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, channels):
+        channels = np.asarray(channels, dtype=np.int64)
+        if channels.size:
+            self.counts = add_counts(self.counts, np.bincount(channels))
+
+    def merge(self, other):
+        self.counts = add_counts(self.counts, other.counts)
+
+    @property
+    def active_channels(self):
+        return int(np.count_nonzero(self.counts))
+
+
+class IntervalHistograms(object):
+    """Number of reads per value bin in every fixed-width time interval, as for violin plots.
+
+    Times are in seconds since the start of the run, the width of the intervals in seconds.
+    Values outside the edges are counted in the outermost bins, missing values are ignored.
+    """
+
+    def __init__(self, edges, width=3 * 3600):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.width = width
+        self.counts = np.zeros((0, self.edges.size - 1), dtype=np.int64)
+
+    def update(self, seconds, values):
+        seconds = np.asarray(seconds, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        if not finite.all():
+            seconds, values = seconds[finite], values[finite]
+        if not values.size:
+            return
+        intervals = (seconds // self.width).astype(np.int64)
+        bins = self.counts.shape[1]
+        counts = np.bincount(intervals * bins + bin_indices(values, self.edges),
+                             minlength=(intervals.max() + 1) * bins)
+        self.counts = add_counts(self.counts, counts.reshape(-1, bins))
+
+    def merge(self, other):
+        self.counts = add_counts(self.counts, other.counts)
+
+
+# bins of the distributions over time: log10 transformed lengths, qualities (also as
+# percent identities) and log10 transformed sequencing speed in nucleotides per second
+TIME_LOG_LENGTH_EDGES = np.linspace(0, 7, 141)
+TIME_QUAL_EDGES = np.linspace(0, 100, 401)
+TIME_LOG_SPEED_EDGES = np.linspace(0, 6, 121)
+
+
+class TimeBuckets(object):
+    """Reads, bases, quality, sequencing speed and active channels per fixed-width time bucket.
+
+    Times are in seconds since the start of the run, the width of the buckets in seconds.
+    The distributions of lengths, qualities and speed are kept per interval of 3 hours.
+    """
+
+    def __init__(self, width=600):
+        self.width = width
+        self.reads = np.zeros(0, dtype=np.int64)
+        self.bases = np.zeros(0, dtype=np.int64)
+        self.qual_sum = np.zeros(0, dtype=np.float64)
+        self.speed_sum = np.zeros(0, dtype=np.float64)
+        self.active = np.zeros((0, 0), dtype=bool)
+        self.length_distributions = IntervalHistograms(TIME_LOG_LENGTH_EDGES)
+        self.qual_distributions = IntervalHistograms(TIME_QUAL_EDGES)
+        self.speed_distributions = IntervalHistograms(TIME_LOG_SPEED_EDGES)
+
+    def update(self, seconds, lengths, quals=None, channels=None, durations=None,
+               length_filter=None):
+        """Add reads, length_filter selects those of which the length distribution is kept."""
+        seconds = np.asarray(seconds, dtype=np.float64)
+        buckets = (seconds // self.width).astype(np.int64)
+        if not buckets.size:
+            return
+        lengths = np.asarray(lengths)
+        self.reads = add_counts(self.reads, np.bincount(buckets))
+        self.bases = add_counts(self.bases, np.bincount(buckets, weights=lengths).astype(np.int64))
+        with np.errstate(divide="ignore"):
+            log_lengths = np.log10(lengths, dtype=np.float64)
+        if length_filter is None:
+            self.length_distributions.update(seconds, log_lengths)
+        else:
+            self.length_distributions.update(seconds[length_filter], log_lengths[length_filter])
+        if quals is not None:
+            self.qual_sum = add_counts(self.qual_sum, np.bincount(buckets, weights=quals))
+            self.qual_distributions.update(seconds, quals)
+        if durations is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                speed = np.nan_to_num(lengths / np.asarray(durations),
+                                      nan=0, posinf=0, neginf=0)
+            self.speed_sum = add_counts(self.speed_sum, np.bincount(buckets, weights=speed))
+            with np.errstate(divide="ignore"):
+                self.speed_distributions.update(seconds, np.log10(speed))
+        if channels is not None:
+            channels = np.asarray(channels, dtype=np.int64)
+            self.active = grow(self.active, (buckets.max() + 1, channels.max() + 1))
+            self.active[buckets, channels] = True
+
+    def merge(self, other):
+        self.reads = add_counts(self.reads, other.reads)
+        self.bases = add_counts(self.bases, other.bases)
+        self.qual_sum = add_counts(self.qual_sum, other.qual_sum)
+        self.speed_sum = add_counts(self.speed_sum, other.speed_sum)
+        self.active = grow(self.active, other.active.shape)
+        self.active[:other.active.shape[0], :other.active.shape[1]] |= other.active
+        self.length_distributions.merge(other.length_distributions)
+        self.qual_distributions.merge(other.qual_distributions)
+        self.speed_distributions.merge(other.speed_distributions)
+
+    def hours(self):
+        """Return the start of every bucket in hours."""
+        return np.arange(self.reads.size) * self.width / 3600
+
+    def mean_quality(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return grow(self.qual_sum, self.reads.shape) / self.reads
+
+    def mean_speed(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return grow(self.speed_sum, self.reads.shape) / self.reads
+
+    def active_channels(self):
+        return grow(self.active.sum(axis=1), self.reads.shape)
@@ -0,0 +1,103 @@
+"""
+Parallel extraction of metrics from indexed bam and cram files.
+
+Rather than one worker per file, or per reference as nanoget does, every file is
+split in regions with about the same number of alignments according to its index.
+All regions of all files are processed by a single pool of worker processes.
+Alignments belong to the region in which they start, such that alignments
+overlapping two regions are extracted only once.
+As with nanoget, secondary alignments and unmapped reads are ignored.
+Qualities are averaged using a lookup table of error probabilities per Phred score.
+"""
+
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["readIDs", "quals", "aligned_quals", "lengths",
+           "aligned_lengths", "mapQ", "percentIdentity"]
+REGIONS_PER_THREAD = 4  # more regions than workers to balance uneven regions
+ERROR_PROBABILITIES = 10 ** (np.arange(256) / -10)
+
+
+def ave_qual(quals):
+    """Return the average basecall quality of the Phred scores, as nanomath.ave_qual."""
+    if quals is None or len(quals) == 0:
+        return None
+    return -10 * np.log10(ERROR_PROBABILITIES[np.frombuffer(quals, dtype=np.uint8)].mean())
+
+
+def split_regions(samfile, pieces):
+    """Return a list of (reference, start, end) regions with about equal numbers of alignments.
+
+    The number of alignments per reference is taken from the index if available,
+    otherwise (e.g. for cram) the alignments are assumed to be proportional to their length
+    """
+    lengths = dict(zip(samfile.references, samfile.lengths))
+    try:
+        counts = {s.contig: s.mapped for s in samfile.get_index_statistics()}
+    except (AttributeError, ValueError):
+        counts = {}
+    if not any(counts.values()):  # cram indices don't hold the number of alignments
+        counts = lengths
+    target = max(sum(counts.values()) / pieces, 1)
+    regions = []
+    for reference, length in lengths.items():
+        if counts.get(reference, 0) == 0:
+            continue
+        splits = int(min(np.ceil(counts[reference] / target), length))
+        edges = np.linspace(0, length, splits + 1).astype(int)
+        regions.extend((reference, start, end) for start, end in zip(edges[:-1], edges[1:]))
+    return regions
+
+
+def extract_region(params):
+    """Return the metrics of the primary and supplementary alignments starting in a region."""
+    import pysam
+    from nanoget.extraction_functions import get_pID
+    alignmentfile, reference, start, end = params
+    reads = []
+    with pysam.AlignmentFile(alignmentfile) as samfile:
+        for read in samfile.fetch(reference, start, end):
+            if read.is_secondary or read.reference_start < start:
+                continue
+            reads.append((read.query_name,
+                          ave_qual(read.query_qualities),
+                          ave_qual(read.query_alignment_qualities),
+                          read.query_length,
+                          read.query_alignment_length,
+                          read.mapping_quality,
+                          get_pID(read)))
+    return reads
+
+
+def extract_alignments(files, source="bam", threads=4):
+    """Return a DataFrame with the metrics of the alignments in the bam or cram files.
+
+    Files are checked, and indexed if necessary, using nanoget
+    """
+    from nanoget.extraction_functions import check_bam
+    params = []
+    for alignmentfile in files:
+        samfile = check_bam(alignmentfile, samtype=source)
+        regions = split_regions(samfile, pieces=threads * REGIONS_PER_THREAD)
+        logging.info("Extracting from {} in {} regions.".format(alignmentfile, len(regions)))
+        params.extend((alignmentfile,) + region for region in regions)
+    if threads > 1 and len(params) > 1:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(extract_region, params))
+    else:
+        results = [extract_region(p) for p in params]
+    datadf = pd.DataFrame(
+        data=[read for region in results for read in region],
+        columns=COLUMNS) \
+        .dropna(axis='columns', how='all') \
+        .dropna(axis='index', how='any') \
+        .reset_index(drop=True)
+    logging.info("Extracted {} primary alignments from {} files.".format(len(datadf), len(files)))
+    if len(datadf) == 0:
+        logging.critical("No reads retrieved.")
+        sys.exit("Fatal: No reads found in input.")
+    return datadf
@@ -0,0 +1,262 @@
+"""
+Processing the runs of a manifest in a single batch.
+
+The manifest lists a run per row of a tsv file, or per object of a json list, with the fields
+  source   the NanoPlot input source of the run, e.g. fastq, summary or bam
+  files    the input files, separated by whitespace in tsv
+  name     the name of the run in the index, by default run<number>
+  outdir   the output directory, by default the name of the run
+  prefix   the prefix of the output files, by default none
+  options  further NanoPlot arguments of this run, e.g. '--maxlength 40000 --plots dot',
+           in json also as a list of arguments or an object of option names and values
+Relative paths are taken relative to the directory of the manifest.
+
+The plotting libraries are loaded and set up once, after which every run is executed in a
+process forked from the batch, at most --workers at the same time. These processes are not
+daemonic, such that a run can start its own pool of processes with --threads. A run which
+fails is reported and doesn't stop the batch. Finally an index of the runs with their main
+statistics, their reports and the errors of failed runs is written as tsv and html.
+"""
+
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import shlex
+import sys
+import signal
+import time
+from argparse import ArgumentParser
+from collections import deque
+from html import escape
+from multiprocessing.connection import wait
+from nanoplot.server import execute, warm_up
+from nanoplot.utils import html_head
+
+SOURCES = ["fastq", "fasta", "fastq_rich", "fastq_minimal", "summary", "bam", "ubam", "cram",
+           "pickle", "feather"]
+INDEX_FEATURES = ["Number of reads", "Total bases", "Median read length", "Read length N50",
+                  "Mean read quality"]
+
+
+def option_arguments(options):
+    """Return the list of arguments of the options of a run, given as string, list or dict."""
+    if not options:
+        return []
+    if isinstance(options, str):
+        return shlex.split(options)
+    if isinstance(options, list):
+        return [str(o) for o in options]
+    arguments = []
+    for name, value in options.items():
+        option = "--" + name.lstrip("-")
+        if value is True:
+            arguments.append(option)
+        elif isinstance(value, list):
+            arguments.extend([option] + [str(v) for v in value])
+        elif value is not None and value is not False:
+            arguments.extend([option, str(value)])
+    return arguments
+
+
+def read_manifest(manifest):
+    """Return the runs of the manifest as dicts with their name, outdir and NanoPlot arguments."""
+    with open(manifest) as handle:
+        if manifest.endswith(".json"):
+            entries = json.load(handle)
+        else:
+            entries = list(csv.DictReader(
+                (line for line in handle if line.strip() and not line.startswith("#")),
+                delimiter="\t"))
+    if not isinstance(entries, list):
+        sys.exit("ERROR: The manifest {} should hold a list of runs.".format(manifest))
+    runs = []
+    for number, entry in enumerate(entries, start=1):
+        source = entry.get("source")
+        if source not in SOURCES:
+            sys.exit("ERROR: Run {} of the manifest has source {}, expected one of {}."
+                     .format(number, source, ", ".join(SOURCES)))
+        files = entry.get("files")
+        files = shlex.split(files) if isinstance(files, str) else files
+        if not files:
+            sys.exit("ERROR: Run {} of the manifest has no files.".format(number))
+        name = entry.get("name") or "run{}".format(number)
+        outdir = entry.get("outdir") or name
+        prefix = entry.get("prefix") or ""
+        runs.append({"name": name,
+                     "outdir": outdir,
+                     "prefix": prefix,
+                     "args": ["--" + source] + [str(f) for f in files]
+                     + ["--outdir", outdir, "--prefix", prefix]
+                     + option_arguments(entry.get("options"))})
+    outputs = [(os.path.normpath(run["outdir"]), run["prefix"]) for run in runs]
+    duplicates = set(o for o in outputs if outputs.count(o) > 1)
+    if duplicates:
+        sys.exit("ERROR: Runs of the manifest write to the same outdir and prefix: {}".format(
+            ", ".join(os.path.join(outdir, prefix) for outdir, prefix in sorted(duplicates))))
+    return runs
+
+
+def run_batch_entry(run, common, cwd):
+    """Execute a run of the batch in a worker and return its result."""
+    started = time.time()
+    start = time.perf_counter()
+    settings, error = execute(common + run["args"], cwd)
+    result = {"name": run["name"],
+              "status": "failed" if error else "done",
+              "error": error,
+              "wall_time": round(time.perf_counter() - start, 2),
+              "report": None,
+              "stats": {}}
+    if settings:
+        report = os.path.join(cwd, settings["path"] + "NanoPlot-report.html")
+        # not a report left in the outdir by an earlier run, allowing for a coarse mtime
+        if os.path.isfile(report) and os.path.getmtime(report) >= int(started):
+            result["report"] = report
+        if settings.get("stats"):
+            result["stats"] = {f: values[0] for f, values in settings["stats"][-1].general()}
+    return result
+
+
+def run_batch_process(run, common, cwd, connection, initialize=False):
+    """Execute a run of the batch in its own process and send its result to the batch."""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if initialize:
+        warm_up()
+    connection.send(run_batch_entry(run, common, cwd))
+    connection.close()
+
+
+def failed_result(run, error):
+    return {"name": run["name"], "status": "failed", "report": None, "stats": {},
+            "error": error, "wall_time": None}
+
+
+def run_batch(runs, common, cwd, workers):
+    """Execute the runs on at most workers processes, return their results in order of the runs.
+
+    With fork the processes inherit the loaded and set up libraries, otherwise every
+    process loads those when it starts
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        warm_up()
+        context = multiprocessing.get_context("fork")
+        initialize = False
+    else:
+        context = multiprocessing.get_context("spawn")
+        initialize = True
+    queue = deque(enumerate(runs))
+    running = {}
+    results = {}
+    try:
+        while queue or running:
+            while queue and len(running) < workers:
+                index, run = queue.popleft()
+                connection, child_connection = context.Pipe(duplex=False)
+                process = context.Process(target=run_batch_process,
+                                          args=(run, common, cwd, child_connection, initialize))
+                process.start()
+                child_connection.close()
+                running[process.sentinel] = (index, process, connection)
+            for sentinel in wait(list(running)):
+                index, process, connection = running.pop(sentinel)
+                run = runs[index]
+                try:
+                    result = connection.recv()
+                except EOFError:  # the process died, e.g. killed for running out of memory
+                    result = failed_result(
+                        run, "process exited with status {}".format(process.exitcode))
+                connection.close()
+                process.join()
+                results[index] = result
+                if result["error"]:
+                    logging.warning("Run {} failed: {}".format(run["name"], result["error"]))
+                else:
+                    logging.info("Finished run {} in {}s.".format(run["name"],
+                                                                  result["wall_time"]))
+                logging.info("Finished {} of {} runs.".format(len(results), len(runs)))
+    finally:
+        for _, process, _ in running.values():
+            process.terminate()
+            process.join()
+    return [results[i] for i in range(len(runs))]
+
+
+def write_index(results, outdir):
+    """Write the index of the results to NanoPlot-batch.tsv and .html in outdir."""
+    header = ["Run", "Status", "Duration"] + INDEX_FEATURES + ["Report", "Error"]
+    with open(os.path.join(outdir, "NanoPlot-batch.tsv"), 'w') as index:
+        index.write("\t".join(header) + "\n")
+        for r in results:
+            index.write("\t".join(
+                [r["name"], r["status"], str(r["wall_time"])]
+                + [str(round(r["stats"][f], 1)) if f in r["stats"] else "NA"
+                   for f in INDEX_FEATURES]
+                + [r["report"] or "NA", " ".join((r["error"] or "").split())]) + "\n")
+    htmlindex = os.path.join(outdir, "NanoPlot-batch.html")
+    with open(htmlindex, 'w') as html_file:
+        html_file.write(html_head.replace("NanoPlot Report", "NanoPlot batch"))
+        html_file.write('<body>\n<div class="panel panelM"> <h1>NanoPlot batch</h1>\n')
+        failed = sum(r["status"] != "done" for r in results)
+        html_file.write('<p>{} runs, {} failed</p>\n'.format(len(results), failed))
+        html_file.write('<table>\n<tr>{}</tr>\n'.format(
+            "".join("<th>{}</th>".format(escape(h)) for h in header)))
+        for r in results:
+            if r["report"]:
+                link = '<a href="{}">report</a>'.format(
+                    escape(os.path.relpath(r["report"], os.path.abspath(outdir))))
+            else:
+                link = ""
+            cells = [escape(r["name"]), r["status"], escape(str(r["wall_time"]))] \
+                + ["{:,.1f}".format(r["stats"][f]) if f in r["stats"] else ""
+                   for f in INDEX_FEATURES] \
+                + [link, escape(r["error"] or "")]
+            html_file.write('<tr>{}</tr>\n'.format("".join("<td>{}</td>".format(c)
+                                                           for c in cells)))
+        html_file.write('</table>\n</div></body></html>')
+    return htmlindex
+
+
+def main():
+    args, common = get_args()
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    runs = read_manifest(args.manifest)
+    logging.info("Processing {} runs of {} on {} worker(s).".format(
+        len(runs), args.manifest, args.workers))
+    results = run_batch(runs,
+                        common=common,
+                        cwd=os.path.dirname(os.path.abspath(args.manifest)),
+                        workers=args.workers)
+    os.makedirs(args.index_dir, exist_ok=True)
+    htmlindex = write_index(results, args.index_dir)
+    failed = [r["name"] for r in results if r["status"] != "done"]
+    logging.info("Wrote index of the runs to {}".format(htmlindex))
+    if failed:
+        sys.exit("ERROR: {} of {} runs failed: {}".format(
+            len(failed), len(runs), ", ".join(failed)))
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Create the plots and reports of the runs listed in a manifest. "
+                    "Further arguments are NanoPlot options applied to every run, "
+                    "which the options of a run in the manifest override.",
+        allow_abbrev=False)
+    parser.add_argument("manifest",
+                        help="Tsv or json file listing the runs, see the documentation.")
+    parser.add_argument("-w", "--workers",
+                        help="Number of runs executed at the same time.",
+                        default=1,
+                        type=int)
+    parser.add_argument("--index_dir",
+                        help="Directory to write the index of the runs to.",
+                        default=".")
+    args, common = parser.parse_known_args()
+    if args.workers < 1:
+        parser.error("--workers should be at least 1")
+    return args, common
+
+
+if __name__ == "__main__":
+    main()
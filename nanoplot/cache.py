@@ -0,0 +1,122 @@
+"""
+Automatic cache of extracted data, to avoid parsing the same input files again.
+
+Every entry is a feather file (see nanoplot.store) named after a hash of
+the source type, the input files with their size and modification time and the
+options which affect the extraction. Entries are touched when used, and the
+least recently used entries are removed once the cache exceeds its maximum size.
+Entries which can't be read, e.g. truncated by a full disk, are removed and
+extracted again, as are temporary files left by runs which were interrupted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from os import path
+import pyarrow as pa
+import nanoplot.store as store
+from nanoplot.version import __version__
+
+STALE_TMP_AGE = 3600  # seconds after which a temporary file is no longer being written
+
+
+def default_cache_dir():
+    """Return $NANOPLOT_CACHE or the NanoPlot directory in the user cache directory."""
+    return os.environ.get("NANOPLOT_CACHE") or path.join(
+        os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache"), "NanoPlot")
+
+
+def cache_key(source, files, settings):
+    """Return a hash identifying the extracted data of these files.
+
+    Returns None if not all inputs are regular files (e.g. streamed from stdin)
+    as those cannot be identified reliably.
+    """
+    if not all(path.isfile(f) for f in files):
+        return None
+    key = {
+        "source": source,
+        "files": [(path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files],
+        "readtype": settings["readtype"],
+        "barcoded": bool(settings["barcoded"]),
+        "alength": bool(settings.get("alength")),
+        "version": __version__,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def entry_path(cache_dir, key):
+    return path.join(cache_dir, key + ".feather")
+
+
+def fetch(cache_dir, key, columns=None):
+    """Return the cached DataFrame for key, or None if it is not in the cache.
+
+    An entry which can't be read is removed and treated as not in the cache.
+    """
+    filename = entry_path(cache_dir, key)
+    if not path.isfile(filename):
+        return None
+    try:
+        os.utime(filename)  # marks the entry as recently used
+        df = store.read_store(filename, columns=columns)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        logging.warning("Removing unreadable cache entry {}: {}".format(filename, e))
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        return None
+    logging.info("Using cached data from {}".format(filename))
+    return df
+
+
+def save(df, cache_dir, key, metadata, max_size):
+    """Add the DataFrame to the cache and evict old entries to stay below max_size bytes.
+
+    Failing to write to the cache is not fatal, this is only logged.
+    """
+    filename = entry_path(cache_dir, key)
+    tmp = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a unique temporary file first, so that concurrent runs never read
+        # a partial entry nor write to the same file
+        handle, tmp = tempfile.mkstemp(dir=cache_dir, prefix=key + ".", suffix=".tmp")
+        os.close(handle)
+        store.write_store(df, tmp, metadata)
+        os.replace(tmp, filename)
+        tmp = None
+        evict(cache_dir, max_size)
+    except OSError as e:
+        logging.warning("Could not write to the cache directory {}: {}".format(cache_dir, e))
+    finally:
+        if tmp is not None and path.exists(tmp):
+            os.remove(tmp)
+
+
+def evict(cache_dir, max_size):
+    """Remove least recently used entries until the cache is smaller than max_size bytes.
+
+    Temporary files older than STALE_TMP_AGE, left by interrupted runs, are removed as well
+    """
+    entries = []
+    for f in os.listdir(cache_dir):
+        if f.endswith(".feather"):
+            stat = os.stat(path.join(cache_dir, f))
+            entries.append((stat.st_mtime, stat.st_size, f))
+        elif f.endswith(".tmp") and \
+                os.stat(path.join(cache_dir, f)).st_mtime < time.time() - STALE_TMP_AGE:
+            os.remove(path.join(cache_dir, f))
+            logging.info("Removed stale temporary file {} from the cache".format(f))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in entries[:-1]:  # never evict the most recent entry
+        if total <= max_size:
+            break
+        os.remove(path.join(cache_dir, f))
+        total -= size
+        logging.info("Removed {} from the cache".format(f))
@@ -0,0 +1,143 @@
+"""
+Submitting runs to a NanoPlot server.
+
+The server (see nanoplot.server) listens on a local Unix socket. Every request is
+a single line of json sent over a new connection, answered with a single line of json.
+A run is submitted as the list of its NanoPlot arguments with the working directory
+against which relative paths are resolved, after which its status can be queried.
+This module only uses the standard library, such that submitting a run starts fast.
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+def default_socket():
+    """Return the socket of the server of this user, unless set by the NANOPLOT_SOCKET variable."""
+    return os.environ.get("NANOPLOT_SOCKET") or os.path.join(
+        tempfile.gettempdir(), "nanoplot-{}.sock".format(os.getuid()))
+
+
+def send_message(connection, message):
+    connection.sendall(json.dumps(message).encode() + b"\n")
+
+
+def receive_message(connection):
+    """Return the json message of a line received on the connection, None if it was closed."""
+    data = b""
+    while not data.endswith(b"\n"):
+        received = connection.recv(65536)
+        if not received:
+            return None
+        data += received
+    return json.loads(data.decode())
+
+
+def request(socketfile, message):
+    """Send a request to the server listening on socketfile and return its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socketfile)
+        except (FileNotFoundError, ConnectionRefusedError):
+            sys.exit("ERROR: No NanoPlot server is listening on {}.".format(socketfile))
+        send_message(connection, message)
+        answer = receive_message(connection)
+    if answer is None:
+        sys.exit("ERROR: The NanoPlot server closed the connection.")
+    if answer.get("error") and "job" not in answer:
+        sys.exit("ERROR: {}".format(answer["error"]))
+    return answer
+
+
+def format_job(job):
+    """Return a line with the id, status, duration and arguments or error of a job."""
+    if job["started"] is not None:
+        duration = "{:.1f}s".format((job["finished"] or time.time()) - job["started"])
+    else:
+        duration = "-"
+    return "\t".join([job["job"], job["status"], duration,
+                      job["error"] or " ".join(job["args"])])
+
+
+def wait_for(socketfile, jobs, interval=0.5):
+    """Poll the server until the jobs are finished, return their final status."""
+    while True:
+        answer = request(socketfile, {"action": "status", "jobs": jobs})
+        if all(job["status"] in FINISHED for job in answer["jobs"]):
+            return answer["jobs"]
+        time.sleep(interval)
+
+
+def main():
+    args = get_args()
+    if args.action == "submit":
+        if not args.arguments:
+            sys.exit("ERROR: Give the arguments of the NanoPlot run to submit.")
+        answer = request(args.socket, {"action": "submit",
+                                       "args": args.arguments,
+                                       "cwd": os.getcwd()})
+        if not args.wait:
+            print(answer["job"])
+            return
+        job = wait_for(args.socket, [answer["job"]])[0]
+        print(format_job(job))
+        if job["status"] != "done":
+            sys.exit(1)
+    elif args.action == "status":
+        answer = request(args.socket, {"action": "status", "jobs": args.jobs or None})
+        for job in answer["jobs"]:
+            print(format_job(job))
+    elif args.action == "wait":
+        jobs = wait_for(args.socket, args.jobs or None)
+        for job in jobs:
+            print(format_job(job))
+        if any(job["status"] != "done" for job in jobs):
+            sys.exit(1)
+    elif args.action == "shutdown":
+        answer = request(args.socket, {"action": "shutdown"})
+        print("Server stops after finishing {} running job(s).".format(answer["running"]))
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Submit NanoPlot runs to a NanoPlot server and query their status.")
+    parser.add_argument("--socket",
+                        help="Socket on which the server listens.",
+                        default=default_socket())
+    parser.add_argument("--wait",
+                        help="Wait until the submitted run is finished, "
+                             "exit with an error if it failed.",
+                        action="store_true")
+    actions = parser.add_subparsers(dest="action", metavar="action")
+    actions.required = True
+    actions.add_parser(
+        "submit",
+        help="Submit a run, printing its job id.",
+        description="Submit a run with the NanoPlot arguments following submit, e.g. "
+                    "'NanoPlot-client submit --summary sequencing_summary.txt -o outdir'. "
+                    "Relative paths are resolved against the current directory.")
+    status = actions.add_parser("status", help="Print the status of all or the given jobs.")
+    status.add_argument("jobs", help="Job ids.", nargs="*")
+    wait = actions.add_parser("wait", help="Wait until all or the given jobs are finished.")
+    wait.add_argument("jobs", help="Job ids.", nargs="*")
+    actions.add_parser("shutdown", help="Stop the server once the running jobs are finished.")
+    # the arguments of the run are not parsed here, but passed on to the server as they are
+    argv = sys.argv[1:]
+    arguments = []
+    if "submit" in argv:
+        index = argv.index("submit")
+        argv, arguments = argv[:index + 1], argv[index + 1:]
+    args = parser.parse_args(argv)
+    args.arguments = arguments
+    return args
+
+
+if __name__ == "__main__":
+    main()
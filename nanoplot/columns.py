@@ -0,0 +1,38 @@
+"""
+Cached column arrays for plotting.
+
+The reads passing the length_filter are selected once per dataset or barcode,
+and every column is materialized once as a contiguous numpy array, rather than
+building datadf[datadf["length_filter"]] again for every plot.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class PlotColumns(object):
+    """Columns of a DataFrame as contiguous arrays, all reads or those passing length_filter."""
+
+    def __init__(self, df):
+        self.df = df
+        if "length_filter" in df and not df["length_filter"].all():
+            self.selection = np.flatnonzero(df["length_filter"].values)
+        else:
+            self.selection = None  # no reads are hidden, filtered columns are the full columns
+        self.cache = {}
+
+    def __contains__(self, column):
+        return column in self.df
+
+    def get(self, column, filtered=False):
+        """Return the column as a Series backed by a contiguous array.
+
+        With filtered=True only the reads passing the length_filter are returned
+        """
+        key = (column, filtered and self.selection is not None)
+        if key not in self.cache:
+            values = self.df[column].values
+            if key[1]:
+                values = values[self.selection]
+            self.cache[key] = pd.Series(np.ascontiguousarray(values), name=column)
+        return self.cache[key]
@@ -0,0 +1,215 @@
+"""
+Fast extraction of read lengths and qualities from fastq and fasta files.
+
+Files are decompressed in large blocks, in which the record boundaries are
+found in bulk by locating all newlines with numpy, rather than parsing every
+record in python. Read lengths follow from the positions of the newlines, and
+average qualities are computed over the raw bytes of the quality lines using a
+lookup table of the error probability of every Phred+33 encoded byte.
+Multiple files are processed in parallel.
+Fastq files are expected to have records of four lines, as produced by the
+basecallers. Other fastq files are processed by nanoget.
+"""
+
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+BLOCKSIZE = 8 * 1024**2  # bytes decompressed at once
+NEWLINE, CARRIAGE_RETURN = ord("\n"), ord("\r")
+# error probability of every byte as Phred+33 encoded quality, bytes below '!' don't occur
+ERROR_PROBABILITIES = 10 ** ((np.arange(256) - 33).clip(0) / -10)
+
+
+def open_compressed(filename):
+    """Return a binary handle to the (gzip, bgzip or bz2 compressed) fastq or fasta file."""
+    if filename.endswith(('.gz', 'bgz')):
+        import gzip
+        return gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        import bz2
+        return bz2.open(filename, 'rb')
+    elif filename.endswith(('.fastq', '.fq', 'fasta', '.fa', '.fas')):
+        return open(filename, 'rb')
+    else:
+        logging.error("INPUT ERROR: Unrecognized file extension {}".format(filename))
+        sys.exit('INPUT ERROR:\nUnrecognized file extension in {}\n'
+                 'Supported are gz, bz2, bgz, fastq, fq, fasta, fa and fas'.format(filename))
+
+
+def read_blocks(filename, blocksize=BLOCKSIZE):
+    """Yield the decompressed content of a file in blocks, with a trailing newline at the end."""
+    with open_compressed(filename) as handle:
+        block = handle.read(blocksize)
+        while block:
+            following = handle.read(blocksize)
+            if not following and not block.endswith(b"\n"):
+                block += b"\n"
+            yield block
+            block = following
+
+
+def line_ends(buf, newlines):
+    """Return the end of the lines ending at the newlines, excluding carriage returns."""
+    return newlines - (buf[np.maximum(newlines - 1, 0)] == CARRIAGE_RETURN)
+
+
+def average_qualities(buf, starts, ends):
+    """Return the average quality of the Phred+33 encoded quality lines from starts to ends."""
+    if starts.size == 0:
+        return np.empty(0)
+    boundaries = np.empty(starts.size * 2, dtype=np.int64)
+    boundaries[0::2] = starts
+    boundaries[1::2] = ends
+    sums = np.add.reduceat(ERROR_PROBABILITIES[buf], boundaries)[0::2]
+    qual_lengths = ends - starts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(qual_lengths > 0, -10 * np.log10(sums / qual_lengths), np.nan)
+
+
+def parse_fastq_block(data, quals=True, headers=False):
+    """Return the lengths, average qualities and optionally headers of the records in data.
+
+    Only complete records are parsed, the number of bytes parsed is returned last.
+    Without quals the qualities are None, which saves most of the work for long reads.
+    A ValueError is raised if the records don't consist of four lines
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == NEWLINE)
+    number = newlines.size // 4
+    ends = newlines[:number * 4].reshape(number, 4)
+    starts = np.empty_like(ends)
+    starts[:, 0] = np.concatenate([[0], ends[:-1, 3] + 1]) if number else []
+    starts[:, 1:] = ends[:, :-1] + 1
+    if not ((buf[starts[:, 0]] == ord("@")).all() and (buf[starts[:, 2]] == ord("+")).all()):
+        raise ValueError("Records of fastq file don't consist of four lines.")
+    ends = line_ends(buf, ends)
+    lengths = ends[:, 1] - starts[:, 1]
+    if quals:
+        quals = average_qualities(buf, starts[:, 3], ends[:, 3])
+    else:
+        quals = None
+    parsed = int(newlines[number * 4 - 1]) + 1 if number else 0
+    if headers:
+        header_lines = [data[s + 1:e] for s, e in zip(starts[:, 0].tolist(), ends[:, 0].tolist())]
+        return lengths, quals, header_lines, parsed
+    return lengths, quals, parsed
+
+
+def fastq_metrics(filename, quals=True, headers=False):
+    """Return the lengths, average qualities and optionally headers of all reads in a fastq."""
+    lengths, qualities, header_lines = [], [], []
+    rest = b""
+    for block in read_blocks(filename):
+        data = rest + block
+        result = parse_fastq_block(data, quals, headers)
+        lengths.append(result[0])
+        qualities.append(result[1])
+        if headers:
+            header_lines.extend(result[2])
+        rest = data[result[-1]:]
+    if rest.strip():
+        raise ValueError("Fastq file {} ends with an incomplete record.".format(filename))
+    lengths = np.concatenate(lengths) if lengths else np.empty(0, dtype=np.int64)
+    if quals:
+        qualities = np.concatenate(qualities) if qualities else np.empty(0)
+    else:
+        qualities = None
+    return (lengths, qualities, header_lines) if headers else (lengths, qualities)
+
+
+def fasta_lengths(filename):
+    """Return the lengths of all sequences in a (multi-line) fasta file.
+
+    Only the length of the sequence being read is kept between blocks, not its content
+    """
+    lengths = []
+    current = None  # length so far of the sequence being read
+    rest = b""  # a header line which is not yet complete
+    at_line_start = True
+    for block in read_blocks(filename):
+        data = rest + block
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == NEWLINE)
+        returns = np.flatnonzero(buf == CARRIAGE_RETURN)
+        line_starts = newlines + 1
+        line_starts = line_starts[line_starts < buf.size]
+        if at_line_start:
+            line_starts = np.concatenate([[0], line_starts])
+        headers = line_starts[buf[line_starts] == ord(">")]
+        header_ends = np.searchsorted(newlines, headers)
+        if header_ends.size and header_ends[-1] == newlines.size:  # incomplete last header
+            rest, headers, header_ends = data[headers[-1]:], headers[:-1], header_ends[:-1]
+            end = buf.size - len(rest)
+        else:
+            rest, end = b"", buf.size
+        at_line_start = bool(rest) or data.endswith(b"\n")
+
+        def residues(start, stop):
+            """Return the number of bytes between start and stop which are not line breaks."""
+            breaks = (np.searchsorted(newlines, stop) - np.searchsorted(newlines, start) +
+                      np.searchsorted(returns, stop) - np.searchsorted(returns, start))
+            return stop - start - breaks
+
+        seq_starts = newlines[header_ends] + 1
+        seq_stops = np.concatenate([headers[1:], [end]]).astype(np.int64)
+        if current is not None:
+            current += int(residues(0, headers[0] if headers.size else end))
+        if headers.size:
+            if current is not None:
+                lengths.append(current)
+            lengths.extend(residues(seq_starts[:-1], seq_stops[:-1]).tolist())
+            current = int(residues(seq_starts[-1], seq_stops[-1]))
+    if rest:
+        if current is not None:
+            lengths.append(current)
+        current = 0
+    if current is not None:
+        lengths.append(current)
+    return np.array(lengths, dtype=np.int64)
+
+
+def extract_file(params):
+    """Return a DataFrame with the metrics of a single fastq or fasta file."""
+    filename, source = params
+    logging.info("Extracting {} metrics from {}.".format(source, filename))
+    if source == "fasta":
+        return pd.DataFrame({"lengths": fasta_lengths(filename)})
+    if source == "fastq_minimal":
+        try:
+            lengths, _, headers = fastq_metrics(filename, quals=False, headers=True)
+            timestamps = pd.to_datetime([h.split(b" ")[4][11:-1].decode() for h in headers])
+        except (IndexError, ValueError):
+            logging.error("Fatal: Incorrect file structure for fastq_minimal")
+            sys.exit("Error: file does not match expected structure for fastq_minimal")
+        return pd.DataFrame({"timestamp": timestamps, "lengths": lengths})
+    try:
+        lengths, quals = fastq_metrics(filename)
+    except ValueError as e:
+        from nanoget.extraction_functions import process_fastq_plain
+        logging.warning("{} Processing {} using nanoget.".format(e, filename))
+        return process_fastq_plain(filename)
+    return pd.DataFrame({"quals": quals, "lengths": lengths}).dropna()
+
+
+def extract_sequences(files, source="fastq", threads=4):
+    """Return a DataFrame with the metrics of the fastq or fasta files.
+
+    For fastq_minimal the start_time of the reads is calculated from their timestamps
+    """
+    params = [(f, source) for f in files]
+    if threads > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(threads, len(files))) as executor:
+            datadf = pd.concat(executor.map(extract_file, params), ignore_index=True)
+    else:
+        datadf = pd.concat([extract_file(p) for p in params], ignore_index=True)
+    if "timestamp" in datadf:
+        datadf["start_time"] = datadf["timestamp"] - datadf["timestamp"].min()
+        datadf = datadf.drop(columns="timestamp")
+    logging.info("Extracted metrics of {} reads from {} files.".format(len(datadf), len(files)))
+    if len(datadf) == 0:
+        logging.critical("No reads retrieved.")
+        sys.exit("Fatal: No reads found in input.")
+    return datadf
@@ -12,8 +12,83 @@ def phred_to_percent(phred):
     return 100 * (1 - 10 ** (phred / -10))
 
 
-def non_filtered_reads(df):
-    return len(df[df["length_filter"]])
+def flag_filtered(mask, flagged):
+    """Unset the flagged reads in mask (in place) and return how many reads were newly flagged."""
+    number = np.count_nonzero(flagged & mask)
+    mask &= ~flagged
+    return number
+
+
+FILTER_MESSAGES = {
+    "drop_outliers": "Hidding {} length outliers in length plots.",
+    "maxlength": "Hidding {} reads longer than {}bp in length plots.",
+    "minlength": "Hidding {} reads shorter than {}bp in length plots.",
+    "minqual": "Removing {} reads with quality below Q{}.",
+    "runtime_from": "Removing {} reads generated in the first {} hours of the run.",
+    "runtime_until": "Removing {} reads generated after {} hours in the run.",
+    "artefacts": "Removed {} artefactual reads with very short length and very high quality.",
+}
+
+
+def set_lengths_pointer(settings):
+    """Set which lengths to use: aligned (bam mode with --alength) or sequenced read lengths."""
+    if settings.get("alength") and settings.get("bam"):
+        settings["lengths_pointer"] = "aligned_lengths"
+        logging.info("Using aligned read lengths for plotting.")
+    else:
+        settings["lengths_pointer"] = "lengths"
+        logging.info("Using sequenced read lengths for plotting.")
+
+
+def started_before(df, hours):
+    """Return a mask of the reads started before hours in the run, or without start time."""
+    return ~(df["start_time"] >= timedelta(hours=hours)).values
+
+
+def started_after(df, hours):
+    """Return a mask of the reads started from hours in the run on, or without start time."""
+    return ~(df["start_time"] < timedelta(hours=hours)).values
+
+
+def filter_masks(df, settings):
+    '''
+    Return the boolean masks keep and length_filter for the reads in df,
+    and a dict with the number of reads flagged by every active filter
+    The length filters only consider settings["lengths_pointer"]
+    '''
+    lengths = df[settings["lengths_pointer"]].values
+    length_filter = np.ones(len(df), dtype=bool)
+    keep = np.ones(len(df), dtype=bool)
+    flagged = {}
+
+    if settings.get("drop_outliers"):
+        flagged["drop_outliers"] = flag_filtered(
+            length_filter, flag_length_outliers(df, settings["lengths_pointer"]).values)
+    if settings.get("maxlength"):
+        flagged["maxlength"] = flag_filtered(length_filter, lengths > settings["maxlength"])
+    if settings.get("minlength"):
+        flagged["minlength"] = flag_filtered(length_filter, lengths < settings["minlength"])
+    if settings.get("minqual"):
+        flagged["minqual"] = flag_filtered(keep, ~(df["quals"].values > settings["minqual"]))
+    if settings.get("runtime_from"):
+        flagged["runtime_from"] = flag_filtered(
+            keep, started_before(df, settings["runtime_from"]))
+    if settings.get("runtime_until"):
+        flagged["runtime_until"] = flag_filtered(
+            keep, started_after(df, settings["runtime_until"]))
+    if "quals" in df:
+        flagged["artefacts"] = flag_filtered(
+            keep, (df["lengths"].values < 20) & (df["quals"].values > 30))
+    return keep, length_filter, flagged
+
+
+def log_filtered(flagged, settings):
+    """Log the number of reads flagged per filter and return if reads were removed."""
+    for name, number in flagged.items():
+        if name != "artefacts" or number > 0:
+            logging.info(FILTER_MESSAGES[name].format(str(number), str(settings.get(name))))
+    return "minqual" in flagged or "runtime_from" in flagged or "runtime_until" in flagged \
+        or flagged.get("artefacts", 0) > 0
 
 
 def filter_and_transform_data(df, settings):
@@ -23,93 +98,38 @@ def filter_and_transform_data(df, settings):
     - hide outliers from length plots*
     - hide reads longer than maxlength or shorter than minlength from length plots*
     - filter reads with a quality below minqual
+    - filter reads generated before runtime_from or after runtime_until hours
     - use log10 scaled reads rather than normal
     - use empirical percent accuracy rather than phred score quality
-    - downsample reads to args.downsample
 
     - always: drop reads which are basecaller artefacts
               judged by length below 20 and quality above 30
 
     * using a boolean column length_filter
-    '''
-    df["length_filter"] = True
-    settings["filtered"] = False
 
-    if settings.get("alength") and settings.get("bam"):
-        settings["lengths_pointer"] = "aligned_lengths"
-        logging.info("Using aligned read lengths for plotting.")
-    else:
-        settings["lengths_pointer"] = "lengths"
-        logging.info("Using sequenced read lengths for plotting.")
-
-    if settings.get("drop_outliers"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[flag_length_outliers(df, settings["lengths_pointer"]), "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
-        logging.info("Hidding {} length outliers in length plots.".format(
-            str(num_reads_prior - num_reads_post)))
-
-    if settings.get("maxlength"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[df[settings["lengths_pointer"]] > settings["maxlength"], "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
-        logging.info("Hidding {} reads longer than {}bp in length plots.".format(
-            str(num_reads_prior - num_reads_post),
-            str(settings["maxlength"])))
-
-    if settings.get("minlength"):
-        num_reads_prior = non_filtered_reads(df)
-        df.loc[df[settings["lengths_pointer"]] < settings["minlength"], "length_filter"] = False
-        num_reads_post = non_filtered_reads(df)
-        logging.info("Hidding {} reads shorter than {}bp in length plots.".format(
-            str(num_reads_prior - num_reads_post),
-            str(settings["minlength"])))
+    All filters are combined in boolean masks, and the reads are removed in a single step
+    Downsampling with --downsample only applies to the bivariate plots, see nanoplot.sampling
+    '''
+    set_lengths_pointer(settings)
+    keep, length_filter, flagged = filter_masks(df, settings)
+    settings["filtered"] = log_filtered(flagged, settings)
 
-    if settings.get("minqual"):
-        num_reads_prior = non_filtered_reads(df)
-        df = df.loc[df["quals"] > settings["minqual"]].copy()
-        num_reads_post = non_filtered_reads(df)
-        logging.info("Removing {} reads with quality below Q{}.".format(
-            str(num_reads_prior - num_reads_post),
-            str(settings["minqual"])))
-        settings["filtered"] = True
+    if not keep.all():
+        df = df.take(np.flatnonzero(keep))
+        length_filter = length_filter[keep]
+    df["length_filter"] = length_filter
 
     if settings.get("loglength"):
-        df["log_" + settings["lengths_pointer"]] = np.log10(df[settings["lengths_pointer"]])
+        df["log_" + settings["lengths_pointer"]] = np.log10(
+            df[settings["lengths_pointer"]].values, dtype=np.float32)
         settings["lengths_pointer"] = "log_" + settings["lengths_pointer"]
         logging.info("Using log10 scaled read lengths.")
         settings["logBool"] = True
     else:
         settings["logBool"] = False
 
-    if settings.get("runtime_until"):
-        num_reads_prior = non_filtered_reads(df)
-        df = df[df.start_time < timedelta(hours=settings["runtime_until"])]
-        num_reads_post = non_filtered_reads(df)
-        logging.info("Removing {} reads generated after {} hours in the run.".format(
-            str(num_reads_prior - num_reads_post),
-            str(settings["runtime_until"])))
-        settings["filtered"] = True
-
-    if "quals" in df:
-        num_reads_prior = len(df)
-        df = df.loc[-((df["lengths"] < 20) & (df["quals"] > 30))].copy()
-        num_reads_post = len(df)
-        if num_reads_prior - num_reads_post > 0:
-            logging.info(
-                "Removed {} artefactual reads with very short length and very high quality."
-                .format(num_reads_prior - num_reads_post))
-            settings["filtered"] = True
-
-    if settings.get("downsample"):
-        new_size = min(settings["downsample"], len(df))
-        logging.info("Downsampling the dataset from {} to {} reads".format(
-            len(df), new_size))
-        df = df.sample(new_size)
-        settings["filtered"] = True
-
     if settings.get("percentqual"):
-        df["quals"] = df["quals"].apply(phred_to_percent)
+        df["quals"] = phred_to_percent(df["quals"])
         logging.info("Converting quality scores to theoretical percent identities.")
 
     return(df, settings)
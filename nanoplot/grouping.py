@@ -0,0 +1,68 @@
+"""
+Splitting the data per barcode in a single pass.
+
+The reads are ordered by barcode once, after which the reads of every barcode
+are a contiguous slice of the sorted DataFrame, rather than scanning all reads
+again for every barcode.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class BarcodeGroups(object):
+    """Reads of a DataFrame grouped per barcode, in order of first appearance."""
+
+    def __init__(self, df, column="barcode"):
+        codes, names = pd.factorize(df[column])
+        if len(names) < np.iinfo(np.int16).max:
+            codes = codes.astype(np.int16)  # allows numpy to use a linear time radix sort
+        # reads without barcode have code -1, are sorted first and are skipped
+        self.set_groups(df.take(np.argsort(codes, kind="stable")), list(names),
+                        np.bincount(codes[codes >= 0], minlength=len(names)),
+                        np.count_nonzero(codes < 0))
+        self.column = column
+
+    def set_groups(self, df, names, sizes, unassigned):
+        self.df = df
+        self.names = names
+        self.sizes = sizes
+        self.offsets = np.cumsum(np.concatenate([[unassigned], self.sizes]))
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def subset(self, df):
+        """Return the BarcodeGroups of df, a subset of the reads of self.df in the same order.
+
+        The reads of every barcode are still contiguous, so the groups are found by comparing
+        neighbouring barcodes rather than by sorting again. Barcodes without reads are dropped
+        """
+        barcodes = df[self.column].values
+        unassigned = np.count_nonzero(pd.isna(barcodes))
+        assigned = barcodes[unassigned:]
+        starts = np.flatnonzero(np.concatenate([[True], assigned[1:] != assigned[:-1]])) \
+            if len(assigned) else np.zeros(0, dtype=np.int64)
+        groups = BarcodeGroups.__new__(BarcodeGroups)
+        groups.set_groups(df, list(assigned[starts]), np.diff(np.append(starts, len(assigned))),
+                          unassigned)
+        groups.column = self.column
+        return groups
+
+    def __len__(self):
+        return len(self.names)
+
+    def counts(self):
+        """Return a list of (barcode, number of reads) tuples."""
+        return list(zip(self.names, self.sizes.tolist()))
+
+    def get(self, name):
+        """Return the reads of this barcode as a slice of the sorted DataFrame."""
+        i = self.index[name]
+        return self.df.iloc[self.offsets[i]:self.offsets[i + 1]]
+
+    def unassigned(self):
+        """Return the reads without barcode."""
+        return self.df.iloc[:self.offsets[0]]
+
+    def frames(self):
+        """Return a list with the DataFrame of every barcode."""
+        return [self.get(name) for name in self.names]
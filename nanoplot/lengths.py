@@ -0,0 +1,80 @@
+"""
+Summaries of read lengths without sorting all reads.
+
+Read lengths are integers, so the number of reads per length is an exact
+representation of the lengths which is computed in linear time. Lengths below
+DENSE_LENGTHS are counted with np.bincount, such that its array stays small even if
+some reads are very long, and the rare longer lengths with np.unique. The N50,
+related metrics and the median are derived from the distinct lengths and their
+counts, which are also what the statistics keep (see nanoplot.aggregates.LengthCounts).
+Percentiles of other metrics use partial sorting (selection) instead.
+"""
+
+import numpy as np
+
+# lengths below are counted in a dense array of at most 8MB, longer lengths sparsely
+DENSE_LENGTHS = 2**20
+
+
+def length_counts(lengths):
+    """Return the distinct read lengths in increasing order and the number of reads of each."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    dense = lengths < DENSE_LENGTHS
+    if dense.all():
+        return nonzero_counts(np.bincount(lengths))
+    values, counts = nonzero_counts(np.bincount(lengths[dense]))
+    long_values, long_counts = np.unique(lengths[~dense], return_counts=True)
+    return np.concatenate([values, long_values]), np.concatenate([counts, long_counts])
+
+
+def nonzero_counts(counts):
+    """Return the lengths with a nonzero count in the dense counts, and their counts."""
+    values = np.flatnonzero(counts)
+    return values, counts[values]
+
+
+def nx(values, counts, x=0.5):
+    """Return the read length Nx from the distinct lengths values and their counts.
+
+    As in nanomath, this is the shortest length for which the reads up to that length
+    contain a fraction 1 - x of all bases, such that nx(values, counts, 0.5) is the N50.
+    """
+    bases = np.cumsum(counts * values)
+    return int(values[np.searchsorted(bases, (1 - x) * bases[-1])])
+
+
+def n50(values, counts):
+    return nx(values, counts, 0.5)
+
+
+def ngx(values, counts, genome_size, x=0.5):
+    """Return the read length NGx: the length of the read at which the longest reads
+    together contain a fraction x of the genome size, or None if there are too few bases.
+    """
+    bases = np.cumsum((counts * values)[::-1])
+    if not bases.size or bases[-1] < x * genome_size:
+        return None
+    return int(values[::-1][np.searchsorted(bases, x * genome_size)])
+
+
+def ng50(values, counts, genome_size):
+    return ngx(values, counts, genome_size, 0.5)
+
+
+def median(values, counts):
+    """Return the median read length from the distinct lengths values and their counts."""
+    cumulative = np.cumsum(counts)
+    number_of_reads = cumulative[-1]
+    # the read with 0-based rank k has the length at which cumulative first exceeds k
+    lower = values[np.searchsorted(cumulative, (number_of_reads - 1) // 2, side="right")]
+    upper = values[np.searchsorted(cumulative, number_of_reads // 2, side="right")]
+    return (lower + upper) / 2
+
+
+def percentile(values, q):
+    """Return the q-th percentile of values, equal to np.percentile, using partial sorting."""
+    values = np.asarray(values, dtype=np.float64)
+    rank = (values.size - 1) * q / 100
+    lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+    partitioned = np.partition(values, [lower, upper])
+    return partitioned[lower] + (partitioned[upper] - partitioned[lower]) * (rank - lower)
@@ -0,0 +1,163 @@
+"""
+Instrumentation of the stages and plots of a run.
+
+The stages of main() and every plot job are measured for their wall time, cpu time
+(including that of finished child processes), their peak resident memory and the
+number of reads they processed. On Linux the peak resident memory of the process is
+reset at the start of every stage through /proc/self/clear_refs, such that peak_rss
+is the peak during the stage. Elsewhere, or if resetting fails, peak_rss is None
+and only process_peak_rss, the peak over the lifetime of the process, is recorded.
+Plot jobs are measured in the process which runs them, forked workers send their
+records back with the plots.
+The records are written as json to NanoPlot-metrics.json next to the report,
+from which the duration and memory needs of future runs can be estimated.
+With --profile the main process is also profiled with cProfile.
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from nanoplot.version import __version__
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# records of the current run, lists of dicts as returned by measure()
+stage_records = []
+plot_records = []
+_start = time.perf_counter()
+# the peaks seen so far by the enclosing measurements, which a nested measurement resets
+_enclosing_peaks = []
+# the peak of the process before the last reset, as resetting also resets ru_maxrss
+_process_peak = 0
+
+
+def cpu_time():
+    """Return the cpu seconds used by this process and its finished child processes."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss(who="self"):
+    """Return the peak resident memory in bytes of this process, or of its largest child.
+
+    Returns None on platforms without the resource module
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    peak = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return max(peak, _process_peak) if who == "self" else peak
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process to its current use.
+
+    Returns the peak before resetting in bytes, or None if it can't be reset
+    """
+    global _process_peak
+    peak = current_peak_rss()
+    if peak is None:
+        return None
+    try:
+        with open("/proc/self/clear_refs", 'w') as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return None
+    _process_peak = max(_process_peak, peak)
+    return peak
+
+
+def current_peak_rss():
+    """Return the peak resident memory in bytes since the last reset, None if unknown."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset():
+    """Start the records of a new run, e.g. in a process forked from a long running server."""
+    global _start
+    del stage_records[:]
+    del plot_records[:]
+    del _enclosing_peaks[:]
+    _start = time.perf_counter()
+
+
+@contextmanager
+def measure(name, records, rows=None):
+    """Measure the enclosed code and append its record to records.
+
+    The record is yielded, such that e.g. the number of rows can be set when known
+    """
+    record = {"name": name, "rows": rows}
+    previous = reset_peak_rss()
+    resettable = previous is not None
+    if resettable and _enclosing_peaks:
+        _enclosing_peaks[-1] = max(_enclosing_peaks[-1], previous)
+    _enclosing_peaks.append(0)
+    wall, cpu = time.perf_counter(), cpu_time()
+    try:
+        yield record
+    finally:
+        nested = _enclosing_peaks.pop()
+    peak = max(current_peak_rss() or 0, nested) if resettable else None
+    if peak is not None and _enclosing_peaks:
+        _enclosing_peaks[-1] = max(_enclosing_peaks[-1], peak)
+    record.update(wall_time=round(time.perf_counter() - wall, 4),
+                  cpu_time=round(cpu_time() - cpu, 4),
+                  peak_rss=peak,
+                  process_peak_rss=peak_rss(),
+                  pid=os.getpid())
+    records.append(record)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Measure a stage of the run, see measure."""
+    with measure(name, stage_records, rows) as record:
+        yield record
+    logging.info("Finished stage {} in {:.2f}s".format(name, record["wall_time"]))
+
+
+def write_metrics(outputfile, settings):
+    """Write the records of the run, with its totals and settings, as json to outputfile."""
+    metrics = {
+        "version": __version__,
+        "command": " ".join(sys.argv),
+        "threads": settings["threads"],
+        "wall_time": round(time.perf_counter() - _start, 4),
+        "cpu_time": round(cpu_time(), 4),
+        "peak_rss": peak_rss(),
+        "peak_rss_children": peak_rss("children"),
+        "stages": stage_records,
+        "plots": plot_records,
+    }
+    with open(outputfile, 'w') as output:
+        json.dump(metrics, output, indent=2)
+    logging.info("Wrote metrics of the run to {}".format(outputfile))
+
+
+def start_profiler():
+    """Return a running cProfile profiler."""
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, outputfile):
+    """Stop the profiler and dump its statistics to outputfile, for use with pstats."""
+    profiler.disable()
+    profiler.dump_stats(outputfile)
+    logging.info("Wrote profile of the run to {}".format(outputfile))
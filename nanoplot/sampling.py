@@ -0,0 +1,109 @@
+"""
+Random samples of reads for plotting.
+
+Scatter-type plots (dot, kde, hex, pauvre) scale badly with the number of reads,
+so with --downsample they are made from a sample of the reads, while the
+statistics, histograms and other plots still use all reads.
+The sample is a reservoir which is updated chunk by chunk: every read gets a
+random key and the reads with the smallest keys are kept (bottom-k sampling),
+which is a uniform sample of all reads regardless of how these arrive in chunks.
+The sample can be stratified by barcode, channel or time, such that every
+barcode, channel or hour of the run is equally represented.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+STRATA = {"barcode": "barcode", "channel": "channelIDs", "time": "start_time"}
+TIME_STRATUM = 3600  # seconds per stratum when stratifying by time
+
+
+def stratum_labels(df, by):
+    """Return the stratum of every read in df, by barcode, channel or hour of the run.
+
+    Reads without start time are in stratum -1 when stratifying by time
+    """
+    if by == "time":
+        seconds = df["start_time"].dt.total_seconds().values
+        hours = np.full(seconds.size, -1, dtype=np.int64)
+        known = ~np.isnan(seconds)
+        hours[known] = seconds[known] // TIME_STRATUM
+        return hours
+    return df[STRATA[by]].values
+
+
+class Reservoir(object):
+    """A uniform random sample of at most size reads, optionally stratified by.
+
+    With stratification every stratum gets an equal share of size, or all its reads if it
+    has fewer reads than its share, in which case the rest of its share goes to the others.
+    """
+
+    def __init__(self, size, by=None, seed=None):
+        self.size = size
+        self.by = by
+        self.rng = np.random.default_rng(seed)
+        self.reads = None
+        self.keys = np.empty(0)
+        self.strata = np.empty(0, dtype=object)
+
+    def update(self, chunk):
+        keys = self.rng.random(len(chunk))
+        if self.by is None:
+            if self.keys.size == self.size:
+                # only reads with a key below the largest kept key can enter the sample
+                candidates = np.flatnonzero(keys < self.keys.max())
+                chunk, keys = chunk.iloc[candidates], keys[candidates]
+            strata = np.empty(0, dtype=object)
+        else:
+            strata = stratum_labels(chunk, self.by)
+        if self.reads is None:
+            self.reads = chunk
+        else:
+            self.reads = pd.concat([self.reads, chunk], ignore_index=True)
+        self.keys = np.concatenate([self.keys, keys])
+        self.strata = np.concatenate([self.strata, strata])
+        self.trim()
+        return self
+
+    def trim(self):
+        """Keep only the reads with the smallest keys, per stratum if stratified."""
+        if self.keys.size <= self.size:
+            return
+        if self.by is None:
+            selected = np.sort(np.argpartition(self.keys, self.size - 1)[:self.size])
+        else:
+            codes = pd.factorize(self.strata)[0]  # reads without stratum (-1) are a stratum
+            order = np.lexsort((self.keys, codes))
+            sorted_codes = codes[order]
+            rank = np.arange(order.size) - np.searchsorted(sorted_codes, sorted_codes)
+            # the reads with the smallest keys of every stratum first, then the second, etc.
+            # with the smallest keys first among the reads of equal rank
+            by_rank = np.lexsort((self.keys[order], rank))[:self.size]
+            selected = np.sort(order[by_rank])
+        self.reads = self.reads.iloc[selected].reset_index(drop=True)
+        self.keys = self.keys[selected]
+        if self.by is not None:
+            self.strata = self.strata[selected]
+
+    def sample(self):
+        """Return the sampled reads as a DataFrame."""
+        return self.reads
+
+
+def make_reservoir(columns, settings):
+    """Return an empty Reservoir for --downsample reads, stratified if the columns allow."""
+    by = settings.get("downsample_by")
+    if by and STRATA[by] not in columns:
+        logging.warning("Can't stratify the downsampled reads by {}, which is unknown.".format(by))
+        by = None
+    return Reservoir(settings["downsample"], by=by)
+
+
+def sample_reads(df, settings):
+    """Return a sample of at most settings["downsample"] reads of df for the scatter plots."""
+    sample = make_reservoir(df.columns, settings).update(df).sample()
+    logging.info("Downsampling the dataset from {} to {} reads for the bivariate plots".format(
+        len(df), len(sample)))
+    return sample
@@ -0,0 +1,141 @@
+"""
+Rendering plots in parallel.
+
+Every call to a nanoplotter function is described as a PlotJob. The jobs are
+executed on a pool of forked worker processes, which inherit the jobs and thus
+the column arrays from the parent process: the data is shared copy-on-write
+rather than pickled to every worker. Only the resulting Plot objects are sent
+back, and those are returned in the order of the jobs.
+On platforms without fork, or with a single thread, the jobs run sequentially.
+Every job is measured by nanoplot.metrics in the process running it.
+The number of workers can be bounded by a memory budget, using an estimate of
+the memory each job needs, derived from the kinds of plots it creates.
+"""
+
+import logging
+import multiprocessing
+import nanoplot.metrics as metrics
+
+# approximate bytes per plotted read while rendering a bivariate plot, beyond the plotted
+# columns: matplotlib keeps a marker path per point of a dot plot, a kde evaluates the
+# density of every point, hex and binned plots only keep a bin per point
+BIVARIATE_BYTES_PER_READ = {"dot": 160, "kde": 80, "pauvre": 80, "hex": 40, "binned": 16}
+# the histograms and other plots of all reads transform the values, e.g. log10 as float64
+BYTES_PER_READ = 16
+FIGURE_BYTES = 64 * 1024**2  # a rendered figure with the matplotlib state it needs
+
+
+class PlotJob(object):
+    """A plotting function with its keyword arguments and a log message for when it's done."""
+
+    def __init__(self, function, kwargs, message):
+        self.function = function
+        self.kwargs = kwargs
+        self.message = message
+
+    def run(self):
+        return self.function(**self.kwargs)
+
+    @property
+    def rows(self):
+        """The number of plotted reads, as the length of the first array argument, if any."""
+        for value in self.kwargs.values():
+            if hasattr(value, "shape"):
+                return len(value)
+        return None
+
+
+_jobs = []  # the jobs of the running pool, inherited by the forked workers
+
+
+def release_figures(plots, encode=True):
+    """Drop the figures of the plots, which are already saved to their files.
+
+    Figures can't be pickled and would otherwise be kept in memory until the report
+    is written. With encode the report embeds the images, which for non-png files
+    requires encoding the figure as png first.
+    """
+    for plot in plots:
+        if plot.fig is not None:
+            if encode and not plot.path.endswith(".png"):
+                plot.html = plot.encode()
+            plot.fig = None
+    return plots
+
+
+def measured_run(job, encode=True):
+    """Run and measure a job, return its plots and the plot records made meanwhile.
+
+    The records include those of jobs nested in this job, e.g. plots of a barcode
+    """
+    first = len(metrics.plot_records)
+    with metrics.measure(job.message, metrics.plot_records, rows=job.rows):
+        plots = release_figures(job.run(), encode)
+    return plots, metrics.plot_records[first:]
+
+
+def _run_job(index, encode=True):
+    """Run a job in a worker and prepare the plots and records to be sent back to the parent."""
+    return measured_run(_jobs[index], encode)
+
+
+def can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def run_plot_jobs(jobs, threads=1, encode=True):
+    """Run the jobs on up to threads processes and return all plots in order of the jobs.
+
+    encode is passed to release_figures, see there
+    """
+    global _jobs
+    if threads > 1 and len(jobs) > 1 and can_fork():
+        _jobs = jobs
+        try:
+            # a Pool of the fork context, as ProcessPoolExecutor only takes one from python 3.7
+            with multiprocessing.get_context("fork").Pool(min(threads, len(jobs))) as pool:
+                results = pool.starmap(_run_job, [(i, encode) for i in range(len(jobs))],
+                                       chunksize=1)
+        finally:
+            _jobs = []
+        for _, records in results:
+            metrics.plot_records.extend(records)
+    else:
+        results = [measured_run(job, encode) for job in jobs]
+    plots = []
+    for job, (result, _) in zip(jobs, results):
+        plots.extend(result)
+        logging.info(job.message)
+    return plots
+
+
+def estimate_plot_memory(df, plots, downsample=None):
+    """Estimate the number of bytes needed for creating the plots of this DataFrame.
+
+    plots are the kinds of bivariate plots, made from at most downsample reads if given.
+    The plotted columns are copied once (see nanoplot.columns) and the plots are rendered
+    one after the other, so the plot needing the most memory determines the estimate
+    """
+    reads = len(df)
+    sampled = min(reads, downsample or reads)
+    columns = df.memory_usage(index=False).sum()
+    per_plot = [reads * BYTES_PER_READ] + \
+        [sampled * BIVARIATE_BYTES_PER_READ[plot] for plot in plots]
+    # a downsampled copy of the columns is made for the bivariate plots
+    sample = columns * sampled // reads if sampled < reads else 0
+    return columns + sample + max(per_plot) + FIGURE_BYTES
+
+
+def workers_within_budget(threads, job_sizes, budget):
+    """Return the number of workers, at most threads, for which the largest jobs fit in budget.
+
+    At least one worker is always returned, even if the largest job exceeds the budget.
+    """
+    workers = 0
+    total = 0
+    for size in sorted(job_sizes, reverse=True)[:threads]:
+        total += size
+        if total > budget:
+            break
+        workers += 1
+    return max(workers, 1)
@@ -0,0 +1,55 @@
+"""
+Compact column types of the extracted data.
+
+nanoget returns 64-bit numbers and python strings, while the values of most
+columns fit in much smaller types. Columns are downcast right after extraction
+or loading, when all values fit the smaller type, to reduce memory use.
+Qualities and identities are only reported with one decimal, for which float32
+is more than precise enough.
+start_time stays a timedelta, as required by the time plots of nanoplotter.
+"""
+
+import logging
+import numpy as np
+
+COMPACT_DTYPES = {
+    "lengths": np.uint32,
+    "aligned_lengths": np.uint32,
+    "quals": np.float32,
+    "aligned_quals": np.float32,
+    "percentIdentity": np.float32,
+    "duration": np.float32,
+    "channelIDs": np.uint16,
+    "mapQ": np.uint8,
+    "barcode": "category",
+    "runIDs": "category",
+}
+
+
+def fits(values, dtype):
+    """Return if all values can be represented exactly by the integer dtype."""
+    if values.size == 0:
+        return True
+    if np.issubdtype(values.dtype, np.floating):
+        if np.isnan(values).any() or not np.array_equal(values, np.round(values)):
+            return False
+    info = np.iinfo(dtype)
+    return info.min <= values.min() and values.max() <= info.max
+
+
+def compact(df):
+    """Downcast the columns of df to the types of COMPACT_DTYPES where possible and return df."""
+    before = df.memory_usage(index=False).sum()
+    for column, dtype in COMPACT_DTYPES.items():
+        if column not in df or df[column].dtype == dtype:
+            continue
+        if dtype == "category" or np.issubdtype(dtype, np.floating):
+            df[column] = df[column].astype(dtype)
+        elif np.issubdtype(df[column].dtype, np.number) and fits(df[column].values, dtype):
+            df[column] = df[column].values.astype(dtype)
+        else:
+            logging.info("Keeping column {} as {}, not all values fit {}.".format(
+                column, df[column].dtype, np.dtype(dtype).name))
+    logging.info("Compacted data from {:.1f}MB to {:.1f}MB".format(
+        before / 1e6, df.memory_usage(index=False).sum() / 1e6))
+    return df
@@ -0,0 +1,323 @@
+"""
+A long running NanoPlot server, amortizing the startup over many runs.
+
+The server imports the plotting and data libraries, applies the plot settings and loads
+the fonts once, after which every submitted run is executed in a process forked from it.
+The forked process starts with all of this ready, while the runs stay isolated from each
+other and from the server: logging, metrics, the working directory and memory are per run.
+At most --workers runs are executed at the same time, further runs are queued.
+
+Runs are submitted with the NanoPlot arguments as parsed by get_args() over a local Unix
+socket, using the protocol of nanoplot.client. The server answers the following requests:
+  {"action": "submit", "args": [...], "cwd": "..."}  queue a run, answer its job
+  {"action": "status", "jobs": [...] or null}      answer the status of the (or all) jobs
+  {"action": "shutdown"}                           stop after finishing the running jobs
+The server loop is single threaded, such that forking a run is safe.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict, deque
+from multiprocessing.connection import wait
+from nanoplot.client import default_socket, send_message, receive_message
+from nanoplot.version import __version__
+
+# finished jobs kept for status requests, older ones are forgotten
+MAX_HISTORY = 10000
+
+
+class Job(object):
+    """A submitted run, with its status and the process executing it."""
+
+    def __init__(self, job_id, args, cwd):
+        self.id = job_id
+        self.args = args
+        self.cwd = cwd
+        self.status = "queued"
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.process = None
+        self.connection = None
+
+    def to_dict(self):
+        return {"job": self.id,
+                "status": self.status,
+                "args": self.args,
+                "cwd": self.cwd,
+                "error": self.error,
+                "pid": self.process.pid if self.process else None,
+                "submitted": self.submitted,
+                "started": self.started,
+                "finished": self.finished}
+
+
+def warm_up(dpi=100):
+    """Import the heavy dependencies, apply the plot settings and render text once.
+
+    Rendering a figure with text loads the font cache and the fonts themselves
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import nanoplotter
+    import nanoplot.NanoPlot
+    import nanoplot.aggregate_plots
+    import nanoplot.alignments
+    import nanoplot.fastx
+    import nanoplot.filteroptions
+    import nanoplot.grouping
+    import nanoplot.store
+    import nanoplot.stream
+    import nanoplot.summary
+    nanoplotter.plot_settings({}, dpi=dpi)
+    fig, ax = plt.subplots()
+    ax.set_title("NanoPlot")
+    ax.plot([0, 1], [0, 1])
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+def execute(args, cwd):
+    """Execute a NanoPlot run with arguments args in directory cwd in this process.
+
+    Return the settings of the run, None if the arguments are invalid, and its error, None
+    if the run succeeded. The state NanoPlot keeps per process (logging, metrics, argv,
+    figures and working directory) is reset, such that a process can execute many runs
+    """
+    import io
+    from contextlib import redirect_stderr
+    import nanoplot.NanoPlot as NanoPlot
+    import nanoplot.metrics as metrics
+    for handler in logging.root.handlers[:]:  # such that init_logs sets up the log of this run
+        handler.close()
+        logging.root.removeHandler(handler)
+    metrics.reset()
+    sys.argv = ["NanoPlot"] + args
+    previous = os.getcwd()
+    settings = error = None
+    try:
+        os.chdir(cwd)
+        stderr = io.StringIO()
+        try:
+            with redirect_stderr(stderr):
+                arguments = NanoPlot.get_args(args)
+        except SystemExit as e:
+            if e.code:
+                lines = stderr.getvalue().strip().splitlines()
+                raise SystemExit(lines[-1] if lines else "invalid arguments")
+            raise
+        settings = vars(arguments)
+        NanoPlot.run(arguments)
+    except SystemExit as e:
+        if e.code:
+            error = str(e.code)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        os.chdir(previous)
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close("all")
+    return settings, error
+
+
+def run_job(args, cwd, connection):
+    """Execute a NanoPlot run in a forked process and send its error, or None, to the server."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    _, error = execute(args, cwd)
+    connection.send(error)
+    connection.close()
+    sys.exit(1 if error else 0)
+
+
+class Server(object):
+    """Executes the submitted runs on at most workers forked processes."""
+
+    def __init__(self, socketfile, workers=1):
+        self.socketfile = socketfile
+        self.workers = workers
+        self.jobs = OrderedDict()
+        self.queue = deque()
+        self.running = []
+        self.submitted = 0
+        self.stopping = False
+        self.context = multiprocessing.get_context("fork")
+
+    def serve(self):
+        if os.path.exists(self.socketfile):
+            if self.listening():
+                sys.exit("ERROR: A NanoPlot server is already listening on {}."
+                         .format(self.socketfile))
+            os.remove(self.socketfile)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socketfile)
+        os.chmod(self.socketfile, 0o600)
+        listener.listen(64)
+        logging.info("Listening on {} with {} worker(s).".format(self.socketfile, self.workers))
+        try:
+            while self.running or not self.stopping:
+                self.start_jobs()
+                ready = wait([listener] + [job.process.sentinel for job in self.running])
+                if listener in ready:
+                    self.answer(listener)
+                self.reap_jobs()
+        except KeyboardInterrupt:
+            logging.info("Interrupted, terminating {} running job(s).".format(len(self.running)))
+            for job in self.running:
+                job.process.terminate()
+            for job in self.running:
+                job.process.join()
+                self.finish(job, "failed", "interrupted")
+        finally:
+            listener.close()
+            os.remove(self.socketfile)
+        logging.info("Stopped.")
+
+    def listening(self):
+        """Return if another server answers on the socket."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socketfile)
+                return True
+            except (ConnectionRefusedError, FileNotFoundError):
+                return False
+
+    def answer(self, listener):
+        connection, _ = listener.accept()
+        with connection:
+            connection.settimeout(10)
+            try:
+                message = receive_message(connection)
+                if message is None:
+                    return
+                try:
+                    answer = self.handle(message)
+                except Exception as e:  # a bad request should never stop the server
+                    logging.exception("Failed to handle a request.")
+                    answer = {"error": "{}: {}".format(type(e).__name__, e)}
+                send_message(connection, answer)
+            except (OSError, ValueError) as e:
+                logging.warning("Failed to answer a request: {}".format(e))
+
+    def handle(self, message):
+        if not isinstance(message, dict):
+            return {"error": "A request should be a JSON object."}
+        action = message.get("action")
+        if action == "submit":
+            if self.stopping:
+                return {"error": "The server is shutting down."}
+            args = message.get("args")
+            if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+                return {"error": "The arguments of a run should be a list of strings."}
+            return self.submit(args, message.get("cwd") or os.getcwd()).to_dict()
+        elif action == "status":
+            ids = message.get("jobs")
+            if ids is None:
+                return {"jobs": [job.to_dict() for job in self.jobs.values()]}
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                return {"error": "The jobs of a status request should be a list of strings."}
+            unknown = [i for i in ids if i not in self.jobs]
+            if unknown:
+                return {"error": "Unknown job(s): {}".format(", ".join(unknown))}
+            return {"jobs": [self.jobs[i].to_dict() for i in ids]}
+        elif action == "shutdown":
+            self.stopping = True
+            for job in self.queue:
+                self.finish(job, "cancelled", "server shut down")
+            self.queue.clear()
+            logging.info("Shutting down after {} running job(s).".format(len(self.running)))
+            return {"running": len(self.running)}
+        else:
+            return {"error": "Unknown action {}.".format(action)}
+
+    def submit(self, args, cwd):
+        self.submitted += 1
+        job = Job(str(self.submitted), args, cwd)
+        self.jobs[job.id] = job
+        self.queue.append(job)
+        logging.info("Queued job {}: {}".format(job.id, " ".join(args)))
+        return job
+
+    def start_jobs(self):
+        while self.queue and len(self.running) < self.workers:
+            job = self.queue.popleft()
+            job.connection, child_connection = self.context.Pipe(duplex=False)
+            job.process = self.context.Process(target=run_job,
+                                               args=(job.args, job.cwd, child_connection))
+            job.process.start()
+            child_connection.close()
+            job.status = "running"
+            job.started = time.time()
+            self.running.append(job)
+            logging.info("Started job {} in process {}.".format(job.id, job.process.pid))
+
+    def reap_jobs(self):
+        for job in [job for job in self.running if not job.process.is_alive()]:
+            job.process.join()
+            self.running.remove(job)
+            try:
+                error = job.connection.recv()
+            except EOFError:
+                error = "process exited with status {}".format(job.process.exitcode)
+            job.connection.close()
+            self.finish(job, "failed" if error else "done", error)
+
+    def finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.process = job.connection = None
+        if error:
+            logging.warning("Job {} {}: {}".format(job.id, status, error))
+        else:
+            logging.info("Job {} {} in {:.2f}s.".format(job.id, status,
+                                                        job.finished - job.started))
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for old in finished[:max(len(finished) - MAX_HISTORY, 0)]:
+            del self.jobs[old.id]
+
+
+def main():
+    args = get_args()
+    if "fork" not in multiprocessing.get_all_start_methods():
+        sys.exit("ERROR: The NanoPlot server requires a platform which supports fork.")
+    handlers = [logging.StreamHandler()]
+    if args.logfile:
+        handlers = [logging.FileHandler(args.logfile)]
+    logging.basicConfig(format='%(asctime)s %(message)s', handlers=handlers, level=logging.INFO)
+    logging.info("NanoPlot server {} warming up.".format(__version__))
+    start = time.perf_counter()
+    warm_up()
+    logging.info("Warmed up in {:.2f}s.".format(time.perf_counter() - start))
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    Server(args.socket, workers=args.workers).serve()
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Run NanoPlot as a server, executing runs submitted with NanoPlot-client.")
+    parser.add_argument("--socket",
+                        help="Socket on which to listen for runs.",
+                        default=default_socket())
+    parser.add_argument("-w", "--workers",
+                        help="Number of runs executed at the same time.",
+                        default=1,
+                        type=int)
+    parser.add_argument("--logfile",
+                        help="Write the log of the server to this file instead of to stderr.")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers should be at least 1")
+    return args
+
+
+if __name__ == "__main__":
+    main()
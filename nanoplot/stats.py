@@ -0,0 +1,299 @@
+"""
+Mergeable statistics of reads.
+
+ReadStats are updated chunk by chunk and can be merged across barcodes and
+files. They hold exact counts and sums and the number of reads per length for the
+N50, NG50 and median length. For the median quality and percent identity they keep all
+values when exact, as when all reads are in memory, such that the statistics equal
+those of nanomath. When streaming they keep value counts at a resolution of 0.01
+instead, such that these medians can differ from nanomath by up to 0.01, which can
+change the value shown after rounding to one decimal. They are written in the
+layout of the NanoStats files produced by nanomath, or rendered by StatsTable
+as tsv, json or html without reading the files back.
+"""
+
+import sys
+import json
+from html import escape
+import numpy as np
+from nanoplot.aggregates import LengthCounts, ValueCounts, ExactValues, ChannelCounts
+import nanoplot.lengths as lengths
+
+QUAL_CUTOFFS = [5, 7, 10, 12, 15]
+STATS_EXTENSIONS = {"text": ".txt", "tsv": ".tsv", "json": ".json"}
+FEATURES = ["Number of reads", "Total bases", "Total bases aligned", "Median read length",
+            "Mean read length", "Read length N50", "Read length NG50", "Average percent identity",
+            "Median percent identity", "Active channels", "Mean read quality",
+            "Median read quality"]
+
+
+def top_5(current, new):
+    """Return the 5 largest tuples of current and new combined.
+
+    Ties are broken by the other values of the tuples, such that the result doesn't depend
+    on the order in which reads are added or merged
+    """
+    return sorted(current + new, reverse=True)[:5]
+
+
+class ReadStats(object):
+    """Summary statistics of reads, updated with DataFrames or merged with other ReadStats.
+
+    Statistics of optional columns are None until a DataFrame with that column is added.
+    With exact all qualities and identities are kept for their medians, see the module,
+    until finish drops them once the statistics are merged
+    """
+
+    def __init__(self, exact=False):
+        self.exact = exact
+        self.lengths = LengthCounts()
+        self.aligned_bases = None
+        self.identities = None
+        self.quals = None
+        self.channels = None
+
+    def new_values(self):
+        return ExactValues() if self.exact else ValueCounts()
+
+    def init_quals(self):
+        if self.quals is None:
+            self.quals = self.new_values()
+            self.reads_above = np.zeros(len(QUAL_CUTOFFS), dtype=np.int64)
+            self.bases_above = np.zeros(len(QUAL_CUTOFFS), dtype=np.int64)
+            self.top5_lengths = []
+            self.top5_quals = []
+
+    def update(self, df):
+        self.lengths.update(df["lengths"])
+        if "aligned_lengths" in df:
+            self.aligned_bases = (self.aligned_bases or 0) + int(df["aligned_lengths"].sum())
+        if "percentIdentity" in df:
+            self.identities = self.identities or self.new_values()
+            self.identities.update(df["percentIdentity"])
+        if "quals" in df:
+            self.init_quals()
+            self.quals.update(df["quals"])
+            for i, q in enumerate(QUAL_CUTOFFS):
+                above = df["quals"].values > q
+                self.reads_above[i] += np.count_nonzero(above)
+                self.bases_above[i] += df["lengths"].values[above].sum()
+            self.top5_lengths = top_5(self.top5_lengths, top_5_records(df, "lengths", "quals"))
+            self.top5_quals = top_5(self.top5_quals, top_5_records(df, "quals", "lengths"))
+        if "channelIDs" in df:
+            self.channels = self.channels or ChannelCounts()
+            self.channels.update(df["channelIDs"])
+        return self
+
+    def merge(self, other):
+        self.lengths.merge(other.lengths)
+        if other.aligned_bases is not None:
+            self.aligned_bases = (self.aligned_bases or 0) + other.aligned_bases
+        if other.identities is not None:
+            self.identities = self.identities or self.new_values()
+            self.identities.merge(other.identities)
+        if other.quals is not None:
+            self.init_quals()
+            self.quals.merge(other.quals)
+            self.reads_above += other.reads_above
+            self.bases_above += other.bases_above
+            self.top5_lengths = top_5(self.top5_lengths, other.top5_lengths)
+            self.top5_quals = top_5(self.top5_quals, other.top5_quals)
+        if other.channels is not None:
+            self.channels = self.channels or ChannelCounts()
+            self.channels.merge(other.channels)
+        return self
+
+    def finish(self):
+        """Drop the qualities and identities kept when exact, keeping their mean and median."""
+        for values in (self.quals, self.identities):
+            if isinstance(values, ExactValues):
+                values.finish()
+        return self
+
+    def features(self, genome_size=None):
+        """Return a dict of the general summary features.
+
+        The NG50 is included for a genome_size, unless the reads contain fewer bases than
+        half of it
+        """
+        number_of_reads = self.lengths.number_of_reads
+        read_lengths = self.lengths.distinct()
+        features = {
+            "Number of reads": number_of_reads,
+            "Total bases": self.lengths.number_of_bases,
+            "Median read length": lengths.median(*read_lengths),
+            "Mean read length": self.lengths.number_of_bases / number_of_reads,
+            "Read length N50": lengths.n50(*read_lengths),
+        }
+        if genome_size:
+            ng50 = lengths.ng50(*read_lengths, genome_size=genome_size)
+            if ng50 is not None:
+                features["Read length NG50"] = ng50
+        if self.aligned_bases is not None:
+            features["Total bases aligned"] = self.aligned_bases
+        if self.identities is not None:
+            features["Average percent identity"] = self.identities.mean()
+            features["Median percent identity"] = self.identities.quantile(0.5)
+        if self.quals is not None:
+            features["Mean read quality"] = self.quals.mean()
+            features["Median read quality"] = self.quals.quantile(0.5)
+        if self.channels is not None:
+            features["Active channels"] = self.channels.active_channels
+        return features
+
+    def reads_above_qual(self):
+        number_of_reads = self.lengths.number_of_reads
+        return ["{} ({}%) {}Mb".format(n, round(100 * (n / number_of_reads), ndigits=1),
+                                      round(b / 1e6, ndigits=1))
+                for n, b in zip(self.reads_above, self.bases_above)]
+
+
+def merge_stats(stats):
+    """Return a new ReadStats combining all ReadStats in stats, exact if all of them are."""
+    stats = list(stats)
+    merged = ReadStats(exact=all(s.exact for s in stats))
+    for s in stats:
+        merged.merge(s)
+    return merged
+
+
+def top_5_records(df, col, other):
+    """Return (col, other[, readID]) tuples of the 5 reads with the highest value for col."""
+    columns = [col, other] + (["readIDs"] if "readIDs" in df else [])
+    return list(df.nlargest(5, col, keep="all")[columns].itertuples(index=False, name=None))
+
+
+def format_top_5(records):
+    return [str(round(r[0], ndigits=1)) + " (" + str(round(r[1], ndigits=1)) +
+            ("; " + r[2] if len(r) > 2 else "") + ")" for r in records]
+
+
+def plain(value):
+    """Return numpy scalars as the equivalent python number, e.g. for json."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def format_value(value):
+    return '{:,.1f}'.format(value)
+
+
+class StatsTable(object):
+    """Statistics of a list of ReadStats, as a column per ReadStats named by names.
+
+    The table is rendered as the text of the NanoStats files, tsv, json or html.
+    With a genome_size the NG50 is shown as well
+    """
+
+    def __init__(self, stats, names=None, genome_size=None):
+        self.stats = list(stats)
+        self.names = list(names or [])
+        self.features = [s.features(genome_size) for s in self.stats]
+
+    @property
+    def detailed(self):
+        """Whether the top 5 reads and quality cutoffs are known, requiring qualities."""
+        return all(s.quals is not None for s in self.stats)
+
+    def general(self):
+        """Return (feature, values) tuples of the features known for every column."""
+        return [(f, [plain(feat[f]) for feat in self.features])
+                for f in sorted(FEATURES) if all(f in feat for feat in self.features)]
+
+    def long_features(self):
+        """Return (title, labels, formatted values per column) of the top 5 and cutoffs."""
+        if not self.detailed:
+            return []
+        return sorted([
+            ("Top 5 longest reads and their mean basecall quality score",
+             [str(i) for i in range(1, 6)], [format_top_5(s.top5_lengths) for s in self.stats]),
+            ("Top 5 highest mean basecall quality scores and their read lengths",
+             [str(i) for i in range(1, 6)], [format_top_5(s.top5_quals) for s in self.stats]),
+            ("Number, percentage and megabases of reads above quality cutoffs",
+             [">Q" + str(q) for q in QUAL_CUTOFFS], [s.reads_above_qual() for s in self.stats]),
+        ])
+
+    def rows(self):
+        """Yield the rows of the long features: title, label and a value per column."""
+        for title, labels, values in self.long_features():
+            for i, label in enumerate(labels):
+                yield title, label, [v[i] if len(v) > i else "NA" for v in values]
+
+    def to_text(self):
+        max_len = max(len(k) for k in FEATURES)
+        max_num = max([len(str(f["Total bases"])) for f in self.features] +
+                      [len(str(n)) for n in self.names]) + 6
+        lines = ["{:<{}}{}".format('General summary:', max_len,
+                                   " ".join(['{:>{}}'.format(n, max_num) for n in self.names]))]
+        for f, values in self.general():
+            lines.append("{f:{pad}}{v}".format(
+                f=f + ':',
+                pad=max_len,
+                v=' '.join(['{:>{},.1f}'.format(v, max_num) for v in values])))
+        title = None
+        for row_title, label, values in self.rows():
+            if row_title != title:
+                lines.append(row_title)
+                title = row_title
+            lines.append("{}:\t{}".format(label, '\t'.join(values)))
+        return "\n".join(lines) + "\n"
+
+    def to_tsv(self):
+        lines = ["\t".join(["Metrics"] + (self.names or ["dataset"]))]
+        for f, values in self.general():
+            lines.append("\t".join([f] + [str(round(v, 1)) for v in values]))
+        for title, label, values in self.rows():
+            lines.append("\t".join([title + " " + label] + values))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Return the statistics as a dict with a list of values per feature."""
+        table = {"names": self.names}
+        table.update({f: values for f, values in self.general()})
+        if self.detailed:
+            keys = ("length", "quality", "readID")
+            table["Top 5 longest reads"] = [
+                [dict(zip(keys, map(plain, r))) for r in s.top5_lengths] for s in self.stats]
+            table["Top 5 highest mean basecall quality scores"] = [
+                [dict(zip(keys[1::-1] + keys[2:], map(plain, r))) for r in s.top5_quals]
+                for s in self.stats]
+            table["Reads above quality cutoffs"] = [
+                {">Q" + str(q): {"reads": int(n), "bases": int(b)}
+                 for q, n, b in zip(QUAL_CUTOFFS, s.reads_above, s.bases_above)}
+                for s in self.stats]
+        return table
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2) + "\n"
+
+    def to_html(self):
+        def row(header, values):
+            return "<tr><th>{}</th>{}</tr>".format(
+                escape(header), "".join("<td>{}</td>".format(escape(str(v))) for v in values))
+
+        columns = max(len(self.stats), 1)
+        lines = ['<table border="1" class="dataframe">', '<tbody>']
+        if self.names:
+            lines.append(row("General summary", self.names))
+        for f, values in self.general():
+            lines.append(row(f, [format_value(v) for v in values]))
+        title = None
+        for row_title, label, values in self.rows():
+            if row_title != title:
+                lines.append(row(row_title, [""] * columns))
+                title = row_title
+            lines.append(row(label, values))
+        lines.extend(['</tbody>', '</table>'])
+        return "\n".join(lines) + "\n"
+
+    def render(self, format="text"):
+        return {"text": self.to_text, "tsv": self.to_tsv, "json": self.to_json}[format]()
+
+    def write(self, outputfile, format="text"):
+        """Write the table in format to outputfile, which can be 'stdout'."""
+        if outputfile == 'stdout':
+            sys.stdout.write(self.render(format))
+        else:
+            with open(outputfile, 'wt') as output:
+                output.write(self.render(format))
+        return outputfile
+
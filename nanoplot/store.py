@@ -0,0 +1,76 @@
+"""
+Columnar storage of the extracted data for future plotting.
+
+Data is written with --store to a compressed feather (Arrow IPC) file
+and loaded again with --feather, selecting only the columns which are used for
+statistics and plots. A small metadata header records the source type,
+the input files and their modification time, and the NanoPlot version.
+"""
+
+import json
+import logging
+from os import path
+import pyarrow as pa
+from pyarrow import feather
+from nanoplot.version import __version__
+
+METADATA_KEY = b"nanoplot"
+
+# readIDs are used by the stats for reporting the top 5 longest and highest quality reads
+PLOT_COLUMNS = ["readIDs", "lengths", "quals", "aligned_lengths", "aligned_quals", "mapQ",
+                "percentIdentity", "channelIDs", "start_time", "duration"]
+
+
+def needed_columns(settings):
+    """Return the columns used by make_stats and make_plots for these settings."""
+    columns = list(PLOT_COLUMNS)
+    if settings.get("barcoded"):
+        columns.append("barcode")
+    return columns
+
+
+def make_metadata(source, files):
+    """Describe the origin of the data: source type, input files and NanoPlot version."""
+    return {
+        "source": source,
+        "files": [{"path": path.abspath(f),
+                   "mtime": path.getmtime(f) if path.isfile(f) else None}
+                  for f in files],
+        "version": __version__,
+    }
+
+
+def read_metadata(filename):
+    """Return the metadata header of a stored feather file without reading the data."""
+    with pa.memory_map(filename) as source:
+        schema = pa.ipc.open_file(source).schema
+    if schema.metadata and METADATA_KEY in schema.metadata:
+        return json.loads(schema.metadata[METADATA_KEY].decode())
+    else:
+        return {}
+
+
+def write_store(df, filename, metadata):
+    """Write the DataFrame to a zstd compressed feather file with a metadata header."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata).encode()
+    table = table.replace_schema_metadata(schema_metadata)
+    feather.write_feather(table, filename, compression="zstd")
+    logging.info("Stored data of {} reads in {}".format(len(df), filename))
+    return filename
+
+
+def read_store(filename, columns=None):
+    """Load a feather file created by write_store.
+
+    If columns is specified only those columns present in the file are read
+    """
+    metadata = read_metadata(filename)
+    logging.info("Loading data from {}, extracted from {} input by NanoPlot {}".format(
+        filename, metadata.get("source", "unknown"), metadata.get("version", "unknown")))
+    if columns is not None:
+        with pa.memory_map(filename) as source:
+            available = pa.ipc.open_file(source).schema.names
+        columns = [c for c in columns if c in available]
+    return feather.read_table(filename, columns=columns, memory_map=True).to_pandas()
@@ -0,0 +1,230 @@
+"""
+Streaming ingestion of sequencing_summary files.
+
+The summary files are read in chunks of a fixed number of reads, reading only
+the columns which are used. Every chunk is filtered and updates the statistics
+and the aggregates from which the plots are created, after which it is
+discarded: memory use is bounded regardless of the size of the run.
+As when reading all reads at once, times are rebased to the start of the first read.
+Summary files are written in order of the reads, so this is the first read of the first
+chunk of one of the files, which are read upfront. Reads in later chunks starting even
+earlier are counted as started at the start of the run, with a warning.
+Barcodes are kept in order of their first read, as when grouping all reads.
+"""
+
+import logging
+import sys
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+from nanoplot.aggregates import LengthCounts, Histogram2D, ChannelCounts, TimeBuckets
+from nanoplot.stats import ReadStats
+from nanoplot.filteroptions import set_lengths_pointer, filter_masks, log_filtered
+from nanoplot.sampling import make_reservoir
+from nanoplot.summary import summary_columns, missing_columns, split_pieces, parse_piece, \
+    COMPRESSED
+
+# grid for the length vs quality plot: log10 transformed lengths up to 10Mb and qualities
+LOG_LENGTH_EDGES = np.linspace(0, 7, 351)
+QUAL_EDGES = np.linspace(0, 50, 201)
+
+
+def summary_chunks(summaryfile, names, chunksize=1000000):
+    """Yield DataFrames of at most chunksize reads with the columns names of a summary file.
+
+    Uncompressed files are parsed column-projected per piece, see nanoplot.summary
+    """
+    if summaryfile.endswith(COMPRESSED):
+        try:
+            reader = pd.read_csv(summaryfile, sep="\t", usecols=list(names), chunksize=chunksize)
+        except pd.errors.EmptyDataError:
+            logging.warning("Summary file {} is empty.".format(summaryfile))
+            return
+        except ValueError:
+            missing_columns(summaryfile, names)
+        for chunk in reader:
+            yield chunk
+    else:
+        for piece in split_pieces(summaryfile, names):
+            df = parse_piece(piece)
+            for i in range(0, len(df), chunksize):
+                yield df.iloc[i:i + chunksize]
+
+
+def run_start(files, readtype="1D", chunksize=1000000):
+    """Return the start time in seconds of the first read with a >0 length in the first chunk
+    of every summary file, or None if there are no such reads.
+
+    Only the start_time and length columns of the first chunk are read
+    """
+    names = summary_columns(readtype, columns=["lengths", "start_time"])
+    start = None
+    for summaryfile in files:
+        for chunk in summary_chunks(summaryfile, names, chunksize):
+            chunk = chunk.rename(columns=names)
+            times = chunk["start_time"].values[chunk["lengths"].values != 0]
+            if times.size:
+                start = np.nanmin(times) if start is None else min(start, np.nanmin(times))
+            break
+    return start
+
+
+def read_summary_chunks(files, readtype="1D", barcoded=False, columns=None, chunksize=1000000):
+    """Yield DataFrames of at most chunksize reads with a >0 length from the summary files.
+
+    The read_id is read as well, for the top 5 reads in the statistics.
+    start_time is converted to a timedelta since the start of the first read of the first
+    chunks, see run_start. Reads starting even earlier are counted as started at 0
+    """
+    names = summary_columns(readtype, barcoded, columns, identifiers=True)
+    start = run_start(files, readtype, chunksize) if "start_time" in names.values() else None
+    early = 0
+    for summaryfile in files:
+        logging.info("Reading summary file {} in chunks of {} reads".format(summaryfile, chunksize))
+        for chunk in summary_chunks(summaryfile, names, chunksize):
+            chunk = prepare_chunk(chunk, names, start)
+            if start is not None:
+                before = (chunk["start_time"] < pd.Timedelta(0)).values
+                if before.any():
+                    early += np.count_nonzero(before)
+                    chunk.loc[before, "start_time"] = pd.Timedelta(0)
+            if len(chunk):
+                yield chunk
+    if early:
+        logging.warning("{} reads started before the reads in the first chunk of every summary "
+                        "file, their start time is set to the start of the run.".format(early))
+
+
+def prepare_chunk(chunk, names, start=None):
+    """Rename the summary columns of chunk to names, drop reads of length 0 and convert times.
+
+    start_time is converted to a timedelta since start seconds, or as reported if None
+    """
+    chunk = chunk.rename(columns=names)
+    if "lengths" in chunk:
+        chunk = chunk.loc[chunk["lengths"] != 0]
+    if "start_time" in chunk:
+        seconds = chunk["start_time"] - start if start is not None else chunk["start_time"]
+        chunk["start_time"] = pd.to_timedelta(seconds, unit="s")
+    return chunk
+
+
+class RunAggregates(object):
+    """Statistics and plot aggregates of a run or barcode, updated chunk by chunk.
+
+    stats covers all reads, filtered_stats the reads remaining after filtering.
+    The length aggregates only contain reads passing the length_filter.
+    If a Reservoir is given, the reads remaining after filtering are sampled for plotting,
+    with their length_filter.
+    """
+
+    def __init__(self, sample=None):
+        self.stats = ReadStats()
+        self.filtered_stats = ReadStats()
+        self.lengths = LengthCounts()
+        self.length_vs_qual = Histogram2D(LOG_LENGTH_EDGES, QUAL_EDGES)
+        self.channels = ChannelCounts()
+        self.time = TimeBuckets()
+        self.sample = sample
+
+    @property
+    def number_of_reads(self):
+        return self.filtered_stats.lengths.number_of_reads
+
+    def update(self, chunk, keep, length_filter, lengths_pointer="lengths"):
+        self.stats.update(chunk)
+        kept = chunk.loc[keep]
+        self.filtered_stats.update(kept)
+        shown = kept.loc[length_filter[keep]]
+        self.lengths.update(shown["lengths"])
+        if "quals" in kept:
+            self.length_vs_qual.update(np.log10(shown[lengths_pointer]), shown["quals"])
+        if self.sample is not None:
+            self.sample.update(kept.drop(columns="readIDs", errors="ignore")
+                               .assign(length_filter=length_filter[keep]))
+        if "channelIDs" in kept:
+            self.channels.update(kept["channelIDs"])
+        if "start_time" in kept:
+            self.time.update(
+                seconds=kept["start_time"].dt.total_seconds(),
+                lengths=kept["lengths"],
+                quals=kept["quals"] if "quals" in kept else None,
+                channels=kept["channelIDs"] if "channelIDs" in kept else None,
+                durations=kept["duration"] if "duration" in kept else None,
+                length_filter=length_filter[keep])
+
+
+class SummaryAggregates(object):
+    """The RunAggregates of a run and of every barcode, updated with chunks of a summary file.
+
+    flagged holds the number of reads flagged by every filter so far.
+    barcodes are in order of their first read, as the barcodes are grouped when reading
+    all reads.
+    """
+
+    def __init__(self, settings):
+        if settings.get("drop_outliers"):
+            logging.warning("Ignoring --drop_outliers when streaming, requires all reads.")
+            settings["drop_outliers"] = False
+        set_lengths_pointer(settings)
+        self.settings = settings
+        self.columns = summary_columns(settings["readtype"], settings["barcoded"]).values()
+        self.run = self.new_aggregates()
+        self.barcodes = OrderedDict()
+        self.flagged = {}
+
+    def new_aggregates(self):
+        if self.settings.get("downsample"):
+            return RunAggregates(sample=make_reservoir(self.columns, self.settings))
+        return RunAggregates()
+
+    def update(self, chunk):
+        settings = self.settings
+        keep, length_filter, chunk_flagged = filter_masks(chunk, settings)
+        for name, number in chunk_flagged.items():
+            self.flagged[name] = self.flagged.get(name, 0) + number
+        self.run.update(chunk, keep, length_filter, settings["lengths_pointer"])
+        if settings["barcoded"]:
+            # reads without barcode have code -1 and are only part of the run
+            codes, names = pd.factorize(chunk["barcode"])
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+            for i, barcode in enumerate(names):
+                if barcode not in self.barcodes:
+                    self.barcodes[barcode] = self.new_aggregates()
+                index = order[bounds[i]:bounds[i + 1]]
+                self.barcodes[barcode].update(
+                    chunk.iloc[index], keep[index], length_filter[index],
+                    settings["lengths_pointer"])
+
+    def reported_barcodes(self):
+        """Return an OrderedDict of the barcodes with reads remaining after filtering."""
+        return OrderedDict((barcode, aggregates) for barcode, aggregates in self.barcodes.items()
+                           if aggregates.number_of_reads)
+
+    def finish(self):
+        """Log the filtered reads and set settings["filtered"] and settings["logBool"]."""
+        logging.info("Aggregated metrics of {} reads".format(
+            self.run.stats.lengths.number_of_reads))
+        self.settings["filtered"] = log_filtered(self.flagged, self.settings)
+        self.settings["logBool"] = bool(self.settings.get("loglength"))
+
+
+def aggregate_summary(settings):
+    """Stream over the summary files and return the RunAggregates of the run and per barcode.
+
+    The barcodes are returned as an OrderedDict of SummaryAggregates.reported_barcodes(),
+    which is empty if not settings["barcoded"]
+    settings["filtered"] is set if reads were removed by filtering
+    """
+    aggregates = SummaryAggregates(settings)
+    for chunk in read_summary_chunks(files=settings["summary"],
+                                     readtype=settings["readtype"],
+                                     barcoded=settings["barcoded"],
+                                     chunksize=settings["chunksize"]):
+        aggregates.update(chunk)
+    if aggregates.run.stats.lengths.number_of_reads == 0:
+        logging.critical("No reads retrieved.")
+        sys.exit("Fatal: No reads found in input.")
+    aggregates.finish()
+    return aggregates.run, aggregates.reported_barcodes()
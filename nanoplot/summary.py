@@ -0,0 +1,184 @@
+"""
+Column-projected parsing of sequencing_summary files.
+
+Summary files of guppy and dorado have 20 to 40 columns, of which only a handful
+is used. Uncompressed files are memory-mapped and split at line boundaries in
+pieces, which are parsed in parallel. Within a piece the positions of all tabs and
+newlines are located with numpy, from which the bytes of only the needed fields are
+gathered into a small table, such that pandas only tokenizes and converts those.
+Compressed files, and pieces in which not every line has all fields, are read by
+pandas with usecols.
+"""
+
+import io
+import logging
+import mmap
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+READTYPE_COLUMNS = {
+    "1D": {"sequence_length_template": "lengths", "mean_qscore_template": "quals"},
+    "2D": {"sequence_length_2d": "lengths", "mean_qscore_2d": "quals"},
+    "1D2": {"sequence_length_2d": "lengths", "mean_qscore_2d": "quals"},
+}
+COMPRESSED = ('.gz', '.bz2', '.zip', '.xz')
+PIECE_SIZE = 32 * 1024**2  # maximal bytes per piece, bounding the memory of a worker
+TAB, NEWLINE = ord("\t"), ord("\n")
+
+
+def summary_columns(readtype="1D", barcoded=False, columns=None, identifiers=False):
+    """Return a dict of the summary columns to read and their names in NanoPlot.
+
+    If columns is given, only the columns with those NanoPlot names are read.
+    With identifiers the read_id is read as well
+    """
+    names = {"read_id": "readIDs"} if identifiers else {}
+    names.update(READTYPE_COLUMNS[readtype])
+    names.update({"channel": "channelIDs", "start_time": "start_time", "duration": "duration"})
+    if barcoded:
+        names["barcode_arrangement"] = "barcode"
+    if columns is not None:
+        names = {k: v for k, v in names.items() if v in columns}
+    return names
+
+
+def missing_columns(summaryfile, names):
+    """Exit with an error about the columns which are expected in every summary file."""
+    logging.error("Did not find expected columns in summary file {}:\n {}".format(
+        summaryfile, ', '.join(names)))
+    sys.exit("ERROR: expected columns in summary file {} not found:\n {}".format(
+        summaryfile, ', '.join(names)))
+
+
+def read_header(buf, summaryfile, names):
+    """Return the end of the header line in buf, the sorted indices of names in it and the header.
+
+    Returns None if the header line is not complete yet
+    """
+    start = buf.find(b"\n") + 1
+    if start == 0:
+        return None
+    header = buf[:start].decode().rstrip("\r\n").split("\t")
+    if not set(names).issubset(header):
+        missing_columns(summaryfile, names)
+    return start, tuple(sorted(header.index(name) for name in names)), header
+
+
+def split_pieces(summaryfile, names, threads=1):
+    """Return the pieces of an uncompressed summary file as (file, start, end, fields, header).
+
+    Pieces end at line boundaries, the header line is not part of any piece.
+    fields are the sorted indices of the needed columns in the header.
+    An empty file, or a file with only a header, has no pieces
+    """
+    if os.path.getsize(summaryfile) == 0:  # can't be memory-mapped
+        logging.warning("Summary file {} is empty.".format(summaryfile))
+        return []
+    with open(summaryfile, 'rb') as handle, \
+            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if read_header(buf, summaryfile, names) is None:  # only a header without newline
+            read_header(buf[:] + b"\n", summaryfile, names)
+            return []
+        start, fields, header = read_header(buf, summaryfile, names)
+        number = max(-(-(buf.size() - start) // PIECE_SIZE), threads)
+        pieces = []
+        while start < buf.size():
+            end = buf.find(b"\n", start + (buf.size() - start) // number)
+            end = buf.size() if end == -1 else end + 1
+            pieces.append((summaryfile, start, end, fields, header))
+            start = end
+            number = max(number - 1, 1)
+    return pieces
+
+
+def project_fields(buf, fields, number):
+    """Return the fields of every line of buf as a tab separated table, in bytes.
+
+    Returns None if not every line of buf has number fields and ends with a newline
+    """
+    separators = np.flatnonzero((buf == TAB) | (buf == NEWLINE))
+    if separators.size % number or not (buf[separators[number - 1::number]] == NEWLINE).all():
+        return None
+    separators = separators.reshape(-1, number)
+    # bounds[:, i] is the start of field i and bounds[:, i + 1] - 1 its separator
+    bounds = np.empty((separators.shape[0], number + 1), dtype=np.int64)
+    bounds[:, 0] = np.concatenate([[0], separators[:-1, -1] + 1])
+    bounds[:, 1:] = separators + 1
+    fields = np.array(fields)
+    starts = bounds[:, fields].ravel()
+    lengths = bounds[:, fields + 1].ravel() - starts
+    offsets = np.cumsum(lengths) - lengths
+    table = buf[np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)]
+    ends = (offsets + lengths - 1).reshape(-1, fields.size)
+    table[ends[:, :-1]] = TAB
+    table[ends[:, -1]] = NEWLINE
+    return table.tobytes()
+
+
+def parse_piece(params):
+    """Return a DataFrame with the needed columns of a piece of an uncompressed summary file."""
+    summaryfile, start, end, fields, header = params
+    with open(summaryfile, 'rb') as handle, \
+            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        piece = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+        table = project_fields(piece, fields, len(header))
+        usecols = None
+        if table is None:
+            table, usecols = piece.tobytes(), list(fields)
+        del piece  # the memory map can only be closed without views on it
+    return pd.read_csv(io.BytesIO(table), sep="\t", header=None, usecols=usecols) \
+        .set_axis([header[i] for i in fields], axis="columns")
+
+
+def read_compressed(summaryfile, names):
+    """Return a DataFrame with the needed columns of a compressed summary file, None if empty."""
+    try:
+        return pd.read_csv(summaryfile, sep="\t", usecols=list(names))
+    except pd.errors.EmptyDataError:
+        logging.warning("Summary file {} is empty.".format(summaryfile))
+        return None
+    except ValueError:
+        missing_columns(summaryfile, names)
+
+
+def read_summary(files, readtype="1D", barcoded=False, columns=None, identifiers=False,
+                 threads=1):
+    """Return a DataFrame of the requested columns of the summary files.
+
+    Only reads which have a >0 length are returned.
+    start_time is converted to a timedelta since the start of the first read
+    """
+    names = summary_columns(readtype, barcoded, columns, identifiers)
+    logging.info("Reading columns {} of summary files.".format(', '.join(names)))
+    params = []
+    dfs = []
+    for summaryfile in files:
+        if summaryfile.endswith(COMPRESSED):
+            df = read_compressed(summaryfile, names)
+            if df is not None:
+                dfs.append(df)
+        else:
+            params.extend(split_pieces(summaryfile, names, threads))
+    if threads > 1 and len(params) > 1:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            dfs.extend(executor.map(parse_piece, params))
+    else:
+        dfs.extend(parse_piece(p) for p in params)
+    if not dfs:
+        logging.critical("No reads retrieved.")
+        sys.exit("Fatal: No reads found in input.")
+    datadf = pd.concat(dfs, ignore_index=True)[list(names)].rename(columns=names)
+    if "lengths" in datadf:
+        datadf = datadf.loc[datadf["lengths"] != 0].reset_index(drop=True)
+    if "start_time" in datadf:
+        seconds = datadf["start_time"].values - datadf["start_time"].min()
+        # converting integer nanoseconds is much faster than converting float seconds
+        datadf["start_time"] = pd.to_timedelta(np.round(seconds * 1e9).astype(np.int64))
+    logging.info("Read {} reads from {} summary files.".format(len(datadf), len(files)))
+    if len(datadf) == 0:
+        logging.critical("No reads retrieved.")
+        sys.exit("Fatal: No reads found in input.")
+    return datadf
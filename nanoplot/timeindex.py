@@ -0,0 +1,51 @@
+"""
+Aggregating the reads of a DataFrame by their start time.
+
+time_buckets aggregates the reads of a DataFrame in TimeBuckets, from which the time
+plots are created (see nanoplot.aggregate_plots) rather than from the reads themselves.
+The runtime filters compare the start times of all reads in a single vectorized scan
+(see nanoplot.filteroptions), which is faster than ordering the reads by time first.
+"""
+
+import logging
+import sys
+import numpy as np
+from nanoplot.aggregates import TimeBuckets
+
+NANOSECONDS = 10**9
+# reads starting later are not shown in the time plots, as likely multiple runs are combined
+MAX_DAYS = 5
+
+
+def start_nanoseconds(start_time):
+    """Return the timedelta Series start_time as int64 nanoseconds, missing times as NaT."""
+    return start_time.values.astype("timedelta64[ns]").view(np.int64)
+
+
+def time_buckets(df, width=600):
+    """Return the TimeBuckets of the reads of df, of which the first MAX_DAYS days are kept."""
+    nanoseconds = start_nanoseconds(df["start_time"])
+    shown = (nanoseconds != np.iinfo(np.int64).min) & (nanoseconds >= 0)
+    if (nanoseconds[shown] >= MAX_DAYS * 24 * 3600 * NANOSECONDS).any():
+        sys.stderr.write("\nWarning: data generated is from more than {} days.\n".format(MAX_DAYS))
+        sys.stderr.write("Likely this indicates you are combining multiple runs.\n")
+        sys.stderr.write("Plots based on time are invalid and therefore truncated to first "
+                         "{} days.\n\n".format(MAX_DAYS))
+        logging.warning("Time plots truncated to first {} days.".format(MAX_DAYS))
+        shown &= nanoseconds < MAX_DAYS * 24 * 3600 * NANOSECONDS
+    shown = None if shown.all() else np.flatnonzero(shown)
+
+    def column(name):
+        if name not in df:
+            return None
+        values = df[name].values
+        return values if shown is None else values[shown]
+    seconds = nanoseconds / NANOSECONDS
+    buckets = TimeBuckets(width)
+    buckets.update(seconds=seconds if shown is None else seconds[shown],
+                   lengths=column("lengths"),
+                   quals=column("quals"),
+                   channels=column("channelIDs"),
+                   durations=column("duration"),
+                   length_filter=column("length_filter"))
+    return buckets
@@ -6,8 +6,7 @@ import logging
 from nanoplot.version import __version__
 from argparse import HelpFormatter, Action
 import textwrap as _textwrap
-import pandas as pd
-import numpy as np
+from html import escape
 
 
 class CustomHelpFormatter(HelpFormatter):
@@ -74,20 +73,42 @@ def init_logs(args, tool="NanoPlot"):
     return logname
 
 
-def chunks(values, chunks):
-    if values:
-        chunksize = int(len(values) / chunks)
-        return([' '.join(values[i:i+chunksize]) for i in range(0, len(values), chunksize)])
-    else:
-        return [" "] * chunks
+# formats which browsers show as images, other plot files are linked as download
+BROWSER_FORMATS = ["png", "jpg", "jpeg", "gif", "svg"]
+THUMBNAIL_WIDTH = 400
 
 
-def stats2html(statsf):
-    df = pd.read_csv(statsf, sep=':', header=None, names=['feature', 'value'])
-    values = df["value"].str.strip().str.replace('\t', ' ').str.split().replace(np.nan, '')
-    num = len(values[0]) or 1
-    v = [chunks(i, num) for i in values]
-    return pd.DataFrame(v, index=df["feature"]).to_html(header=False)
+def make_thumbnail(plotfile, width=THUMBNAIL_WIDTH):
+    """Save a downscaled copy of a raster image and return its path.
+
+    Vector images are returned as is, since browsers scale those without loss,
+    as are all images if Pillow is not installed
+    """
+    if plotfile.endswith(".svg"):
+        return plotfile
+    try:
+        from PIL import Image
+    except ImportError:
+        logging.warning("Pillow is not installed, linking full images instead of thumbnails.")
+        return plotfile
+    thumbnail = os.path.splitext(plotfile)[0] + ".thumbnail.png"
+    with Image.open(plotfile) as image:
+        image.thumbnail((width, width * image.height // image.width or 1))
+        image.save(thumbnail)
+    return thumbnail
+
+
+def link_plot(plot, reportdir, thumbnails=False):
+    """Return the html linking to the file of a plot, relative to the directory of the report.
+
+    Images are loaded lazily by the browser, only when scrolled into view
+    """
+    target = os.path.relpath(plot.path, reportdir)
+    if plot.path.rsplit(".", 1)[-1].lower() not in BROWSER_FORMATS:
+        return '<a href="{0}">{0}</a>'.format(escape(target))
+    source = os.path.relpath(make_thumbnail(plot.path), reportdir) if thumbnails else target
+    return '<a href="{}"><img src="{}" loading="lazy" alt="{}"></a>'.format(
+        escape(target), escape(source), escape(plot.title))
 
 
 html_head = """<!DOCTYPE html>
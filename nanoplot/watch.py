@@ -0,0 +1,98 @@
+"""
+Watching summary files which grow during a run.
+
+Every summary file is read from the byte offset up to which it was read before,
+such that only the complete rows appended since the previous update are parsed.
+These are added to the aggregates of the run and of the barcodes, as when streaming.
+As the start of the run isn't known while it grows, times are used as reported in the summary.
+The cost of an update thus depends on the number of new reads, not on the size of the run.
+If a file shrinks, e.g. when it is rewritten or rotated, its rows that were counted can't be
+removed from the aggregates, which are therefore rebuilt by reading all files from the start.
+"""
+
+import logging
+import mmap
+import os
+from nanoplot.stream import SummaryAggregates, prepare_chunk
+from nanoplot.summary import PIECE_SIZE, summary_columns, read_header, parse_piece
+
+
+class SummaryTail(object):
+    """The rows of a summary file which were not read yet."""
+
+    def __init__(self, summaryfile, names):
+        self.summaryfile = summaryfile
+        self.names = names
+        self.offset = None  # the end of the rows which are read, once the header is known
+        self.fields = None
+        self.header = None
+        self.truncated = False
+
+    def rewind(self):
+        """Read the file from its start again."""
+        self.offset = None
+        self.truncated = False
+
+    def chunks(self):
+        """Yield DataFrames of the complete rows appended since the previous call.
+
+        Rows are parsed in pieces of at most PIECE_SIZE bytes.
+        If the file shrank since the previous call, truncated is set and nothing is yielded
+        """
+        if not os.path.isfile(self.summaryfile) or os.path.getsize(self.summaryfile) == 0:
+            self.truncated = self.offset is not None
+            return
+        with open(self.summaryfile, 'rb') as handle, \
+                mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if self.offset is None:
+                header = read_header(buf, self.summaryfile, self.names)
+                if header is None:
+                    return
+                self.offset, self.fields, self.header = header
+            if buf.size() < self.offset:
+                self.truncated = True
+                return
+            ends = []
+            start = self.offset
+            while start < buf.size():
+                end = buf.rfind(b"\n", start, start + PIECE_SIZE) + 1
+                if end <= start:
+                    break
+                ends.append(end)
+                start = end
+        for end in ends:
+            chunk = parse_piece((self.summaryfile, self.offset, end, self.fields, self.header))
+            self.offset = end
+            yield prepare_chunk(chunk, self.names)
+
+
+class SummaryWatcher(object):
+    """The SummaryAggregates of summary files, updated with the rows appended to them."""
+
+    def __init__(self, settings):
+        names = summary_columns(settings["readtype"], settings["barcoded"], identifiers=True)
+        self.settings = settings
+        self.tails = [SummaryTail(summaryfile, names) for summaryfile in settings["summary"]]
+        self.aggregates = SummaryAggregates(settings)
+
+    def update(self):
+        """Add the new rows of all summary files to the aggregates, return the number of reads.
+
+        If a file shrank, the aggregates are rebuilt from all rows of all files
+        """
+        new_reads = 0
+        for tail in self.tails:
+            for chunk in tail.chunks():
+                self.aggregates.update(chunk)
+                new_reads += len(chunk)
+        truncated = [tail.summaryfile for tail in self.tails if tail.truncated]
+        if truncated:
+            logging.warning("Summary file(s) {} shrank, reading all summary files again."
+                            .format(", ".join(truncated)))
+            self.aggregates = SummaryAggregates(self.settings)
+            for tail in self.tails:
+                tail.rewind()
+            return self.update()
+        if new_reads:
+            self.aggregates.finish()
+        return new_reads
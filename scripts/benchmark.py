@@ -0,0 +1,383 @@
+#! /usr/bin/env python
+"""
+Benchmark NanoPlot on synthetic data.
+
+Summary, fastq and bam files are generated from a fixed random seed at the requested
+number of reads and barcodes, and stored in a data directory for reuse. NanoPlot is
+run on every input in a fresh process, such that the peak memory of every run is
+measured separately, and the timing, cpu time, peak memory and number of reads of
+every stage and plot type are collected from its NanoPlot-metrics.json.
+The results are written as json, which can be passed as --baseline to a later run
+to report the stages and plots which became slower or use more memory.
+
+Every run uses a single thread by default, and the environment of the runs is
+fixed (hash seed, matplotlib backend, BLAS threads) for reproducible numbers.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from os import path
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+CASES = {
+    "summary": ["--summary", "{summary}"],
+    "summary_stream": ["--summary", "{summary}", "--stream"],
+    "fastq": ["--fastq", "{fastq}"],
+    "fastq_minimal": ["--fastq_minimal", "{fastq}"],
+    "bam": ["--bam", "{bam}"],
+}
+CHUNKSIZE = 100000  # reads generated at once
+RUN_HOURS = 48
+CHANNELS = 512
+REFERENCES = 24
+REFERENCE_LENGTH = 10000000
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+RUN_ENVIRONMENT = {
+    "PYTHONHASHSEED": "0",
+    "MPLBACKEND": "Agg",
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+
+def main():
+    args = get_args()
+    os.makedirs(args.datadir, exist_ok=True)
+    os.makedirs(args.outdir, exist_ok=True)
+    inputs = generate_inputs(args)
+    results = {
+        "format": FORMAT_VERSION,
+        "environment": environment(),
+        "settings": {k: getattr(args, k) for k in
+                     ["reads", "barcodes", "read_length", "seed", "threads", "plots"]},
+        "cases": {case: run_case(case, inputs, args) for case in args.cases},
+    }
+    output = args.output or path.join(args.outdir, "benchmark.json")
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+    print("Wrote results to {}".format(output))
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.tolerance, args.min_time)
+        if regressions:
+            sys.exit("{} measurements regressed by more than a factor {}".format(
+                len(regressions), args.tolerance))
+
+
+def get_args():
+    parser = ArgumentParser(description="Benchmark NanoPlot on synthetic data.")
+    parser.add_argument("--reads",
+                        help="Number of reads to generate, e.g. 1e6.",
+                        type=lambda value: int(float(value)),
+                        default=100000)
+    parser.add_argument("--barcodes",
+                        help="Number of barcodes in the summary file, 1 for no barcodes.",
+                        type=int,
+                        choices=range(1, 97),
+                        metavar="1-96",
+                        default=1)
+    parser.add_argument("--read_length",
+                        help="Median read length.",
+                        type=int,
+                        default=2000)
+    parser.add_argument("--seed",
+                        help="Seed of the random generator.",
+                        type=int,
+                        default=1)
+    parser.add_argument("--cases",
+                        help="Inputs on which to run NanoPlot.",
+                        nargs='+',
+                        choices=list(CASES),
+                        default=list(CASES))
+    parser.add_argument("-t", "--threads",
+                        help="Number of threads used by NanoPlot.",
+                        type=int,
+                        default=1)
+    parser.add_argument("--plots",
+                        help="Bivariate plot types passed to NanoPlot, default those of NanoPlot.",
+                        nargs='+',
+                        choices=['kde', 'hex', 'dot', 'pauvre', 'binned'])
+    parser.add_argument("--repeats",
+                        help="Run every case this many times and keep the fastest run.",
+                        type=int,
+                        default=1)
+    parser.add_argument("--datadir",
+                        help="Directory for the generated inputs, which are reused if present.",
+                        default="benchmark-data")
+    parser.add_argument("-o", "--outdir",
+                        help="Directory for the output of NanoPlot and the results.",
+                        default="benchmark")
+    parser.add_argument("--output",
+                        help="File to write the results to, default benchmark.json in outdir.")
+    parser.add_argument("--baseline",
+                        help="Results of an earlier benchmark to compare against.")
+    parser.add_argument("--tolerance",
+                        help="Ratio to the baseline above which a measurement is a regression.",
+                        type=float,
+                        default=1.25)
+    parser.add_argument("--min_time",
+                        help="Ignore measurements faster than this many seconds in the baseline.",
+                        type=float,
+                        default=0.1)
+    return parser.parse_args()
+
+
+def environment():
+    """Return a description of the machine and package versions the benchmark runs on."""
+    import matplotlib
+    from nanoplot.version import __version__
+    cpu = platform.processor()
+    if path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as cpuinfo:
+            models = [line.split(":", 1)[1].strip() for line in cpuinfo
+                      if line.startswith("model name")]
+        cpu = models[0] if models else cpu
+    return {
+        "platform": platform.platform(),
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "nanoplot": __version__,
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "matplotlib": matplotlib.__version__,
+    }
+
+
+def chunks(reads):
+    """Yield the sizes of the chunks in which reads are generated."""
+    for start in range(0, reads, CHUNKSIZE):
+        yield min(CHUNKSIZE, reads - start)
+
+
+def read_lengths(rng, number, median):
+    return np.maximum(rng.lognormal(np.log(median), 0.8, number), 50).astype(np.int64)
+
+
+def read_quals(rng, number):
+    return np.clip(rng.normal(11, 2.5, number), 2, 30)
+
+
+def generate_inputs(args):
+    """Generate the inputs needed by the cases if not yet present, return their paths."""
+    name = "reads{}_barcodes{}_length{}_seed{}".format(
+        args.reads, args.barcodes, args.read_length, args.seed)
+    inputs = {
+        "summary": path.join(args.datadir, name + "_summary.txt"),
+        "fastq": path.join(args.datadir, name + ".fastq.gz"),
+        "bam": path.join(args.datadir, name + ".bam"),
+    }
+    needed = {arg.strip("{}") for case in args.cases for arg in CASES[case] if arg[0] == "{"}
+    generators = {"summary": write_summary, "fastq": write_fastq, "bam": write_bam}
+    for kind in sorted(needed):
+        if not path.exists(inputs[kind]):
+            print("Generating {}".format(inputs[kind]))
+            # in a separate process: the peak memory of a process is inherited by the
+            # NanoPlot processes started later, and would be attributed to these
+            partial = path.join(args.datadir, "partial_" + path.basename(inputs[kind]))
+            generator = multiprocessing.get_context("spawn").Process(
+                target=generators[kind], args=(partial, args))
+            generator.start()
+            generator.join()
+            if generator.exitcode != 0:
+                sys.exit("Generating {} failed".format(inputs[kind]))
+            os.replace(partial, inputs[kind])
+            if kind == "bam":
+                os.replace(partial + ".bai", inputs[kind] + ".bai")
+    return inputs
+
+
+def write_summary(filename, args):
+    """Write a sequencing_summary file with the columns of guppy, sorted by start time."""
+    rng = np.random.default_rng(args.seed)
+    barcodes = ["barcode{:02d}".format(b + 1) for b in range(args.barcodes)] + ["unclassified"]
+    start = 0
+    for index, number in enumerate(chunks(args.reads)):
+        # every chunk covers the next part of the run, such that start times increase
+        end = RUN_HOURS * 3600 * (start + number) / args.reads
+        begin = RUN_HOURS * 3600 * start / args.reads
+        lengths = read_lengths(rng, number, args.read_length)
+        chunk = pd.DataFrame({
+            "filename": "FAK00000_pass_{}.fast5".format(index),
+            "read_id": ["read_{}".format(i) for i in range(start, start + number)],
+            "run_id": "0123456789abcdef",
+            "channel": rng.integers(1, CHANNELS + 1, number),
+            "start_time": np.sort(rng.uniform(begin, end, number)).round(4),
+            "duration": (lengths / 450).round(4),
+            "num_events": lengths * 2,
+            "passes_filtering": "TRUE",
+            "template_start": rng.uniform(0, 2, number).round(4),
+            "num_events_template": lengths * 2,
+            "template_duration": (lengths / 450).round(4),
+            "sequence_length_template": lengths,
+            "mean_qscore_template": read_quals(rng, number).round(6),
+            "strand_score_template": rng.uniform(-1, 0, number).round(6),
+            "median_template": rng.uniform(70, 110, number).round(4),
+            "mad_template": rng.uniform(8, 15, number).round(4),
+        })
+        if args.barcodes > 1:
+            chunk["barcode_arrangement"] = rng.choice(barcodes, number)
+        chunk.to_csv(filename, sep="\t", index=False, header=index == 0,
+                     mode='w' if index == 0 else 'a')
+        start += number
+
+
+def sequences(rng, lengths, alphabet, low=0):
+    """Return random sequences of lengths as a list of bytes, drawn from alphabet."""
+    data = alphabet[rng.integers(low, low + alphabet.size, lengths.sum())].tobytes()
+    ends = np.cumsum(lengths).tolist()
+    return [data[e - l:e] for e, l in zip(ends, lengths.tolist())]
+
+
+def write_fastq(filename, args):
+    """Write a gzip compressed fastq file with MinKNOW style headers."""
+    import gzip
+    rng = np.random.default_rng(args.seed + 1)
+    qualities = np.arange(33, 33 + 41, dtype=np.uint8)
+    start = 0
+    with gzip.open(filename, 'wb', compresslevel=1) as fastq:
+        for number in chunks(args.reads):
+            lengths = read_lengths(rng, number, args.read_length)
+            seconds = np.sort(rng.uniform(start, start + number, number) * RUN_HOURS * 3600 /
+                              args.reads).astype(np.int64)
+            times = pd.to_datetime("2020-01-01") + pd.to_timedelta(seconds, unit="s")
+            channels = rng.integers(1, CHANNELS + 1, number)
+            quals = [qualities[np.clip(rng.normal(q, 4, n), 0, 40).astype(np.int64)].tobytes()
+                     for q, n in zip(read_quals(rng, number), lengths)]
+            records = []
+            for i, (seq, qual, ch, time) in enumerate(zip(
+                    sequences(rng, lengths, BASES), quals, channels,
+                    times.strftime("%Y-%m-%dT%H:%M:%SZ"))):
+                records.append(
+                    b"@read_%d runid=0123456789abcdef read=%d ch=%d start_time=%s\n%s\n+\n%s\n"
+                    % (start + i, start + i, ch, time.encode(), seq, qual))
+            fastq.write(b"".join(records))
+            start += number
+
+
+def write_bam(filename, args):
+    """Write a sorted and indexed bam file of reads aligned to a synthetic genome."""
+    import array
+    import pysam
+    rng = np.random.default_rng(args.seed + 2)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"},
+              "SQ": [{"SN": "chr{}".format(r + 1), "LN": REFERENCE_LENGTH}
+                     for r in range(REFERENCES)]}
+    genome = REFERENCES * REFERENCE_LENGTH
+    start = 0
+    with pysam.AlignmentFile(filename, "wb", header=header) as bam:
+        for number in chunks(args.reads):
+            # every chunk covers the next part of the genome, such that positions are sorted
+            positions = np.sort(rng.integers(genome * start // args.reads,
+                                             genome * (start + number) // args.reads, number))
+            lengths = np.minimum(read_lengths(rng, number, args.read_length),
+                                 REFERENCE_LENGTH - positions % REFERENCE_LENGTH)
+            clips = rng.integers(0, 50, number) * (lengths > 100)
+            flags = rng.choice([0, 16, 256, 2048], number, p=[0.45, 0.45, 0.05, 0.05])
+            mapqs = rng.integers(0, 61, number)
+            errors = (lengths * rng.uniform(0.02, 0.15, number)).astype(np.int64)
+            quals = sequences(rng, lengths, np.arange(41, dtype=np.uint8))
+            for i, seq in enumerate(sequences(rng, lengths, BASES)):
+                read = pysam.AlignedSegment()
+                read.query_name = "read_{}".format(start + i)
+                read.query_sequence = seq.decode()
+                read.flag = int(flags[i])
+                read.reference_id = int(positions[i] // REFERENCE_LENGTH)
+                read.reference_start = int(positions[i] % REFERENCE_LENGTH)
+                read.mapping_quality = int(mapqs[i])
+                read.cigartuples = [(4, int(clips[i])), (0, int(lengths[i] - clips[i]))] \
+                    if clips[i] else [(0, int(lengths[i]))]
+                read.query_qualities = array.array("B", quals[i])
+                read.set_tag("NM", int(errors[i]))
+                bam.write(read)
+            start += number
+    pysam.index(filename)
+
+
+def run_case(case, inputs, args):
+    """Run NanoPlot on the input of case and return the metrics of the fastest run."""
+    outdir = path.join(args.outdir, case)
+    command = [sys.executable, "-m", "nanoplot.NanoPlot", "-o", outdir, "--no_cache",
+               "-t", str(args.threads)] + [arg.format(**inputs) for arg in CASES[case]]
+    if args.barcodes > 1 and case.startswith("summary"):
+        command.append("--barcoded")
+    if args.plots:
+        command.extend(["--plots"] + args.plots)
+    env = dict(os.environ, **RUN_ENVIRONMENT)
+    runs = []
+    for _ in range(args.repeats):
+        print("Running {}".format(" ".join(command)))
+        subprocess.run(command, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(path.join(outdir, "NanoPlot-metrics.json")) as handle:
+            runs.append(summarize(json.load(handle)))
+    return min(runs, key=lambda run: run["wall_time"])
+
+
+def summarize(metrics):
+    """Return the totals, stages and plot types of NanoPlot metrics, keyed by their name.
+
+    Plots with the same name, e.g. of different barcodes, are summed
+    """
+    plots = {}
+    for record in metrics["plots"]:
+        plot = plots.setdefault(record["name"], {
+            "count": 0, "wall_time": 0, "cpu_time": 0, "peak_rss": 0, "rows": 0})
+        plot["count"] += 1
+        plot["wall_time"] = round(plot["wall_time"] + record["wall_time"], 4)
+        plot["cpu_time"] = round(plot["cpu_time"] + record["cpu_time"], 4)
+        plot["peak_rss"] = max(plot["peak_rss"], record["peak_rss"] or 0)
+        plot["rows"] += record["rows"] or 0
+    return {
+        "wall_time": metrics["wall_time"],
+        "cpu_time": metrics["cpu_time"],
+        "peak_rss": max(metrics["peak_rss"] or 0, metrics["peak_rss_children"] or 0),
+        "stages": {s["name"]: {k: v for k, v in s.items() if k not in ["name", "pid"]}
+                   for s in metrics["stages"]},
+        "plots": plots,
+    }
+
+
+def compare(results, baseline, tolerance, min_time):
+    """Print the ratio of the wall times and peak memory to those of the baseline.
+
+    Returns the measurements of which the ratio exceeds the tolerance
+    """
+    for key in ["environment", "settings"]:
+        if results[key] != baseline.get(key):
+            print("WARNING: the {} of the baseline differs, the comparison may not be fair."
+                  .format(key))
+    regressions = []
+    print("{:<16}{:<60}{:>10}{:>10}{:>8}".format(
+        "case", "measurement", "baseline", "now", "ratio"))
+    for case, measured in results["cases"].items():
+        if case not in baseline["cases"]:
+            continue
+        base = baseline["cases"][case]
+        pairs = [("total wall_time", measured["wall_time"], base["wall_time"]),
+                 ("total peak_rss (MB)", measured["peak_rss"] / 1e6, base["peak_rss"] / 1e6)]
+        for kind in ["stages", "plots"]:
+            for name, values in measured[kind].items():
+                if name in base[kind] and base[kind][name]["wall_time"] >= min_time:
+                    pairs.append((name, values["wall_time"], base[kind][name]["wall_time"]))
+        for name, now, before in pairs:
+            ratio = now / before if before else float("inf")
+            flag = " <-- regression" if ratio > tolerance else ""
+            print("{:<16}{:<60}{:>10.2f}{:>10.2f}{:>8.2f}{}".format(
+                case, name[:58], before, now, ratio, flag))
+            if ratio > tolerance:
+                regressions.append((case, name))
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+"""
+Check that importing the NanoPlot entry point stays fast.
+
+The module is imported in a fresh interpreter, which fails if any of the heavy
+dependencies is loaded at import time or if importing takes longer than the budget.
+"""
+
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+HEAVY_MODULES = ["matplotlib", "seaborn", "pandas", "numpy", "scipy", "pysam", "Bio",
+                 "pyarrow", "nanoget", "nanoplotter", "nanomath"]
+
+PROBE = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import nanoplot.NanoPlot
+print(perf_counter() - start)
+print(" ".join(m for m in {!r} if m in sys.modules))
+"""
+
+
+def main():
+    parser = ArgumentParser(description="Check the import time of the NanoPlot entry point.")
+    parser.add_argument("--budget",
+                        help="Maximal import time in seconds.",
+                        type=float,
+                        default=0.5)
+    args = parser.parse_args()
+    output = subprocess.run([sys.executable, "-c", PROBE.format(HEAVY_MODULES)],
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    seconds, loaded = output.split("\n")[:2]
+    print("Importing nanoplot.NanoPlot took {:.3f} seconds".format(float(seconds)))
+    errors = []
+    if loaded:
+        errors.append("heavy modules imported at startup: {}".format(loaded))
+    if float(seconds) > args.budget:
+        errors.append("import time exceeds the budget of {} seconds".format(args.budget))
+    if errors:
+        sys.exit("ERROR: " + "; ".join(errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from nanoget import get_input
+from nanoplot.summary import read_summary
 from nanoplotter.timeplots import sequencing_speed_over_time
 from argparse import ArgumentParser
 from os import path
@@ -6,7 +6,7 @@ from os import path
 
 def main():
     args = get_args()
-    df = get_input(source="summary", files=args.summary)[["lengths", "start_time", "duration"]]
+    df = read_summary(files=args.summary, columns=["lengths", "start_time", "duration"])
     sequencing_speed_over_time(dfs=df,
                                path=path.join(args.outdir, args.prefix),
                                figformat=args.format,
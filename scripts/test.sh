@@ -2,6 +2,12 @@ set -ev
 
 git clone https://github.com/wdecoster/nanotest.git
 
+python -m pytest -q tests
+python scripts/check_import_time.py
+benchmark=$(mktemp -d)
+python scripts/benchmark.py --reads 1e4 --barcodes 4 --cases summary_stream bam \
+    --datadir "$benchmark/data" -o "$benchmark/output"
+rm -rf "$benchmark"
 NanoPlot -h
 NanoPlot --listcolors
 echo ""
@@ -32,12 +32,13 @@ setup(
     python_requires='>=3',
     install_requires=['biopython',
                       'pysam>0.10.0.0',
-                      'pandas>=0.22.0',
+                      'pandas>=1.0.0',
                       'numpy',
+                      'pyarrow',
                       'scipy',
                       'python-dateutil',
                       'seaborn',
-                      'nanoplotter>=0.44.3',
+                      'nanoplotter>=1.2.0',
                       'nanoget>=1.7.7',
                       'nanomath>=0.21.0'
                       ],
@@ -47,6 +48,9 @@ setup(
     entry_points={
         'console_scripts': [
             'NanoPlot=nanoplot.NanoPlot:main',
+            'NanoPlot-server=nanoplot.server:main',
+            'NanoPlot-client=nanoplot.client:main',
+            'NanoPlot-batch=nanoplot.batch:main',
         ],
     },
 )
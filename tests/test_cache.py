@@ -0,0 +1,57 @@
+import os
+import time
+import pandas as pd
+import nanoplot.cache as cache
+import nanoplot.store as store
+
+SETTINGS = {"readtype": "1D", "barcoded": False, "alength": False}
+
+
+def test_key_changes_with_the_input_files(tmp_path):
+    reads = tmp_path / "reads.fastq"
+    reads.write_text("@r\nA\n+\n!\n")
+    key = cache.cache_key("fastq", [str(reads)], SETTINGS)
+    assert key == cache.cache_key("fastq", [str(reads)], SETTINGS)
+    assert key != cache.cache_key("fastq", [str(reads)], dict(SETTINGS, barcoded=True))
+    reads.write_text("@r\nAC\n+\n!!\n")
+    assert key != cache.cache_key("fastq", [str(reads)], SETTINGS)
+    assert cache.cache_key("fastq", [str(tmp_path / "missing.fastq")], SETTINGS) is None
+
+
+def test_save_and_fetch(tmp_path):
+    df = pd.DataFrame({"lengths": [1, 2, 3], "quals": [7.0, 8.0, 9.0]})
+    metadata = store.make_metadata("fastq", [])
+    assert cache.fetch(str(tmp_path), "key") is None
+    cache.save(df, str(tmp_path), "key", metadata, max_size=1e9)
+    assert os.listdir(str(tmp_path)) == ["key.feather"]
+    pd.testing.assert_frame_equal(cache.fetch(str(tmp_path), "key"), df)
+    pd.testing.assert_frame_equal(cache.fetch(str(tmp_path), "key", columns=["lengths"]),
+                                  df[["lengths"]])
+
+
+def test_evict_keeps_the_most_recent_entry(tmp_path):
+    df = pd.DataFrame({"lengths": range(1000)})
+    metadata = store.make_metadata("fastq", [])
+    for i, key in enumerate(["old", "new"]):
+        cache.save(df, str(tmp_path), key, metadata, max_size=1e9)
+        os.utime(str(tmp_path / (key + ".feather")), (i, i))
+    cache.evict(str(tmp_path), max_size=1)
+    assert os.listdir(str(tmp_path)) == ["new.feather"]
+
+
+def test_unreadable_entry_is_removed(tmp_path):
+    df = pd.DataFrame({"lengths": range(1000)})
+    cache.save(df, str(tmp_path), "key", store.make_metadata("fastq", []), max_size=1e9)
+    entry = tmp_path / "key.feather"
+    entry.write_bytes(entry.read_bytes()[:100])
+    assert cache.fetch(str(tmp_path), "key") is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_evict_removes_stale_temporary_files(tmp_path):
+    for name, age in [("old.tmp", 2 * cache.STALE_TMP_AGE), ("new.tmp", 0)]:
+        (tmp_path / name).write_text("partial")
+        mtime = time.time() - age
+        os.utime(str(tmp_path / name), (mtime, mtime))
+    cache.evict(str(tmp_path), max_size=1e9)
+    assert os.listdir(str(tmp_path)) == ["new.tmp"]
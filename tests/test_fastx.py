@@ -0,0 +1,51 @@
+import gzip
+import numpy as np
+import pandas as pd
+import pytest
+from nanoget import get_input
+from nanoplot.fastx import extract_sequences
+
+
+def write_reads(filename, number, fasta=False, seed=1, line_width=None):
+    rng = np.random.default_rng(seed)
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, 'wt') as handle:
+        for i in range(number):
+            length = int(rng.integers(1, 3000))
+            seq = "".join(rng.choice(list("ACGT"), length))
+            if fasta:
+                width = line_width or length
+                lines = [seq[j:j + width] for j in range(0, length, width)]
+                handle.write(">read{}\n{}\n".format(i, "\n".join(lines)))
+            else:
+                qual = "".join(chr(33 + q) for q in rng.integers(2, 40, length))
+                handle.write("@read{}\n{}\n+\n{}\n".format(i, seq, qual))
+
+
+@pytest.mark.parametrize("name", ["reads.fastq", "reads.fastq.gz"])
+def test_fastq_equals_nanoget(tmp_path, name):
+    filename = str(tmp_path / name)
+    write_reads(filename, 500)
+    expected = get_input("fastq", [filename], threads=1)
+    extracted = extract_sequences([filename], source="fastq", threads=1)
+    np.testing.assert_array_equal(extracted["lengths"], expected["lengths"])
+    np.testing.assert_allclose(extracted["quals"], expected["quals"], rtol=1e-6)
+
+
+def test_fastq_blocks_split_records(tmp_path, monkeypatch):
+    import nanoplot.fastx as fastx
+    filename = str(tmp_path / "reads.fastq")
+    write_reads(filename, 200)
+    whole = extract_sequences([filename], source="fastq", threads=1)
+    monkeypatch.setattr(fastx, "BLOCKSIZE", 1000)
+    blocks = extract_sequences([filename], source="fastq", threads=1)
+    pd.testing.assert_frame_equal(blocks, whole)
+
+
+@pytest.mark.parametrize("line_width", [None, 60])
+def test_fasta_equals_nanoget(tmp_path, line_width):
+    filename = str(tmp_path / "reads.fa")
+    write_reads(filename, 300, fasta=True, line_width=line_width)
+    expected = get_input("fasta", [filename], threads=1)
+    extracted = extract_sequences([filename], source="fasta", threads=1)
+    np.testing.assert_array_equal(extracted["lengths"], expected["lengths"])
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nanoplot.grouping import BarcodeGroups
+
+
+def test_groups_in_order_of_first_appearance():
+    df = pd.DataFrame({"barcode": ["b", "a", None, "b", "c", "a", None],
+                       "lengths": np.arange(7)})
+    groups = BarcodeGroups(df)
+    assert groups.names == ["b", "a", "c"]
+    assert groups.counts() == [("b", 2), ("a", 2), ("c", 1)]
+    assert groups.get("a")["lengths"].tolist() == [1, 5]
+    assert groups.unassigned()["lengths"].tolist() == [2, 6]
+    assert [len(f) for f in groups.frames()] == [2, 2, 1]
+
+
+def test_groups_equal_selecting_every_barcode():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"barcode": rng.choice(["x", "y", "z"], 1000),
+                       "lengths": rng.integers(1, 100, 1000)})
+    groups = BarcodeGroups(df)
+    for name in groups.names:
+        pd.testing.assert_frame_equal(groups.get(name), df.loc[df["barcode"] == name])
+
+
+@pytest.mark.parametrize("dtype", [object, "category"])
+def test_subset_equals_grouping_again(dtype):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"barcode": rng.choice(["x", "y", None, "z"], 1000),
+                       "lengths": rng.integers(1, 100, 1000)})
+    df["barcode"] = df["barcode"].astype(dtype)
+    groups = BarcodeGroups(df)
+    # all reads of barcode y are removed
+    keep = (groups.df["lengths"].values > 30) & (groups.df["barcode"] != "y").values
+    subset = groups.subset(groups.df.loc[keep])
+    expected = BarcodeGroups(groups.df.loc[keep])
+    assert subset.names == expected.names == [n for n in groups.names if n != "y"]
+    assert subset.counts() == expected.counts()
+    pd.testing.assert_frame_equal(subset.unassigned(), expected.unassigned())
+    for name in expected.names:
+        pd.testing.assert_frame_equal(subset.get(name), expected.get(name))
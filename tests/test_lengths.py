@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import nanoplot.lengths as lengths
+from nanoplot.aggregates import LengthCounts
+
+
+def reference_nx(values, x):
+    """The Nx as computed by nanomath, from all lengths sorted."""
+    values = np.sort(values)
+    return values[np.where(np.cumsum(values) >= (1 - x) * np.sum(values))[0][0]]
+
+
+def reference_ngx(values, genome_size, x):
+    """The NGx from all lengths sorted, longest first."""
+    values = np.sort(values)[::-1]
+    return values[np.where(np.cumsum(values) >= x * genome_size)[0][0]]
+
+
+def random_lengths(seed, high=100000):
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, high, rng.integers(1, 5000))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("x", [0.1, 0.5, 0.9])
+def test_nx_equals_sorted_reference(seed, x):
+    values = random_lengths(seed)
+    assert lengths.nx(*lengths.length_counts(values), x=x) == reference_nx(values, x)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("x", [0.1, 0.5, 0.9])
+def test_ngx_equals_sorted_reference(seed, x):
+    values = random_lengths(seed)
+    genome_size = values.sum() // 2
+    assert lengths.ngx(*lengths.length_counts(values), genome_size=genome_size, x=x) == \
+        reference_ngx(values, genome_size, x)
+
+
+def test_ng50_without_enough_bases():
+    assert lengths.ng50(*lengths.length_counts([1000, 2000]), genome_size=10000) is None
+
+
+def test_n50_of_single_read():
+    assert lengths.n50(*lengths.length_counts([1234])) == 1234
+
+
+@pytest.mark.parametrize("number", [1, 2, 3, 1000, 1001])
+def test_median_equals_numpy(number):
+    values = np.random.default_rng(number).integers(1, 50000, number)
+    assert lengths.median(*lengths.length_counts(values)) == np.median(values)
+
+
+def test_long_reads_are_counted_sparsely():
+    values = random_lengths(1, high=4 * lengths.DENSE_LENGTHS)
+    counts = LengthCounts()
+    for chunk in np.array_split(values, 3):
+        counts.update(chunk)
+    assert counts.counts.size <= lengths.DENSE_LENGTHS
+    distinct = counts.distinct()
+    np.testing.assert_array_equal(distinct[0], np.unique(values))
+    np.testing.assert_array_equal(distinct[1], np.unique(values, return_counts=True)[1])
+    np.testing.assert_array_equal(np.concatenate(distinct),
+                                  np.concatenate(lengths.length_counts(values)))
+    assert counts.number_of_bases == values.sum()
+    assert counts.max() == values.max()
+    assert lengths.median(*distinct) == np.median(values)
+    assert lengths.n50(*distinct) == reference_nx(values, 0.5)
+
+
+@pytest.mark.parametrize("q", [0, 5, 25, 50, 90, 100])
+def test_percentile_equals_numpy(q):
+    values = np.random.default_rng(1).normal(10, 3, 999)
+    assert lengths.percentile(values, q) == pytest.approx(np.percentile(values, q))
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from nanoplot.sampling import Reservoir, stratum_labels
+
+
+def reads(number, seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"lengths": np.arange(number),
+                         "barcode": rng.choice(["a", "b", "c", "d"], number, p=[.7, .1, .1, .1])})
+
+
+def test_reservoir_keeps_size_reads_regardless_of_chunks():
+    df = reads(10000)
+    whole = Reservoir(500, seed=3).update(df).sample()
+    assert len(whole) == 500
+    assert whole["lengths"].is_unique
+    chunked = Reservoir(500, seed=3)
+    for i in range(0, 10000, 1500):
+        chunked.update(df.iloc[i:i + 1500])
+    assert len(chunked.sample()) == 500
+
+
+def test_reservoir_keeps_all_reads_if_fewer():
+    df = reads(100)
+    assert len(Reservoir(500).update(df).sample()) == 100
+
+
+def test_stratified_reservoir_represents_every_stratum_equally():
+    sample = Reservoir(400, by="barcode", seed=1).update(reads(10000)).sample()
+    assert sample["barcode"].value_counts().tolist() == [100] * 4
+
+
+def test_stratified_reservoir_keeps_at_most_size_reads():
+    df = reads(1000)
+    df["channelIDs"] = np.arange(1000) % 300
+    sample = Reservoir(200, by="channel", seed=1).update(df).sample()
+    assert len(sample) == 200
+    assert sample["channelIDs"].is_unique
+
+
+def test_stratified_reservoir_shares_the_rest_of_small_strata():
+    df = reads(10000)
+    b = np.flatnonzero(df["barcode"] == "b")
+    df.loc[b[40:], "barcode"] = "e"
+    sample = Reservoir(400, by="barcode", seed=1).update(df).sample()
+    assert len(sample) == 400
+    counts = sample["barcode"].value_counts()
+    assert counts["b"] == 40
+    assert counts.drop("b").max() - counts.drop("b").min() <= 1
+
+
+def test_reads_without_start_time_are_a_time_stratum():
+    df = reads(1000)
+    df["start_time"] = pd.to_timedelta(np.arange(1000) * 20, unit="s")
+    df.loc[::10, "start_time"] = pd.NaT
+    labels = stratum_labels(df, "time")
+    assert (labels[::10] == -1).all()
+    assert labels.min() == -1 and labels.max() == 999 * 20 // 3600
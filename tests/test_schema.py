@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+from nanoplot.schema import compact
+from nanoplot.stats import ReadStats, StatsTable
+
+
+def extracted(number=2000, seed=1):
+    """Reads as extracted by nanoget, with 64-bit numbers and python strings."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "lengths": rng.integers(1, 100000, number),
+        "aligned_lengths": rng.integers(1, 100000, number),
+        "quals": rng.uniform(3, 20, number),
+        "percentIdentity": rng.uniform(80, 100, number),
+        "channelIDs": rng.integers(1, 512, number),
+        "mapQ": rng.integers(0, 61, number),
+        "readIDs": ["read{}".format(i) for i in range(number)],
+        "barcode": rng.choice(["barcode01", "barcode02"], number)})
+
+
+def test_compact_downcasts_columns():
+    df = compact(extracted())
+    assert df["lengths"].dtype == np.uint32
+    assert df["quals"].dtype == np.float32
+    assert df["channelIDs"].dtype == np.uint16
+    assert df["mapQ"].dtype == np.uint8
+    assert df["barcode"].dtype == "category"
+
+
+def test_compact_keeps_values_which_do_not_fit():
+    df = pd.DataFrame({"lengths": [1, 2**33], "channelIDs": [1.5, 2]})
+    compacted = compact(df.copy())
+    pd.testing.assert_frame_equal(compacted, df)
+
+
+def test_compact_leaves_stats_unchanged():
+    df = extracted()
+    before = StatsTable([ReadStats(exact=True).update(df)]).to_text()
+    after = StatsTable([ReadStats(exact=True).update(compact(df.copy()))]).to_text()
+    assert after == before
+
+
+def test_compact_leaves_barcode_stats_unchanged():
+    df = extracted()
+    names = list(df["barcode"].unique())
+    compacted = compact(df.copy())
+
+    def barcode_stats(data):
+        return StatsTable([ReadStats(exact=True).update(data.loc[data["barcode"] == b])
+                           for b in names], names=names).to_text()
+    assert barcode_stats(compacted) == barcode_stats(df)
+
+
+def test_compact_leaves_plotted_aggregates_unchanged():
+    from nanoplot.aggregates import LengthCounts, Histogram2D
+    from nanoplot.stream import LOG_LENGTH_EDGES, QUAL_EDGES
+
+    def aggregates(data):
+        lengths = LengthCounts()
+        lengths.update(data["lengths"])
+        grid = Histogram2D(LOG_LENGTH_EDGES, QUAL_EDGES)
+        grid.update(np.log10(data["lengths"]), data["quals"])
+        return lengths.distinct() + (grid.counts,)
+    df = extracted()
+    for compacted, original in zip(aggregates(compact(df.copy())), aggregates(df)):
+        np.testing.assert_array_equal(compacted, original)
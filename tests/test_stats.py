@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nanomath import nanomath
+from nanoplot.stats import ReadStats, StatsTable, merge_stats
+
+
+def reads(number, seed=1, **columns):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"lengths": rng.integers(1, 50000, number),
+                       "quals": rng.uniform(3, 20, number),
+                       "channelIDs": rng.integers(1, 512, number),
+                       "readIDs": ["read{}".format(i) for i in range(number)]})
+    if columns.get("aligned"):
+        df["aligned_lengths"] = (df["lengths"] * rng.uniform(0.8, 1, number)).astype(np.int64)
+        df["percentIdentity"] = rng.uniform(80, 100, number)
+    return df
+
+
+def nanomath_stats(tmp_path, dfs, names=[]):
+    nanomath.write_stats(dfs, str(tmp_path / "nanomath.txt"), names=names)
+    return (tmp_path / "nanomath.txt").read_text()
+
+
+@pytest.mark.parametrize("aligned", [False, True])
+def test_stats_equal_nanomath(tmp_path, aligned):
+    df = reads(1001, aligned=aligned)
+    table = StatsTable([ReadStats(exact=True).update(df)])
+    assert table.to_text() == nanomath_stats(tmp_path, [df])
+
+
+def test_barcode_stats_equal_nanomath(tmp_path):
+    df = reads(2000)
+    frames = [df.iloc[:700], df.iloc[700:1500], df.iloc[1500:]]
+    table = StatsTable([ReadStats(exact=True).update(f) for f in frames], names=["a", "b", "c"])
+    assert table.to_text() == nanomath_stats(tmp_path, frames, names=["a", "b", "c"])
+
+
+def test_merged_stats_equal_stats_of_all_reads():
+    df = reads(3000)
+    merged = merge_stats(ReadStats(exact=True).update(df.iloc[i:i + 1000])
+                         for i in range(0, 3000, 1000))
+    assert StatsTable([merged]).to_text() == \
+        StatsTable([ReadStats(exact=True).update(df)]).to_text()
+
+
+def test_chunked_stats_are_within_resolution():
+    df = reads(3000)
+    streamed = ReadStats()
+    for i in range(0, 3000, 700):
+        streamed.update(df.iloc[i:i + 700])
+    features = streamed.features()
+    exact = ReadStats(exact=True).update(df).features()
+    assert features["Median read quality"] == pytest.approx(exact["Median read quality"],
+                                                            abs=0.01)
+    for feature in ["Number of reads", "Total bases", "Median read length", "Read length N50",
+                    "Active channels"]:
+        assert features[feature] == exact[feature]
+    assert streamed.top5_lengths == ReadStats(exact=True).update(df).top5_lengths
+
+
+def test_top_5_ties_do_not_depend_on_order():
+    df = pd.DataFrame({"lengths": [10, 20, 20, 20, 20, 20, 20, 5],
+                       "quals": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]})
+    forward = ReadStats().update(df.iloc[:4]).merge(ReadStats().update(df.iloc[4:]))
+    backward = ReadStats().update(df.iloc[::-1])
+    assert forward.top5_lengths == backward.top5_lengths == \
+        [(20, 7.0), (20, 6.0), (20, 5.0), (20, 4.0), (20, 3.0)]
+
+
+def test_finished_stats_keep_features_and_drop_values():
+    df = reads(1000, aligned=True)
+    stats = ReadStats(exact=True).update(df)
+    features = stats.features()
+    stats.finish()
+    assert stats.quals.arrays == [] and stats.identities.arrays == []
+    assert stats.features() == features
+    with pytest.raises(ValueError):
+        stats.update(df)
@@ -0,0 +1,69 @@
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+from nanoplot.NanoPlot import get_args
+from nanoplot.filteroptions import filter_and_transform_data
+from nanoplot.grouping import BarcodeGroups
+from nanoplot.stats import ReadStats, StatsTable
+from nanoplot.stream import aggregate_summary, read_summary_chunks
+from nanoplot.summary import read_summary
+
+
+def write_summary(filename, number=3000, seed=1):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "read_id": ["read{}".format(i) for i in range(number)],
+        "channel": rng.integers(1, 512, number),
+        "start_time": np.sort(rng.uniform(100, 4 * 3600, number)),
+        "duration": rng.uniform(1, 10, number),
+        "sequence_length_template": rng.integers(0, 20000, number),
+        "mean_qscore_template": rng.uniform(3, 15, number),
+        "barcode_arrangement": rng.choice(["barcode05", "barcode01", "barcode03"], number)})
+    # all reads of barcode03 are removed by --minqual
+    df.loc[df["barcode_arrangement"] == "barcode03", "mean_qscore_template"] = 2
+    df.to_csv(filename, sep="\t", index=False)
+
+
+def assert_stats_equal(streamed, exact):
+    """Assert the streamed StatsTable equals the exact one, but for the median quality.
+
+    Streamed median qualities are accurate up to 0.01, which can change the rounded value
+    """
+    for s, e in zip(streamed.features, exact.features):
+        assert s.pop("Median read quality") == pytest.approx(e.pop("Median read quality"),
+                                                             abs=0.01)
+    assert streamed.to_text() == exact.to_text()
+
+
+@pytest.mark.parametrize("name", ["sequencing_summary.txt", "sequencing_summary.txt.gz"])
+@pytest.mark.parametrize("options", [[], ["--minqual", "4"], ["--runtime_from", "1"]])
+def test_streamed_stats_equal_in_memory(tmp_path, name, options):
+    filename = str(tmp_path / name)
+    write_summary(filename)
+    args = ["--summary", filename, "--barcoded"] + options
+    settings = vars(get_args(args))
+    groups = BarcodeGroups(read_summary([filename], barcoded=True, identifiers=True))
+    datadf, settings = filter_and_transform_data(groups.df, settings)
+    groups = BarcodeGroups(datadf)
+    expected = StatsTable([ReadStats(exact=True).update(df) for df in groups.frames()],
+                          names=groups.names)
+    run, barcodes = aggregate_summary(vars(get_args(args + ["--stream", "--chunksize", "700"])))
+    streamed = StatsTable([b.filtered_stats for b in barcodes.values()], names=list(barcodes))
+    assert_stats_equal(streamed, expected)
+    assert_stats_equal(StatsTable([run.filtered_stats]),
+                       StatsTable([ReadStats(exact=True).update(datadf)]))
+
+
+def test_reads_starting_before_the_first_chunks_start_at_zero(tmp_path, caplog):
+    filename = str(tmp_path / "sequencing_summary.txt")
+    write_summary(filename)
+    df = pd.read_csv(filename, sep="\t")
+    df.loc[2000, "start_time"] = 10
+    df.to_csv(filename, sep="\t", index=False)
+    with caplog.at_level(logging.WARNING):
+        chunks = list(read_summary_chunks([filename], chunksize=700))
+    start_times = pd.concat(chunks)["start_time"]
+    assert start_times.min() == pd.Timedelta(0)
+    assert (start_times == pd.Timedelta(0)).sum() == 2
+    assert "1 reads started before" in caplog.text
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nanoplot.summary import read_summary
+
+
+def write_summary(filename, number, seed=1):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "filename": "reads.fast5",
+        "read_id": ["read{}".format(i) for i in range(number)],
+        "channel": rng.integers(1, 512, number),
+        "start_time": rng.uniform(10, 3600, number).round(4),
+        "duration": rng.uniform(0.1, 10, number).round(4),
+        "num_events": rng.integers(100, 10000, number),
+        "sequence_length_template": rng.integers(0, 20000, number),
+        "mean_qscore_template": rng.uniform(3, 15, number).round(3),
+        "barcode_arrangement": rng.choice(["barcode01", "barcode02", "unclassified"], number)})
+    df.to_csv(filename, sep="\t", index=False)
+    return df
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_summary_equals_pandas(tmp_path, threads, monkeypatch):
+    import nanoplot.summary as summary
+    monkeypatch.setattr(summary, "PIECE_SIZE", 4096)  # many pieces
+    filename = str(tmp_path / "sequencing_summary.txt")
+    df = write_summary(filename, 1000)
+    df = df.loc[df["sequence_length_template"] != 0].reset_index(drop=True)
+    datadf = read_summary([filename], barcoded=True, identifiers=True, threads=threads)
+    np.testing.assert_array_equal(datadf["lengths"], df["sequence_length_template"])
+    np.testing.assert_array_equal(datadf["quals"], df["mean_qscore_template"])
+    np.testing.assert_array_equal(datadf["channelIDs"], df["channel"])
+    np.testing.assert_array_equal(datadf["readIDs"], df["read_id"])
+    np.testing.assert_array_equal(datadf["barcode"], df["barcode_arrangement"])
+    np.testing.assert_allclose(datadf["start_time"].dt.total_seconds(),
+                               df["start_time"] - df["start_time"].min())
+
+
+def test_compressed_summary_equals_uncompressed(tmp_path):
+    write_summary(str(tmp_path / "summary.txt"), 300)
+    pd.read_csv(str(tmp_path / "summary.txt"), sep="\t") \
+        .to_csv(str(tmp_path / "summary.txt.gz"), sep="\t", index=False)
+    pd.testing.assert_frame_equal(read_summary([str(tmp_path / "summary.txt.gz")]),
+                                  read_summary([str(tmp_path / "summary.txt")]))
+
+
+@pytest.mark.parametrize("content", ["", "read_id\tchannel\tstart_time\tduration\t"
+                                         "sequence_length_template\tmean_qscore_template\n"])
+def test_summary_without_reads_exits(tmp_path, content):
+    filename = tmp_path / "sequencing_summary.txt"
+    filename.write_text(content)
+    with pytest.raises(SystemExit, match="No reads found"):
+        read_summary([str(filename)])
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from nanoplot.filteroptions import started_before, started_after
+from nanoplot.timeindex import time_buckets
+
+
+def start_times():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"start_time": pd.to_timedelta(rng.uniform(0, 4 * 3600, 1000), unit="s"),
+                       "lengths": rng.integers(100, 10000, 1000)})
+    df.loc[::50, "start_time"] = pd.NaT
+    return df
+
+
+@pytest.mark.parametrize("hours", [0, 0.5, 1, 2.25, 10])
+def test_runtime_masks_keep_reads_without_start_time(hours):
+    df = start_times()
+    hours_in = df["start_time"].dt.total_seconds().values / 3600
+    missing = np.isnan(hours_in)
+    np.testing.assert_array_equal(started_before(df, hours), missing | (hours_in < hours))
+    np.testing.assert_array_equal(started_after(df, hours), missing | (hours_in >= hours))
+
+
+def test_time_buckets_skip_reads_without_start_time():
+    df = start_times()
+    buckets = time_buckets(df, width=600)
+    shown = df["start_time"].notna().values
+    assert buckets.reads.sum() == shown.sum()
+    assert buckets.bases.sum() == df["lengths"].values[shown].sum()
+    seconds = df["start_time"].dt.total_seconds().values[shown]
+    np.testing.assert_array_equal(
+        buckets.reads, np.bincount((seconds // 600).astype(np.int64)))
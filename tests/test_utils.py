@@ -0,0 +1,16 @@
+from nanoplot.utils import link_plot
+
+
+class Plot(object):
+    def __init__(self, path, title):
+        self.path = path
+        self.title = title
+
+
+def test_link_plot_escapes_paths_and_title(tmp_path):
+    plot = Plot(str(tmp_path / "a&b.png"), 'Length <"log">')
+    assert link_plot(plot, str(tmp_path)) == \
+        '<a href="a&amp;b.png"><img src="a&amp;b.png" loading="lazy" ' \
+        'alt="Length &lt;&quot;log&quot;&gt;"></a>'
+    assert link_plot(Plot(str(tmp_path / "a&b.pdf"), "pdf"), str(tmp_path)) == \
+        '<a href="a&amp;b.pdf">a&amp;b.pdf</a>'